@@ -0,0 +1,89 @@
+"""
+Benchmark: events/sec through the asyncio engine against the Twisted polling
+engine, both reading from a fake docker daemon on a unix socket
+
+The polling engine's poll is timed with docker-py decoding the events, and
+with rawEvents; the asyncio engine streams them with its own HTTP client.
+Both dispatch to the same handlers as codado.dockerish.bench.SampleOwner.
+
+    python bench/aio_throughput.py [count] [runs]
+"""
+from __future__ import print_function
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import docker
+
+from codado.dockerish.aio import AsyncDockerEngine
+from codado.dockerish.bench import SampleOwner, benchmark
+from codado.dockerish.fakedaemon import FakeDaemon
+from codado.dockerish.replay import synthesize
+
+
+def asyncOwner(path, count):
+    """
+    An owner of an AsyncDockerEngine with SampleOwner's handlers, which stops
+    after `count` events
+    """
+    class AsyncSampleOwner(object):
+        engine = AsyncDockerEngine(dockerHost='unix://' + path)
+        seen = 0
+
+        @engine.handler("container.start")
+        @engine.handler("container.die")
+        def onLifecycle(self, event):
+            event.actor.name
+
+        @engine.handler("container.health_status")
+        def onHealth(self, event):
+            event.actor.attributes.get('com.example.role')
+
+        @engine.defaultHandler
+        def onAnything(self, event):
+            if event.eventType == 'dockerish':
+                return
+            self.seen += 1
+            if self.seen == count:
+                self.engine.stop()
+
+    return AsyncSampleOwner()
+
+
+def twistedRate(path, count, raw):
+    client = docker.DockerClient(base_url='unix://' + path, version='1.41')
+    result = benchmark(SampleOwner(), client, timeHandlers=False, raw=raw)
+    assert result.events == count, result.events
+    return result.eventsPerSecond
+
+
+def asyncRate(path, count):
+    owner = asyncOwner(path, count)
+    start = time.perf_counter()
+    asyncio.run(owner.engine.run())
+    assert owner.seen == count, owner.seen
+    return count / (time.perf_counter() - start)
+
+
+def main(count=100000, runs=3):
+    # in the future, so they come after the asyncio engine's `since`
+    llEvents = synthesize(count, start=int(time.time()) + 3600)
+    path = os.path.join(tempfile.mkdtemp(), 'docker.sock')
+    stop = FakeDaemon(path, llEvents).runInThread()
+    try:
+        decoded = max(twistedRate(path, count, False) for n in range(runs))
+        raw = max(twistedRate(path, count, True) for n in range(runs))
+        aio = max(asyncRate(path, count) for n in range(runs))
+    finally:
+        stop()
+    print("%d events through a fake daemon, best of %d runs" % (count, runs))
+    print("  Twisted, polling:            %8.0f events/sec" % decoded)
+    print("  Twisted, polling, rawEvents: %8.0f events/sec" % raw)
+    print("  asyncio, streaming:          %8.0f events/sec" % aio)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
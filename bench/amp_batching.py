@@ -0,0 +1,64 @@
+"""
+Benchmark: small AMP calls/sec, one box per call against batches
+
+Makes `count` small calls over a TCP connection on the loopback interface,
+all issued at once, first with callRemote and then through a
+codado.tx.BatchingClient with each batch size, and reports the calls/sec
+of each.
+
+    python bench/amp_batching.py [count]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from twisted.internet import defer, endpoints, protocol, task
+from twisted.protocols import amp
+
+from codado import tx
+
+
+BATCH_SIZES = (10, 100, 500)
+
+
+class Add(amp.Command):
+    arguments = [(b'a', amp.Integer()), (b'b', amp.Integer())]
+    response = [(b'total', amp.Integer())]
+
+
+class Adder(amp.AMP):
+    @tx.batchResponder(Add)
+    def add(self, a, b):
+        return {'total': a + b}
+
+
+def callsPerSecond(call, count):
+    start = time.perf_counter()
+    d = defer.gatherResults([call(a=n, b=1) for n in range(count)])
+
+    def check(results):
+        assert [r['total'] for r in results] == list(range(1, count + 1))
+        return count / (time.perf_counter() - start)
+    return d.addCallback(check)
+
+
+@defer.inlineCallbacks
+def main(reactor, count=20000):
+    port = yield endpoints.TCP4ServerEndpoint(reactor, 0, interface='127.0.0.1'
+            ).listen(protocol.Factory.forProtocol(Adder))
+    client = yield endpoints.connectProtocol(endpoints.TCP4ClientEndpoint(
+        reactor, '127.0.0.1', port.getHost().port), amp.AMP())
+    print("%-24s %12s" % ('', 'calls/sec'))
+    rate = yield callsPerSecond(lambda **kw: client.callRemote(Add, **kw), count)
+    print("%-24s %12.0f" % ('callRemote', rate))
+    for size in BATCH_SIZES:
+        batching = tx.BatchingClient(client, Add, maxCalls=size)
+        rate = yield callsPerSecond(batching.callRemote, count)
+        print("%-24s %12.0f" % ('batches of %d' % size, rate))
+    client.transport.loseConnection()
+    yield port.stopListening()
+
+
+if __name__ == '__main__':
+    task.react(main, [int(a) for a in sys.argv[1:]])
@@ -0,0 +1,86 @@
+"""
+Benchmark: the binary AMP argument types against codado.tx.JSON
+
+Sends representative payloads through an AMP box with JSON (stdlib and
+orjson), MsgPack and, for numbers, NumericArray, reporting the bytes on the
+wire and the time to encode (build and serialize the box) and decode (parse
+it and convert the argument).
+
+    python bench/amp_binary.py [seconds per measurement]
+"""
+from __future__ import print_function
+
+import array
+import sys
+import timeit
+
+from twisted.protocols import amp
+
+from codado import tx
+
+
+def event(n):
+    return {'status': 'start', 'id': '%064x' % n, 'from': 'corydodt/noms',
+            'Type': 'container', 'Action': 'start', 'scope': 'local',
+            'Actor': {'ID': '%064x' % n, 'Attributes': {
+                'image': 'corydodt/noms', 'name': 'noms_%d' % n}},
+            'time': 1500000000 + n, 'timeNano': 1500000000000000000 + n}
+
+
+def payloads():
+    samples = [float(n) / 7 for n in range(100000)]
+    counters = list(range(0, 10000000, 10))
+    return [
+        ('one event', event(1), []),
+        ('1000 events', [event(n) for n in range(1000)], []),
+        ('100k doubles', samples, [
+            ('NumericArray(d)', tx.NumericArray('d'),
+                array.array('d', samples)),
+            ('NumericArray(d, view)', tx.NumericArray('d', view=True),
+                array.array('d', samples)),
+            ]),
+        ('1M int64s', counters, [
+            ('NumericArray(q)', tx.NumericArray('q'),
+                array.array('q', counters)),
+            ]),
+        ]
+
+
+def timeCall(fn, seconds):
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * seconds / max(elapsed, 1e-9)))
+    return min(timer.repeat(3, number)) / number
+
+
+def measure(argument, value, seconds):
+    class Send(amp.Command):
+        arguments = [(b'value', argument)]
+
+    def encode():
+        return Send.makeArguments({'value': value}, None).serialize()
+    wire = encode()
+
+    def decode():
+        [box] = amp.parseString(wire)
+        return Send.parseArguments(box, None)
+    return len(wire), timeCall(encode, seconds), timeCall(decode, seconds)
+
+
+def main(seconds=0.3):
+    types = [('JSON', tx.JSON()),
+            ('JSON(orjson, unsorted)', tx.JSON(sortKeys=False,
+                serializer=tx.FAST_SERIALIZER)),
+            ('MsgPack', tx.MsgPack())]
+    for label, value, extra in payloads():
+        print(label)
+        print("  %-24s %12s %12s %12s" % ('', 'bytes', 'encode us',
+            'decode us'))
+        for name, argument, v in [(n, a, value) for (n, a) in types] + extra:
+            size, enc, dec = measure(argument, v, seconds)
+            print("  %-24s %12d %12.1f %12.1f" % (name, size, enc * 1e6,
+                dec * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:]])
@@ -0,0 +1,73 @@
+"""
+Benchmark: sending JSON documents of every size through AMP
+
+Encodes a document of each size into an AMP box with codado.tx.JSON (in
+chunks, past AMP's 64KB limit on one value), serializes the box, then
+parses it and decodes the document again, reporting the throughput of each
+side.
+
+    python bench/amp_json.py [max size in MB]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from twisted.protocols import amp
+
+from codado.tx import JSON
+
+
+KB = 1024
+MB = 1024 * KB
+SIZES = (KB, 10 * KB, 100 * KB, MB, 10 * MB, 100 * MB)
+
+
+class Send(amp.Command):
+    arguments = [(b'doc', JSON())]
+
+
+def document(size):
+    """
+    A list of 1KB strings, about `size` bytes encoded
+    """
+    item = 'x' * 1018
+    return [item] * max(1, size // KB)
+
+
+def best(fn, runs):
+    times = []
+    for n in range(runs):
+        start = time.perf_counter()
+        ret = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), ret
+
+
+def main(maxMB=100):
+    print("    size  chunks     encode MB/s    decode MB/s")
+    for size in SIZES:
+        if size > maxMB * MB:
+            break
+        doc = document(size)
+        runs = max(1, min(100, 10 * MB // size))
+        encodeTime, wire = best(
+                lambda: Send.makeArguments({'doc': doc}, None).serialize(), runs)
+        def decode():
+            [box] = amp.parseString(wire)
+            return box, Send.parseArguments(box, None)
+        decodeTime, (box, got) = best(decode, runs)
+        assert got['doc'] == doc
+        megabytes = len(wire) / 1e6
+        print("%8s  %6d  %14.1f  %13.1f" % (label(size), len(box),
+            megabytes / encodeTime, megabytes / decodeTime))
+
+
+def label(size):
+    if size >= MB:
+        return '%dMB' % (size // MB)
+    return '%dKB' % (size // KB)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,74 @@
+"""
+Benchmark: codado.tx.JSON toString and fromString
+
+Times encoding and decoding small, medium and large documents with each
+serializer, with and without sorted keys, against the json.dumps(...,
+sort_keys=True) and json.loads that JSON used to call.
+
+    python bench/amp_json_codec.py [seconds per measurement]
+"""
+from __future__ import print_function
+
+import json
+import sys
+import timeit
+
+from codado import tx
+
+
+def documents():
+    event = {'status': 'start', 'id': 'c' * 64, 'from': 'corydodt/noms',
+            'Type': 'container', 'Action': 'start', 'scope': 'local',
+            'Actor': {'ID': 'c' * 64, 'Attributes': {
+                'image': 'corydodt/noms', 'name': 'noms_1'}},
+            'time': 1500000000, 'timeNano': 1500000000000000000}
+    return [
+        ('small', {'ok': True, 'count': 3, 'name': 'noms_1'}),
+        ('medium', event),
+        ('large', [dict(event, time=event['time'] + n) for n in range(1000)]),
+        ]
+
+
+def usPerCall(fn, seconds):
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(number, int(number * seconds / max(elapsed, 1e-9)))
+    return min(timer.repeat(3, number)) / number * 1e6
+
+
+class Legacy(object):
+    """
+    What JSON.toString and fromString did before serializers
+    """
+    def toString(self, val):
+        return json.dumps(val, sort_keys=True).encode('utf-8')
+
+    def fromString(self, val):
+        return json.loads(val)
+
+
+def main(seconds=0.2):
+    codecs = [
+        ('json.dumps(sort_keys=True)', Legacy()),
+        ('stdlib, sorted', tx.JSON()),
+        ('stdlib, unsorted', tx.JSON(sortKeys=False)),
+        ]
+    if tx.FAST_SERIALIZER is not tx.STDLIB_SERIALIZER:
+        codecs.extend([
+            ('orjson, sorted', tx.JSON(serializer=tx.FAST_SERIALIZER)),
+            ('orjson, unsorted', tx.JSON(sortKeys=False,
+                serializer=tx.FAST_SERIALIZER)),
+            ])
+    for label, doc in documents():
+        encoded = tx.JSON().toString(doc)
+        print("%s document, %d bytes" % (label, len(encoded)))
+        print("  %-28s %14s %14s" % ('', 'toString us', 'fromString us'))
+        for name, codec in codecs:
+            assert codec.fromString(codec.toString(doc)) == doc
+            print("  %-28s %14.2f %14.2f" % (name,
+                usPerCall(lambda: codec.toString(doc), seconds),
+                usPerCall(lambda: codec.fromString(encoded), seconds)))
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:]])
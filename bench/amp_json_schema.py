@@ -0,0 +1,85 @@
+"""
+Benchmark: the cost of checking JSON AMP arguments against a schema
+
+Parses a box carrying a typical docker event with codado.tx.JSON, without
+a schema and with one compiled by codado.schema, reporting the time per
+call of each and of the check alone.
+
+    python bench/amp_json_schema.py [seconds per measurement]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from twisted.protocols import amp
+
+from codado import tx
+
+
+SCHEMA = {
+    'type': 'object',
+    'required': ['id', 'Type', 'Action', 'Actor', 'timeNano'],
+    'properties': {
+        'status': {'type': 'string'},
+        'id': {'type': 'string', 'minLength': 64, 'maxLength': 64},
+        'from': {'type': 'string'},
+        'Type': {'enum': ['container', 'image', 'network', 'volume']},
+        'Action': {'type': 'string', 'minLength': 1},
+        'scope': {'enum': ['local', 'swarm']},
+        'Actor': {
+            'type': 'object',
+            'required': ['ID'],
+            'properties': {
+                'ID': {'type': 'string'},
+                'Attributes': {'type': 'object',
+                    'additionalProperties': {'type': 'string'}},
+                },
+            },
+        'time': {'type': 'integer', 'minimum': 0},
+        'timeNano': {'type': 'integer', 'minimum': 0},
+        },
+    'additionalProperties': False,
+    }
+
+
+def event():
+    return {'status': 'start', 'id': 'c' * 64, 'from': 'corydodt/noms',
+            'Type': 'container', 'Action': 'start', 'scope': 'local',
+            'Actor': {'ID': 'c' * 64, 'Attributes': {
+                'image': 'corydodt/noms', 'name': 'noms_1'}},
+            'time': 1500000000, 'timeNano': 1500000000000000000}
+
+
+def usPerCall(fn, seconds):
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(number, int(number * seconds / max(elapsed, 1e-9)))
+    return min(timer.repeat(3, number)) / number * 1e6
+
+
+def main(seconds=0.3):
+    doc = event()
+    results = []
+    for label, argument in [('no schema', tx.JSON()),
+            ('compiled schema', tx.JSON(schema=SCHEMA))]:
+        class Send(amp.Command):
+            arguments = [(b'doc', argument)]
+        wire = Send.makeArguments({'doc': doc}, None).serialize()
+
+        def decode():
+            [box] = amp.parseString(wire)
+            return Send.parseArguments(box, None)
+        assert decode() == {'doc': doc}
+        results.append((label, usPerCall(decode, seconds)))
+
+    validate = tx.JSON(schema=SCHEMA).validate
+    check = usPerCall(lambda: validate(doc), seconds)
+    print("%-20s %12s" % ('', 'us per call'))
+    for label, us in results:
+        print("%-20s %12.2f" % (label, us))
+    print("%-20s %12.2f" % ('the check alone', check))
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:]])
@@ -0,0 +1,64 @@
+"""
+Benchmark: dispatch with docker-py decoding the events, against the engine
+decoding the raw bytes itself (DockerEngine(rawEvents=True))
+
+Replays the same synthetic events through codado.dockerish.bench's sample
+owner both ways, taking the best of a few runs of each, and times decoding
+alone.
+
+    python bench/event_decoding.py [count] [runs]
+"""
+from __future__ import print_function
+
+import json
+import sys
+import time
+
+from codado.dockerish import decode
+from codado.dockerish.bench import SampleOwner, benchmark
+from codado.dockerish.replay import ReplayClient, dumpEvent, synthesize
+
+
+def dispatchRate(lines, raw, runs):
+    """
+    The fastest dispatch rate, in events/sec, of `runs` runs
+    """
+    return max(benchmark(SampleOwner(), ReplayClient(lines),
+        timeHandlers=False, raw=raw).eventsPerSecond for n in range(runs))
+
+
+def decodeRate(chunks, decodeAll, runs):
+    """
+    The fastest rate, in events/sec, at which `decodeAll` gets through
+    `chunks`
+    """
+    best = None
+    for n in range(runs):
+        start = time.perf_counter()
+        decodeAll(chunks)
+        took = time.perf_counter() - start
+        best = took if best is None else min(best, took)
+    return len(chunks) / best
+
+
+def main(count=100000, runs=5):
+    lines = [dumpEvent(e) for e in synthesize(count)]
+    chunks = [(line + '\n').encode('utf-8') for line in lines]
+    print("%d events, best of %d runs, decoding with %s" % (count, runs,
+        decode.PARSER))
+
+    stdlib = decodeRate(chunks, lambda cs: [json.loads(c) for c in cs], runs)
+    fast = decodeRate(chunks, lambda cs: list(decode.decodeStream(cs)), runs)
+    print("  decode, json per chunk:  %9.0f events/sec" % stdlib)
+    print("  decode, decodeStream:    %9.0f events/sec  (%.1fx)" % (fast,
+        fast / stdlib))
+
+    decoded = dispatchRate(lines, False, runs)
+    raw = dispatchRate(lines, True, runs)
+    print("  dispatch, decode=True:   %9.0f events/sec" % decoded)
+    print("  dispatch, rawEvents:     %9.0f events/sec  (%.1fx)" % (raw,
+        raw / decoded))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
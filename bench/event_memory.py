@@ -0,0 +1,115 @@
+"""
+Benchmark: memory used by a history of dockerish Events
+
+Compares the dict-based Event/EventActor layout that dockerish used to have
+with the current slotted layout, both as handlers see an event (keeping
+docker's raw actor dict to decode lazily) and as an EventHistory keeps it
+(compacted, without the actor's attributes). Counts everything the events
+keep allocated once the raw event dicts they came from are gone.
+
+    python bench/event_memory.py [count]
+"""
+from __future__ import print_function
+
+import sys
+import tracemalloc
+
+import attr
+
+from codado.dockerish.event import Event
+
+
+@attr.s
+class OldEventActor(object):
+    image = attr.ib()
+    name = attr.ib()
+    signal = attr.ib()
+    id = attr.ib()
+
+    @classmethod
+    def fromLowLevelActor(cls, dct):
+        a = dct['Attributes']
+        return cls(image=a.get('image'), name=a.get('name'),
+                signal=a.get('signal'), id=dct['ID'])
+
+
+@attr.s
+class OldEvent(object):
+    status = attr.ib()
+    id = attr.ib()
+    time = attr.ib()
+    timeNano = attr.ib()
+    actor = attr.ib(converter=OldEventActor.fromLowLevelActor)
+    action = attr.ib()
+    eventFrom = attr.ib()
+    eventType = attr.ib()
+    engine = attr.ib()
+
+
+def rawEvent(n):
+    """
+    A container event as docker-py decodes it
+    """
+    return {
+        "status": "start",
+        "id": "%064x" % n,
+        "from": "corydodt/noms",
+        "Type": "container",
+        "Action": "start",
+        "Actor": {"ID": "%064x" % n,
+                  "Attributes": {"image": "corydodt/noms", "name": "noms_%d" % n}},
+        "time": 1497218188 + n // 1000,
+        "timeNano": 1497218188361178103 + n,
+        }
+
+
+def old(raw):
+    return OldEvent(engine=None,
+        actor=raw['Actor'],
+        eventFrom=raw['from'],
+        eventType=raw['Type'],
+        action=raw['Action'],
+        id=raw['id'],
+        status=raw['status'],
+        time=raw['time'],
+        timeNano=raw['timeNano'])
+
+
+def dispatched(raw):
+    return Event.fromLowLevelEvent(None, raw)
+
+
+def kept(raw):
+    return Event.fromLowLevelEvent(None, raw).compact()
+
+
+def retained(build, count):
+    """
+    The bytes still allocated for `count` events made by `build`, once the
+    raw dicts they came from are dropped
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    raws = [rawEvent(n) for n in range(count)]
+    events = [build(r) for r in raws]
+    del raws
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(events) == count
+    return used
+
+
+def main(count=1000000):
+    print("%d events" % count)
+    base = None
+    for label, build in [('dict layout', old),
+            ('slotted, dispatched', dispatched),
+            ('slotted, in a history', kept)]:
+        used = retained(build, count)
+        base = base or used
+        print("  %-22s %8.1f MB  %5.0f B/event  %+4.0f%%" % (label, used / 1e6,
+            used / count, 100.0 * (used - base) / base))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
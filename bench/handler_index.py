@@ -0,0 +1,57 @@
+"""
+Benchmark: choosing the handlers for an event by their predicates
+
+Builds a HandlerIndex of `count` handlers, each for one image prefix or one
+label value, and times selecting the handlers for an event against calling
+every predicate in turn.
+
+    python bench/handler_index.py [events]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from codado.dockerish.match import HandlerIndex, Predicate
+
+
+def handlers(count):
+    ret = []
+    for n in range(count):
+        if n % 2:
+            predicate = Predicate(image='registry.example.com/app%d:' % n)
+        else:
+            predicate = Predicate(labels={'com.example.service': 'svc%d' % n})
+        ret.append(('handler%d' % n, predicate))
+    return ret
+
+
+def attributes(n, count):
+    return {'image': 'registry.example.com/app%d:latest' % (n % count | 1),
+            'name': 'c%d' % n,
+            'com.example.service': 'svc%d' % (n % count & ~1)}
+
+
+def timePerEvent(select, actors):
+    start = time.perf_counter()
+    for a in actors:
+        select(a)
+    return (time.perf_counter() - start) / len(actors)
+
+
+def main(events=20000):
+    print("handlers   indexed    every predicate")
+    for count in (10, 100, 1000, 10000):
+        hs = handlers(count)
+        index = HandlerIndex(hs)
+        actors = [attributes(n, count) for n in range(events)]
+        def checkAll(a):
+            return tuple(fn for (fn, p) in hs if p(a))
+        assert index.select(actors[3]) == checkAll(actors[3])
+        indexed = timePerEvent(index.select, actors)
+        every = timePerEvent(checkAll, actors[:max(100, events * 10 // count)])
+        print("%8d  %7.2fus  %10.2fus" % (count, indexed * 1e6, every * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
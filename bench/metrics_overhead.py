@@ -0,0 +1,46 @@
+"""
+Benchmark: the cost of DockerEngine metrics
+
+Dispatches the same synthetic events through codado.dockerish.bench's sample
+owner with metrics off, then with a MetricsRecorder, taking the best of a few
+runs of each. The sample handlers do next to nothing, so the overhead here is
+the worst case; the cost per event is what matters against real handlers.
+
+    python bench/metrics_overhead.py [count] [runs]
+"""
+from __future__ import print_function
+
+import sys
+
+from codado.dockerish.bench import SampleOwner, benchmark
+from codado.dockerish.metrics import MetricsRecorder, renderPrometheus
+from codado.dockerish.replay import ReplayClient, dumpEvent, synthesize
+
+
+def best(lines, metrics, runs):
+    """
+    The fastest dispatch rate, in events/sec, of `runs` runs
+    """
+    SampleOwner.engine.metrics = metrics
+    try:
+        return max(benchmark(SampleOwner(), ReplayClient(lines),
+            timeHandlers=False).eventsPerSecond for n in range(runs))
+    finally:
+        SampleOwner.engine.metrics = None
+
+
+def main(count=100000, runs=5):
+    lines = [dumpEvent(e) for e in synthesize(count)]
+    off = best(lines, None, runs)
+    recorder = MetricsRecorder()
+    on = best(lines, recorder, runs)
+    print("%d events, best of %d runs" % (count, runs))
+    print("  metrics off: %8.0f events/sec" % off)
+    print("  metrics on:  %8.0f events/sec" % on)
+    print("  overhead: %.1f%%, %.2fus/event" % (100.0 * (off - on) / off,
+        (1.0 / on - 1.0 / off) * 1e6))
+    print("  prometheus text: %d bytes" % len(renderPrometheus(recorder.snapshot())))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
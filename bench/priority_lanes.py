@@ -0,0 +1,86 @@
+"""
+Benchmark: how long critical events wait behind a storm of exec events
+
+Dispatches one large sample, mostly health check exec events with a few
+container.die events among them, as a poll of a busy daemon returns it. The
+exec handler does a little work for each event. Reports how long after the
+sample arrived each die event reached its handler, in arrival order and
+with container.die in a higher priority lane.
+
+    python bench/priority_lanes.py [count] [dies]
+"""
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+from codado.dockerish.event import DockerEngine, EventCursor
+from codado.dockerish.replay import synthesize
+
+
+def storm(count, dies):
+    """
+    `count` exec events, with `dies` container.die events spread among them
+    """
+    llEvents = [e for e in synthesize(count * 2)
+            if e['Action'].startswith('exec_')][:count]
+    every = count // dies
+    ret = []
+    for n, llEvent in enumerate(llEvents):
+        ret.append(llEvent)
+        if n % every == 0 and n // every < dies:
+            ret.append(dict(llEvent, status='die', Action='die',
+                timeNano=llEvent['timeNano'] + 1))
+    return ret
+
+
+def latencies(llEvents, priorities):
+    """
+    The seconds from the sample arriving to each container.die reaching its
+    handler
+    """
+    clock = time.perf_counter
+    seen = []
+
+    class Monitor(object):
+        engine = DockerEngine(priorities=priorities)
+
+        @engine.handler("container.die")
+        def onDie(self, event):
+            seen.append(clock() - start)
+
+        @engine.handler("container.exec_create")
+        @engine.handler("container.exec_start")
+        @engine.handler("container.exec_die")
+        def onExec(self, event):
+            sum(range(100))
+
+    engine = Monitor().engine
+    engine.cursor = EventCursor()
+    engine._backlog = engine._newBacklog()
+    engine._flowing = threading.Event()
+    engine._handOffLock = threading.Lock()
+    engine._compileHandlers()
+    sample = [dict(e) for e in llEvents]
+    start = clock()
+    engine._dispatchBatch(sample)
+    return seen
+
+
+def main(count=100000, dies=100):
+    llEvents = storm(count, dies)
+    print("%d exec events, %d container.die" % (count, dies))
+    print("                  mean die latency   max die latency")
+    for label, priorities in [
+            ('arrival order', {}),
+            ('priority lanes', {'container.die': 1, 'container.exec_*': -1}),
+            ]:
+        seen = latencies(llEvents, priorities)
+        assert len(seen) == dies
+        print("%-16s  %14.2fms  %14.2fms" % (label,
+            sum(seen) / len(seen) * 1e3, max(seen) * 1e3))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -10,11 +10,9 @@ from codado.dockerish import DockerEngine
 class NomsMourner(object):
     engine = DockerEngine()
 
-    @engine.handler("die")
+    @engine.handler("container.die", image='corydodt/noms')
     def onDie(self, event):
-        if event.imageFrom.startswith('corydodt/noms'):
-            print "Sadness, noms shut down"
-            event.log()
+        print("Sadness, noms shut down")
 
 engine.run()
 """
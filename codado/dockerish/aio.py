@@ -0,0 +1,301 @@
+"""
+A DockerEngine for asyncio programs
+
+    class Monitor(object):
+        engine = AsyncDockerEngine()
+
+        @engine.handler("container.die")
+        async def onDie(self, event):
+            container = await event.fetchContainer()
+            ...
+
+    await Monitor().engine.run()
+
+Handlers are registered exactly as for DockerEngine, and see the same Event
+objects. The engine reads the events stream from the docker socket itself,
+without blocking, and runs coroutine handlers as tasks on the running loop.
+
+    async for event in engine.events():
+        ...
+
+iterates over the Events without any handlers.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import os
+import time
+from urllib.parse import urlencode, urlsplit
+
+from builtins import object
+
+import attr
+
+from twisted.internet import error
+from twisted.python import failure, log
+
+from codado.dockerish.decode import loads
+from codado.dockerish.event import DockerEngine, Event, EventCursor
+
+
+DEFAULT_DOCKER_HOST = 'unix:///var/run/docker.sock'
+
+# bytes read from the socket at a time
+READ_SIZE = 65536
+
+
+class DaemonError(Exception):
+    """
+    The docker daemon answered with an error
+    """
+
+
+@attr.s
+class DelayedCall(object):
+    """
+    The handle of an AsyncDockerEngine.callLater, which, like Twisted's, can
+    say whether it is still to come
+    """
+    handle = attr.ib(default=None)
+    called = attr.ib(default=False)
+
+    def active(self):
+        return not (self.called or self.handle.cancelled())
+
+    def cancel(self):
+        self.handle.cancel()
+
+
+def dockerAddress(dockerHost=None):
+    """
+    Where to connect for DOCKER_HOST `dockerHost`: ('unix', path) or
+    ('tcp', (host, port))
+    """
+    url = urlsplit(dockerHost or os.environ.get('DOCKER_HOST') or DEFAULT_DOCKER_HOST)
+    if url.scheme == 'unix':
+        return ('unix', url.path)
+    if url.scheme == 'tcp':
+        return ('tcp', (url.hostname, url.port or 2375))
+    raise ValueError("Can't connect to docker at %r" % dockerHost)
+
+
+async def readHead(reader):
+    """
+    Read the status line and headers of a response from `reader`, returning
+    the headers, or raise DaemonError if it isn't a 200
+    """
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = dict((k.strip().lower(), v.strip()) for (k, v) in
+            (line.split(':', 1) for line in lines[1:] if line))
+    if status != 200:
+        body = await reader.read()
+        raise DaemonError(status, body.decode('utf-8', 'replace').strip())
+    return headers
+
+
+async def readEvents(reader, headers=None):
+    """
+    Yield the raw event dicts in the body of an events response from
+    `reader`, chunked or not. Pass the `headers` if readHead already read
+    them.
+    """
+    if headers is None:
+        headers = await readHead(reader)
+    chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+    partial = b''
+    while True:
+        if chunked:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                return
+            data = await reader.readexactly(size + 2)
+            data = data[:-2]
+        else:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+        data = partial + data
+        lines = data.split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield loads(line)
+    if partial.strip():
+        yield loads(partial)
+
+
+@attr.s
+class AsyncDockerEngine(DockerEngine):
+    """
+    A DockerEngine that runs on the running asyncio loop instead of the
+    Twisted reactor.
+
+    `dockerHost` is where the daemon is, like DOCKER_HOST, which it defaults
+    to: "unix:///var/run/docker.sock" or "tcp://host:port" (without TLS).
+    The docker client for lookups (Event.container etc.) comes from
+    `clientFactory`, as for DockerEngine; Event.fetch* lookups run in the
+    loop's default executor and can be awaited.
+
+    Events are always streamed. Handlers may be coroutine functions, and may
+    coalesce, but can't be queued with `concurrency` or `queueSize`, and the
+    engine can't report `metrics`, as those are built on Deferreds. Events
+    are dispatched as they arrive, so there are no `priorities`.
+    """
+    dockerHost = attr.ib(default=None)
+
+    async def run(self):
+        """
+        Dispatch docker events to handlers until stop()
+        """
+        self._start()
+        since = self.cursor.since(time.time())
+        self._callHandlers('dockerish.init', self.initEvent(time.time()))
+        if self.reconcile:
+            await self._reconcileAsync()
+        async for llEvent in self._readEvents(since):
+            self._dispatch(llEvent)
+        await self._settle()
+
+    async def events(self):
+        """
+        Yield each docker event, as an Event, until stop()
+        """
+        self._start()
+        async for llEvent in self._readEvents(self.cursor.since(time.time())):
+            yield Event.fromLowLevelEvent(self, llEvent)
+
+    def _start(self):
+        for options in self.handlerOptions.values():
+            if 'concurrency' in options or 'queueSize' in options:
+                raise ValueError(
+                        "AsyncDockerEngine handlers can't have a concurrency or queueSize")
+        if self.metrics is not None:
+            raise ValueError("AsyncDockerEngine can't report metrics")
+        if self.priorities:
+            raise ValueError(
+                    "AsyncDockerEngine dispatches events as they arrive, without priorities")
+        self._loop = asyncio.get_running_loop()
+        self._tasks = set()
+        self.health = self._newHealth()
+        self.client = self.clientFactory() if self.clientFactory else None
+        self.cursor = EventCursor()
+        if self.checkpoint is not None:
+            self.cursor = self.checkpoint.load() or self.cursor
+            self.dispatched = EventCursor(self.cursor.timeNano, set(self.cursor.seen))
+        self.running = True
+        self._compileHandlers()
+
+    async def _readEvents(self, since):
+        """
+        Yield raw events from the daemon from `since`, opening the events
+        stream again from the last one seen when it drops, after a backoff,
+        until stop()
+        """
+        cursor = self.cursor
+        backoff = self.health.backoff
+        while self.running:
+            writer = None
+            try:
+                reader, writer = await self._request('/events', {
+                    'since': cursor.since(since),
+                    'filters': json.dumps(self._filters or {}),
+                    })
+                self._stream = writer
+                headers = await readHead(reader)
+                backoff.reset()
+                self._regained(None)
+                async for llEvent in readEvents(reader, headers):
+                    if not self.running:
+                        # what was read before stop()
+                        break
+                    if cursor.advance(llEvent):
+                        yield llEvent
+                reason = failure.Failure(
+                        error.ConnectionDone("The docker event stream ended"))
+            except Exception:
+                reason = failure.Failure()
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            # stop() hangs up on the daemon
+            if self.running:
+                self._lost(None, reason)
+                await asyncio.sleep(backoff.next())
+
+    async def _request(self, path, query):
+        """
+        Send GET `path` to the daemon, returning the reader and writer of the
+        connection
+        """
+        kind, address = dockerAddress(self.dockerHost)
+        if kind == 'unix':
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            reader, writer = await asyncio.open_connection(*address)
+        writer.write(('GET %s?%s HTTP/1.1\r\nHost: docker\r\n'
+            'Accept: application/json\r\n\r\n' % (path, urlencode(query))
+            ).encode('ascii'))
+        return reader, writer
+
+    async def _reconcileAsync(self):
+        """
+        Dispatch synthetic events for the docker objects that already exist,
+        as DockerEngine does
+        """
+        try:
+            existing = await self.deferToThread(self._listExisting)
+            if self.resourceCache is not None:
+                sem = asyncio.Semaphore(self.reconcileConcurrency)
+                async def inspect(obj):
+                    key = ('container', obj.id)
+                    generation = self.resourceCache.generation(key)
+                    async with sem:
+                        await self.deferToThread(obj.reload)
+                    self.resourceCache.put(key, obj, generation)
+                await asyncio.gather(*[inspect(obj) for (obj, llEvent) in existing
+                        if llEvent['Type'] == 'container'])
+            self._dispatchExisting(existing)
+        except Exception:
+            log.err(None, "Reconciling existing docker objects failed")
+
+    async def _settle(self):
+        """
+        Wait for the handlers that are still running
+        """
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def callLater(self, delay, f, *a, **kw):
+        call = DelayedCall()
+        def fire():
+            call.called = True
+            f(*a, **kw)
+        call.handle = self._loop.call_later(delay, fire)
+        return call
+
+    def deferToThread(self, f, *a, **kw):
+        """
+        Call f(*a, **kw) in the loop's default executor, returning an
+        awaitable of the result
+        """
+        return self._loop.run_in_executor(None, functools.partial(f, *a, **kw))
+
+    def _watch(self, name, result):
+        """
+        Run what a coroutine handler returned as a task, logging its failure
+        """
+        if not inspect.isawaitable(result):
+            return None
+        task = asyncio.ensure_future(result, loop=self._loop)
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._finished, name))
+        return task
+
+    def _finished(self, name, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.err(task.exception(), "Handler %r failed" % name)
@@ -0,0 +1,177 @@
+"""
+Measure DockerEngine dispatch against recorded events, without docker
+
+    python -m codado.dockerish.bench [--owner module:Class] [recording]
+
+With no recording, a synthetic one is used. Reports events/sec through the
+engine, and the latency of each handler.
+"""
+from __future__ import print_function
+
+import functools
+import importlib
+import time
+
+from builtins import object
+
+import attr
+
+from codado.tx import CLIError, Main
+from codado.dockerish.decode import decodeStream
+from codado.dockerish.event import DockerEngine, EventCursor
+from codado.dockerish.match import HandlerIndex
+from codado.dockerish.replay import ReplayClient, dumpEvent, synthesize
+
+
+class SampleOwner(object):
+    """
+    A DockerEngine owner with the handlers a typical monitor has
+    """
+    engine = DockerEngine()
+
+    @engine.handler("container.start")
+    @engine.handler("container.die")
+    def onLifecycle(self, event):
+        event.actor.name
+
+    @engine.handler("container.health_status")
+    def onHealth(self, event):
+        event.actor.attributes.get('com.example.role')
+
+    @engine.defaultHandler
+    def onAnything(self, event):
+        event.name
+
+
+@attr.s
+class HandlerTiming(object):
+    """
+    Latencies of one handler, in seconds
+    """
+    name = attr.ib()
+    samples = attr.ib(default=attr.Factory(list))
+
+    def percentile(self, p):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    @property
+    def mean(self):
+        return sum(self.samples) / len(self.samples)
+
+
+@attr.s
+class BenchmarkResult(object):
+    events = attr.ib()
+    seconds = attr.ib()
+    handlers = attr.ib()
+
+    @property
+    def eventsPerSecond(self):
+        return self.events / self.seconds
+
+    def report(self):
+        lines = ["%d events in %.3fs: %.0f events/sec" % (
+            self.events, self.seconds, self.eventsPerSecond)]
+        for h in sorted(self.handlers.values(), key=lambda h: h.name):
+            lines.append("  %-24s %8d calls  mean %7.2fus  p50 %7.2fus  p99 %7.2fus" % (
+                h.name, len(h.samples), h.mean * 1e6,
+                h.percentile(0.5) * 1e6, h.percentile(0.99) * 1e6))
+        return '\n'.join(lines)
+
+
+def _timed(fn, timing, clock):
+    @functools.wraps(fn)
+    def timedHandler(event):
+        start = clock()
+        try:
+            return fn(event)
+        finally:
+            timing.samples.append(clock() - start)
+    return timedHandler
+
+
+def benchmark(owner, client, timeHandlers=True, clock=time.perf_counter,
+        raw=False):
+    """
+    Dispatch every event from `client` (a ReplayClient) through the engine of
+    `owner`, as fast as possible, and time it. With `raw`, read the bytes of
+    the events and decode them as DockerEngine(rawEvents=True) does.
+    """
+    engine = owner.engine
+    engine.client = client
+    engine.cursor = EventCursor()
+    engine._compileHandlers()
+
+    timings = {}
+
+    def wrap(fn):
+        timing = timings.setdefault(fn.__name__, HandlerTiming(fn.__name__))
+        return _timed(fn, timing, clock)
+
+    if timeHandlers:
+        for eventName, fns in list(engine._dispatchTable.items()):
+            if isinstance(fns, HandlerIndex):
+                fns = fns.wrapped(wrap)
+            else:
+                fns = tuple(wrap(fn) for fn in fns)
+            engine._dispatchTable[eventName] = fns
+
+    count = 0
+    start = clock()
+    llEvents = client.events(decode=not raw, filters=engine._filters)
+    if raw:
+        llEvents = decodeStream(llEvents)
+    for llEvent in llEvents:
+        if engine.cursor.advance(llEvent):
+            engine._dispatch(llEvent)
+            count += 1
+    return BenchmarkResult(count, clock() - start,
+            dict((k, v) for (k, v) in timings.items() if v.samples))
+
+
+def loadOwner(spec):
+    """
+    Import and instantiate "module:Class"
+    """
+    moduleName, className = spec.split(':')
+    return getattr(importlib.import_module(moduleName), className)()
+
+
+class Options(Main):
+    """
+    Measure DockerEngine dispatch against recorded events
+    """
+    synopsis = "[options] [recording]"
+    optParameters = [
+        ['owner', 'o', None, 'module:Class of the DockerEngine owner to benchmark'],
+        ['synthetic', 's', '100000', 'With no recording, the number of synthetic events'],
+        ['min-rate', None, None, 'Fail if dispatch is slower than this many events/sec'],
+        ]
+    optFlags = [
+        ['no-handler-timing', None, "Don't time each handler"],
+        ['raw', None, "Decode the bytes of each event, as with rawEvents=True"],
+        ]
+
+    def parseArgs(self, recording=None):
+        self['recording'] = recording
+
+    def postOptions(self):
+        if self['recording']:
+            client = ReplayClient.fromFile(self['recording'])
+        else:
+            client = ReplayClient([dumpEvent(e)
+                for e in synthesize(int(self['synthetic']))])
+
+        owner = loadOwner(self['owner']) if self['owner'] else SampleOwner()
+        result = benchmark(owner, client,
+                timeHandlers=not self['no-handler-timing'], raw=self['raw'])
+        print(result.report())
+        if self['min-rate'] and result.eventsPerSecond < float(self['min-rate']):
+            raise CLIError('bench', 1, "dispatch rate %.0f/sec is below %s/sec" % (
+                result.eventsPerSecond, self['min-rate']))
+
+
+if __name__ == '__main__':  # pragma: nocover
+    import sys
+    sys.exit(Options.main())
@@ -0,0 +1,175 @@
+"""
+Cache the docker-py objects that events refer to
+"""
+from collections import OrderedDict
+import threading
+import time
+
+from builtins import object
+
+import attr
+
+
+DEFAULT_TTL_SECONDS = 30.0
+
+DEFAULT_MAX_SIZE = 1024
+
+
+# When the engine sees one of these events, the cached object of the given
+# kind for the event's actor is stale
+INVALIDATING_EVENTS = {
+    'container.create': 'container',
+    'container.destroy': 'container',
+    'container.die': 'container',
+    'container.health_status': 'container',
+    'container.kill': 'container',
+    'container.oom': 'container',
+    'container.pause': 'container',
+    'container.rename': 'container',
+    'container.restart': 'container',
+    'container.start': 'container',
+    'container.stop': 'container',
+    'container.unpause': 'container',
+    'container.update': 'container',
+
+    'image.delete': 'image',
+    'image.import': 'image',
+    'image.load': 'image',
+    'image.pull': 'image',
+    'image.tag': 'image',
+    'image.untag': 'image',
+
+    'plugin.install': 'plugin',
+    'plugin.enable': 'plugin',
+    'plugin.disable': 'plugin',
+    'plugin.remove': 'plugin',
+
+    'volume.create': 'volume',
+    'volume.destroy': 'volume',
+
+    'network.create': 'network',
+    'network.connect': 'network',
+    'network.disconnect': 'network',
+    'network.destroy': 'network',
+}
+
+
+def resourceKey(kind, actor):
+    """
+    The value that docker-py looks up an object of type `kind` by, for the
+    event actor `actor`
+    """
+    if kind in ('image', 'plugin'):
+        return actor.name
+    return actor.id
+
+
+def invalidatedKeys(dct):
+    """
+    The cache keys made stale by the raw docker-py event `dct`
+    """
+    name = '%s.%s' % (dct.get('Type'), dct.get('Action', '').split(':')[0])
+    kind = INVALIDATING_EVENTS.get(name)
+    if kind is None:
+        return []
+
+    actor = dct.get('Actor', {})
+    attributes = actor.get('Attributes') or {}
+    keys = [(kind, actor.get('ID'))]
+    if kind in ('image', 'plugin'):
+        # looked up by name, but tags and deletes may name the image by id
+        keys.append((kind, attributes.get('name')))
+    if kind == 'network' and 'container' in attributes:
+        # connect/disconnect change the container's NetworkSettings too
+        keys.append(('container', attributes['container']))
+    return keys
+
+
+@attr.s
+class ResourceCache(object):
+    """
+    A thread-safe LRU cache of docker-py objects with a time-to-live, keyed by
+    (kind, id) tuples.
+
+    Holds at most `maxSize` objects, each for at most `ttl` seconds.
+    DockerEngine evicts entries itself when events make them stale.
+
+    A lookup that may race with an eviction takes the key's generation()
+    before it starts and passes it to put(), which then does nothing if the
+    key was evicted in the meantime.
+    """
+    ttl = attr.ib(default=DEFAULT_TTL_SECONDS)
+    maxSize = attr.ib(default=DEFAULT_MAX_SIZE)
+    _entries = attr.ib(default=attr.Factory(OrderedDict), init=False, repr=False)
+    _lock = attr.ib(default=attr.Factory(threading.Lock), init=False, repr=False)
+    # when each recently evicted key was evicted, by count of evictions; keys
+    # evicted longer ago than that all count as evicted at `_forgotten`
+    _evictions = attr.ib(default=attr.Factory(OrderedDict), init=False, repr=False)
+    _evictionCount = attr.ib(default=0, init=False, repr=False)
+    _forgotten = attr.ib(default=0, init=False, repr=False)
+
+    clock = staticmethod(time.monotonic)
+
+    def get(self, key):
+        """
+        The cached object for `key`, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def generation(self, key):
+        """
+        A token that changes whenever `key` is evicted
+        """
+        with self._lock:
+            return self._evictions.get(key, self._forgotten)
+
+    def put(self, key, value, generation=None):
+        """
+        Cache `value` under `key`, pushing out the least recently used entry if
+        the cache is full.
+
+        With a `generation`, do nothing if `key` has been evicted since that
+        generation was taken, as `value` may be stale.
+        """
+        with self._lock:
+            if generation is not None and generation != self._evictions.get(
+                    key, self._forgotten):
+                return
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def evict(self, key):
+        """
+        Forget `key`, if it is cached
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._evictionCount += 1
+            self._evictions.pop(key, None)
+            self._evictions[key] = self._evictionCount
+            while len(self._evictions) > self.maxSize:
+                _, self._forgotten = self._evictions.popitem(last=False)
+
+    def clear(self):
+        """
+        Forget everything
+        """
+        with self._lock:
+            self._entries.clear()
+            self._evictions.clear()
+            self._evictionCount += 1
+            self._forgotten = self._evictionCount
+
+    def __len__(self):
+        return len(self._entries)
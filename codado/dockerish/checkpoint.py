@@ -0,0 +1,72 @@
+"""
+Remember where a DockerEngine got to in the docker event stream, so a
+restarted engine can pick up where it left off
+"""
+import json
+import os
+
+from builtins import object
+
+import attr
+
+from zope.interface import Interface, implementer
+
+from codado.dockerish.event import EventCursor
+
+
+class ICheckpointStore(Interface):
+    """
+    Somewhere to keep an EventCursor between runs of a DockerEngine.
+
+    Implement this to keep checkpoints somewhere other than a local file.
+    """
+    def load():
+        """
+        The saved EventCursor, or None if nothing has been saved
+        """
+
+    def save(cursor):
+        """
+        Replace the saved EventCursor with `cursor`
+        """
+
+
+@implementer(ICheckpointStore)
+@attr.s
+class FileCheckpointStore(object):
+    """
+    Keep the checkpoint as a small JSON file at `path`.
+
+    Saving writes a temporary file next to `path` and renames it into place,
+    so a crash leaves either the old checkpoint or the new one, never a torn
+    file.
+    """
+    path = attr.ib()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError):
+            return None
+
+        return EventCursor(
+                timeNano=data['timeNano'],
+                seen=set(tuple(key) for key in data['seen']),
+                ahead=set((timeNano, tuple(key))
+                    for (timeNano, key) in data.get('ahead', ())))
+
+    def save(self, cursor):
+        data = {
+            'timeNano': cursor.timeNano,
+            # ids may be None, which doesn't sort against strings
+            'seen': sorted((list(key) for key in cursor.seen), key=repr),
+            'ahead': sorted(([timeNano, list(key)]
+                for (timeNano, key) in cursor.ahead), key=repr),
+            }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
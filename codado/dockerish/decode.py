@@ -0,0 +1,49 @@
+"""
+Decode the raw bytes of a docker events stream
+
+docker-py's `client.events(decode=True)` decodes each chunk it reads with the
+stdlib json module. With `decode=False` it hands over the chunks as they came
+off the socket; decodeStream splits them into lines in bulk and decodes each
+line with orjson when it is installed.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: nocover
+    orjson = None
+
+
+if orjson is not None:
+    loads = orjson.loads
+    PARSER = 'orjson'
+else:  # pragma: nocover
+    loads = json.loads
+    PARSER = 'json'
+
+
+def decodeStream(chunks, loads=loads):
+    """
+    Yield the raw event dict of each line in `chunks`, an iterable of bytes
+    that may hold any number of lines, or part of one
+    """
+    partial = b''
+    for chunk in chunks:
+        if partial:
+            chunk = partial + chunk
+        last = chunk.rfind(b'\n')
+        if last < 0:
+            partial = chunk
+            continue
+        partial = chunk[last + 1:]
+        if not partial and chunk.find(b'\n') == last:
+            # the usual case, one whole event per chunk; the parser doesn't
+            # mind the newline
+            if not chunk.isspace():
+                yield loads(chunk)
+            continue
+        for line in chunk[:last].split(b'\n'):
+            if line.strip():
+                yield loads(line)
+    if partial.strip():
+        yield loads(partial)
@@ -3,16 +3,30 @@ Publish docker events
 """
 from __future__ import print_function
 
+import fnmatch
+import random
+import threading
 import time
+from collections import deque
 
 from builtins import object
 
 import attr
 
-from twisted.internet import reactor
+from twisted.internet import defer, error, reactor, threads
+from twisted.python import failure, log, threadpool
 
 import docker
 
+from codado.dockerish.cache import (
+        INVALIDATING_EVENTS, invalidatedKeys, resourceKey)
+from codado.dockerish.decode import decodeStream
+from codado.dockerish.flow import (
+        HANDLER_QUEUE_SIZE, STARVATION_LIMIT, Coalescer, HandlerQueue,
+        PriorityBacklog, watch)
+from codado.dockerish.match import HandlerIndex, Predicate
+from codado.dockerish.metrics import metered
+
 
 ALL_EVENTS = '__all_events__'
 
@@ -27,6 +41,7 @@ VALID_EVENTS = (
     'container.die',
     'container.exec_create',
     'container.exec_detach',
+    'container.exec_die',
     'container.exec_start',
     'container.export',
     'container.health_status',
@@ -68,21 +83,56 @@ VALID_EVENTS = (
 
     'daemon.reload',
 
-    # special event specific to the dockerish framework itself
+    # special events specific to the dockerish framework itself
     'dockerish.init',
+    'dockerish.disconnected',
+    'dockerish.reconnected',
 )
 
+# handlers may also listen for a whole category of events, e.g. `container.*`
+WILDCARD_EVENTS = tuple(sorted(set(
+    name.split('.')[0] + '.*' for name in VALID_EVENTS if name != ALL_EVENTS)))
 
-@attr.s
+
+def lookupResource(client, kind, actor):
+    """
+    Ask the docker daemon for the object of type `kind` that `actor` refers to
+    """
+    if kind == 'container':
+        try:
+            return client.containers.get(actor.id)
+        except docker.errors.NotFound:
+            # This mainly happens when a container dies or is destroyed
+            return None
+    if kind == 'image':
+        return client.images.get(actor.name)
+    if kind == 'plugin':
+        return client.plugins.get(actor.name)
+    if kind == 'volume':
+        return client.volumes.get(actor.id)
+    if kind == 'network':
+        try:
+            return client.networks.get(actor.id)
+        except docker.errors.NotFound:
+            # This mainly happens when a network is destroyed
+            return None
+    raise ValueError("%r is not a docker resource type" % kind)
+
+
+@attr.s(slots=True)
 class EventActor(object):
     """
     The source of the event, e.g. the container for a start event or the image
     for a pull event.
+
+    `attributes` is docker's own dict of everything it knows about the actor,
+    including container labels.
     """
     image = attr.ib()
     name = attr.ib()
     signal = attr.ib()
     id = attr.ib()
+    attributes = attr.ib(default=None, eq=False, repr=False)
 
     @classmethod
     def fromLowLevelActor(cls, dct):
@@ -101,62 +151,132 @@ class EventActor(object):
                 image=a.get('image', None),
                 name=a.get('name', None),
                 signal=a.get('signal', None),
-                id=id)
+                id=id,
+                attributes=a)
 
 
-@attr.s
+@attr.s(slots=True)
 class Event(object):
     """
     A generic docker event, constructed from the dict returned by docker-py
+
+    Events are slotted, so a long history of them stays small. The actor is
+    kept as docker's raw dict until something asks for `.actor`; compact()
+    lets it go.
     """
     status = attr.ib()
     id = attr.ib()
     time = attr.ib()
     timeNano = attr.ib()
-    actor = attr.ib(converter=EventActor.fromLowLevelActor)
+    _actor = attr.ib(eq=EventActor.fromLowLevelActor)
     action = attr.ib()
     eventFrom = attr.ib()
     eventType = attr.ib()
     engine = attr.ib()
+    scope = attr.ib(default=None)
+    host = attr.ib(default=None)
+
+    @property
+    def actor(self):
+        """
+        The EventActor, decoded from the raw dict the first time it is needed
+        """
+        actor = self._actor
+        if not isinstance(actor, EventActor):
+            actor = self._actor = EventActor.fromLowLevelActor(actor)
+        return actor
+
+    @property
+    def actorId(self):
+        """
+        The actor's id, without decoding the actor
+        """
+        actor = self._actor
+        if isinstance(actor, EventActor):
+            return actor.id
+        return actor['ID']
+
+    def compact(self):
+        """
+        A copy of this event that doesn't keep docker's raw actor dict, or
+        the actor's attributes, alive; for keeping in a long history
+        """
+        actor = self.actor
+        # the actor's id is usually the event's; keep one copy of the string
+        id = self.id if self.id == actor.id else actor.id
+        return attr.evolve(self,
+                actor=EventActor(actor.image, actor.name, actor.signal, id))
+
+    def _lookup(self, kind):
+        """
+        Get the docker-py object of type `kind` that this event is about.
+        This may block on the docker daemon.
+        """
+        return self.engine.getResource(kind, self.actor, self.host)
 
     @property
     def container(self):
-        try:
-            return self.engine.client.containers.get(self.actor.id)
-        except docker.errors.NotFound:
-            # This mainly happens when a container dies or is destroyed
-            return None
+        return self._lookup('container')
 
     @property
     def image(self):
-        return self.engine.client.images.get(self.actor.name)
+        return self._lookup('image')
 
     @property
     def plugin(self):
-        return self.engine.client.plugins.get(self.actor.name)
+        return self._lookup('plugin')
 
     @property
     def volume(self):
-        return self.engine.client.volumes.get(self.actor.id)
+        return self._lookup('volume')
 
     @property
     def network(self):
-        try:
-            return self.engine.client.networks.get(self.actor.id)
-        except docker.errors.NotFound:
-            # This mainly happens when a network is destroyed
-            return None
+        return self._lookup('network')
+
+    def fetchContainer(self):
+        """
+        Deferred version of `.container`, looked up in the engine's thread pool
+        """
+        return self.engine.deferToThread(self._lookup, 'container')
+
+    def fetchImage(self):
+        """
+        Deferred version of `.image`, looked up in the engine's thread pool
+        """
+        return self.engine.deferToThread(self._lookup, 'image')
+
+    def fetchPlugin(self):
+        """
+        Deferred version of `.plugin`, looked up in the engine's thread pool
+        """
+        return self.engine.deferToThread(self._lookup, 'plugin')
+
+    def fetchVolume(self):
+        """
+        Deferred version of `.volume`, looked up in the engine's thread pool
+        """
+        return self.engine.deferToThread(self._lookup, 'volume')
+
+    def fetchNetwork(self):
+        """
+        Deferred version of `.network`, looked up in the engine's thread pool
+        """
+        return self.engine.deferToThread(self._lookup, 'network')
 
     @property
     def daemon(self):
-        return self.engine.client
+        """
+        The docker client for the daemon the event came from
+        """
+        return self.engine.clientFor(self.host)
 
     @property
     def name(self):
         """
         The dotted event name, e.g. `container.die`
         """
-        return ".".join([self.eventType, self.action])
+        return ".".join([self.eventType, self.action.split(':')[0]])
 
     @classmethod
     def fromLowLevelEvent(cls, engine, dct):
@@ -178,6 +298,167 @@ class Event(object):
 
 PEEK_INTERVAL_SECONDS = 0.5
 
+THREAD_POOL_SIZE = 4
+
+CHECKPOINT_INTERVAL_SECONDS = 1.0
+
+RECONCILE_CONCURRENCY = 8
+
+# the kinds of docker object that reconciliation can list, and the event to
+# synthesize for each one found
+RECONCILE_EVENTS = {
+    'container': 'start',
+    'network': 'create',
+    'volume': 'create',
+}
+
+# the delay before the first attempt to reach a daemon that has gone away,
+# growing by RECONNECT_BACKOFF_FACTOR with each failure, up to
+# RECONNECT_MAX_DELAY_SECONDS
+# an event filter that no docker event matches
+NO_DOCKER_EVENTS = 'dockerish.none'
+
+RECONNECT_DELAY_SECONDS = 1.0
+RECONNECT_BACKOFF_FACTOR = 2.0
+RECONNECT_MAX_DELAY_SECONDS = 60.0
+
+# the most events a stream reader hands to the reactor before waiting for it
+# to take them
+STREAM_HANDOFF_LIMIT = 1000
+
+
+def nanoToSince(timeNano):
+    """
+    Format a `timeNano` as the "seconds.nanoseconds" string that the docker
+    events API accepts for `since` and `until`
+    """
+    return '%d.%09d' % divmod(timeNano, 1000000000)
+
+
+def eventName(dct):
+    """
+    The dotted name of the raw docker-py event `dct`, e.g. `container.die`.
+
+    Some actions carry details after a colon, like
+    "health_status: healthy" or "exec_start: /bin/sh -c ...", which are not
+    part of the name.
+    """
+    return '%s.%s' % (dct['Type'], dct['Action'].split(':')[0])
+
+
+def eventKey(dct):
+    """
+    Identify a raw docker-py event dict well enough to tell apart events that
+    share the same `timeNano`
+    """
+    return (dct.get('Type'), dct.get('Action'), dct.get('Actor', {}).get('ID'))
+
+
+@attr.s
+class EventCursor(object):
+    """
+    The position in the docker event stream of the last event delivered.
+
+    Asking the daemon for events `since` a time includes events at that exact
+    time, so the cursor also remembers which events it has delivered at
+    `timeNano`, and rejects them when they come around a second time.
+
+    `ahead` holds the (timeNano, key) of events past the position that have
+    been delivered already, when the position had to be saved behind them;
+    they are rejected too.
+    """
+    timeNano = attr.ib(default=None)
+    seen = attr.ib(default=attr.Factory(set))
+    ahead = attr.ib(default=attr.Factory(set))
+
+    def advance(self, dct):
+        """
+        Move the cursor past the raw event `dct`.
+
+        Return False if `dct` is at or behind the cursor, i.e. it has already
+        been delivered.
+        """
+        timeNano = dct['timeNano']
+        key = eventKey(dct)
+        if self.timeNano is not None:
+            if timeNano < self.timeNano:
+                return False
+            if timeNano == self.timeNano:
+                if key in self.seen:
+                    return False
+                self.seen.add(key)
+                return self._notAhead(timeNano, key)
+
+        self.timeNano = timeNano
+        self.seen = {key}
+        return self._notAhead(timeNano, key)
+
+    def _notAhead(self, timeNano, key):
+        """
+        False if the event at `timeNano` with `key` was delivered before the
+        position was saved behind it; forget what the cursor has passed
+        """
+        ahead = self.ahead
+        if not ahead:
+            return True
+        if (timeNano, key) in ahead:
+            ahead.discard((timeNano, key))
+            return False
+        self.ahead = set(e for e in ahead if e[0] >= timeNano)
+        return True
+
+    def since(self, default):
+        """
+        The `since` argument for resuming the stream from this cursor, or
+        `default` if nothing has been delivered yet
+        """
+        if self.timeNano is None:
+            return default
+        return nanoToSince(self.timeNano)
+
+
+@attr.s
+class Backoff(object):
+    """
+    The delays between attempts to reach a daemon: `initial` seconds, growing
+    by `factor` each time up to `maximum`.
+
+    Each delay is jittered to between half and all of that, so that many
+    engines whose daemon restarts don't all come back at the same moment.
+    """
+    initial = attr.ib(default=RECONNECT_DELAY_SECONDS)
+    maximum = attr.ib(default=RECONNECT_MAX_DELAY_SECONDS)
+    factor = attr.ib(default=RECONNECT_BACKOFF_FACTOR)
+    random = attr.ib(default=random.random, repr=False)
+    attempts = attr.ib(default=0)
+
+    def next(self):
+        """
+        The delay before the next attempt
+        """
+        delay = self.initial * self.factor ** min(self.attempts, 64)
+        self.attempts += 1
+        delay = min(delay, self.maximum)
+        return delay / 2 * (1 + self.random())
+
+    def reset(self):
+        self.attempts = 0
+
+
+@attr.s
+class Health(object):
+    """
+    Whether an engine can reach a daemon: `connected` is None until the
+    first attempt, then True or False. `failures` counts the attempts that
+    have failed in a row, the last with `lastError`, and `changed` is the time
+    `connected` last changed.
+    """
+    backoff = attr.ib(default=attr.Factory(Backoff), repr=False)
+    connected = attr.ib(default=None)
+    failures = attr.ib(default=0)
+    lastError = attr.ib(default=None)
+    changed = attr.ib(default=None)
+
 
 @attr.s
 class DockerEngine(object):
@@ -185,10 +466,124 @@ class DockerEngine(object):
     Connection to and interface with a docker engine. Listens for events
     from docker by sampling every 0.5s, then reports these events to bound
     listeners, which are created using the @handler decorator.
+
+    With `streaming=True`, holds a single events connection open instead of
+    sampling, reading it in a thread and handing each event to the reactor as
+    soon as it arrives.
+
+    With `rawEvents=True`, the engine asks docker-py for the undecoded bytes
+    of the events stream and decodes them itself with
+    codado.dockerish.decode, which is much faster under a heavy event rate
+    when orjson is installed.
+
+    With `threaded=True`, each sample is fetched in a thread pool of at most
+    `threadPoolSize` threads instead of on the reactor thread. The same pool
+    runs the Event.fetch* lookups.
+
+    With a `resourceCache` (a codado.dockerish.cache.ResourceCache), the
+    objects looked up by Event.container, .image etc. are cached, and evicted
+    again when an event such as `container.destroy` makes them stale.
+
+    The engine only asks the daemon for the types of events that it has
+    handlers for (unless there is a defaultHandler). `eventFilters` adds
+    filters of your own, e.g. {'label': ['com.example.monitored']}, which are
+    always sent.
+
+    With a `history` (a codado.dockerish.history.EventHistory), every event
+    received is remembered there, so handlers can ask what else has happened
+    recently to the same container.
+
+    With a `checkpoint` (a codado.dockerish.checkpoint.ICheckpointStore), the
+    position of the last event dispatched is saved at most once every
+    `checkpointInterval` seconds, and run() resumes from the saved position
+    instead of from the current time.
+
+    `reconcile` names the kinds of docker object ('container', 'network',
+    'volume') that already exist when run() is called, and that handlers
+    should hear about. Each kind is listed with one call to the daemon, and
+    a `container.start` (or `network.create`, `volume.create`) event with
+    status 'reconcile' is dispatched for each object found. With a
+    resourceCache, containers are also inspected, at most
+    `reconcileConcurrency` at a time, and cached for the handlers.
+
+    `clientFactory` makes the docker client when run() is called; it defaults
+    to docker.from_env. See codado.dockerish.replay for a client that replays
+    recorded events instead.
+
+    Handlers may return a Deferred or a coroutine. A handler registered with
+    a `concurrency` or `queueSize` runs through its own bounded queue; when
+    any such queue is full, the engine stops reading events from the daemon
+    until it drains.
+
+    With `metrics` (a codado.dockerish.metrics.IMetricsSink, such as a
+    MetricsRecorder), the engine reports how far behind docker each event is
+    dispatched, how long each poll (or hop from the stream reader) takes, and
+    how long each handler call takes and whether it fails.
+
+    A handler registered with `coalesce` seconds sees only the latest event
+    of each name for each actor within that window (or a list of them, with
+    `batch=True`).
+
+    A handler registered with an `image`, `labels`, `hasLabels`, `name` or
+    `signal` (see codado.dockerish.match.Predicate) is only called for events
+    whose actor matches. These are indexed, so handlers that can't match an
+    event cost next to nothing.
+
+    `priorities` maps event names, or globs of them such as
+    'container.exec_*', to a number (0 if not given). When events back up
+    behind busy handlers, those with a higher priority are dispatched first,
+    e.g. {'container.oom': 10, 'container.die': 10, 'container.exec_*': -1}.
+    Events of a lower priority still get one turn after `starvationLimit`
+    events have gone ahead of them. Events in different lanes may therefore
+    be dispatched out of order, even for the same container; a checkpoint
+    only records a position that every event before it has been dispatched
+    from.
+
+    When the daemon can't be reached, the engine keeps trying, waiting
+    `reconnectDelay` seconds at first and doubling that (with jitter) up to
+    `reconnectMaxDelay`. `health` (a Health) says how that is going. Handlers
+    hear `dockerish.disconnected` when it goes away and
+    `dockerish.reconnected` when it is back, followed by the events that
+    happened in between.
     """
     handlers = attr.ib(default=attr.Factory(dict))
+    streaming = attr.ib(default=False)
+    threaded = attr.ib(default=False)
+    threadPoolSize = attr.ib(default=THREAD_POOL_SIZE)
+    resourceCache = attr.ib(default=None)
+    eventFilters = attr.ib(default=attr.Factory(dict))
+    history = attr.ib(default=None)
+    checkpoint = attr.ib(default=None)
+    checkpointInterval = attr.ib(default=CHECKPOINT_INTERVAL_SECONDS)
+    reconcile = attr.ib(default=())
+    reconcileConcurrency = attr.ib(default=RECONCILE_CONCURRENCY)
+    clientFactory = attr.ib(default=None)
+    handlerOptions = attr.ib(default=attr.Factory(dict))
+    metrics = attr.ib(default=None)
+    rawEvents = attr.ib(default=False)
+    handlerPredicates = attr.ib(default=attr.Factory(dict))
+    reconnectDelay = attr.ib(default=RECONNECT_DELAY_SECONDS)
+    reconnectMaxDelay = attr.ib(default=RECONNECT_MAX_DELAY_SECONDS)
+    priorities = attr.ib(default=attr.Factory(dict))
+    starvationLimit = attr.ib(default=STARVATION_LIMIT)
 
     callLater = reactor.callLater
+    callInThread = reactor.callInThread
+    callFromThread = reactor.callFromThread
+    addSystemEventTrigger = reactor.addSystemEventTrigger
+    removeSystemEventTrigger = reactor.removeSystemEventTrigger
+
+    running = False
+    health = None
+    threadPool = None
+    _dispatchTable = None
+    _filters = None
+    _nextCheckpoint = None
+    _queues = ()
+    _pausedSince = None
+    _shutdownTrigger = None
+    _draining = False
+    _handedOff = 0
 
     def __get__(self, instance, cls):
         """
@@ -201,69 +596,803 @@ class DockerEngine(object):
         if instance is None:
             return self
 
-        self.owner = instance
+        if getattr(self, 'owner', None) is not instance:
+            self.owner = instance
+            self._dispatchTable = None
         return self
 
     def run(self):
         """
         Connect to the docker engine and begin listening for docker events
         """
-        self.client = docker.from_env()
+        self.health = self._newHealth()
+        self.client = self._connect()
+        self.cursor = EventCursor()
+        if self.checkpoint is not None:
+            self.cursor = self.checkpoint.load() or self.cursor
+            self.dispatched = EventCursor(self.cursor.timeNano, set(self.cursor.seen))
+        # with priorities, what was dispatched since the last checkpoint
+        self._recentlyDispatched = []
+        self.running = True
+        # set by stop(), to wake a stream reader waiting to reconnect
+        self._stopping = threading.Event()
+        self._startFlow()
+        self._compileHandlers()
 
         now = time.time()
-        nowNano = now * 1000000000
-        startEvent = Event(status='init',
+        since = self.cursor.since(now)
+        self.callLater(0, self._callHandlers, 'dockerish.init', self.initEvent(now))
+        # a stream reader blocks in the reactor's thread pool, which the
+        # reactor joins at shutdown; the stream must be closed before then
+        self._shutdownTrigger = self.addSystemEventTrigger(
+                'before', 'shutdown', self._shutdown)
+        if self.reconcile:
+            # events that happen while reconciling are picked up from `since`
+            self.callLater(0, self._reconcile, since)
+        else:
+            self._startEvents(since)
+
+    def initEvent(self, now):
+        """
+        The `dockerish.init` event for an engine started at `now`
+        """
+        return self.dockerishEvent('init', now)
+
+    def dockerishEvent(self, action, now, host=None):
+        """
+        The `dockerish.<action>` event that happened at `now`, about the daemon
+        at `host`
+        """
+        return Event(status=action,
                 id=None,
                 time=int(now),
-                timeNano=int(nowNano),
+                timeNano=int(now * 1000000000),
                 actor=EventActor(image=None, name=None, signal=None, id=None),
-                action='init',
+                action=action,
                 eventFrom=None,
                 eventType='dockerish',
                 engine=self,
+                host=host,
                 )
-        self.callLater(0, self._callHandlers, 'dockerish.init', startEvent)
-        self.callLater(PEEK_INTERVAL_SECONDS, self._genEvents, time.time())
+
+    def _startFlow(self):
+        """
+        Set up the backlog of events waiting for handlers, and the flow
+        control between it and the stream reader
+        """
+        self._backlog = self._newBacklog()
+        self._flowing = threading.Event()
+        self._flowing.set()
+        self._handOffLock = threading.Lock()
+        self._handedOff = 0
+
+    def _newBacklog(self):
+        """
+        A deque of the events waiting to be dispatched, or a PriorityBacklog
+        with a lane for each of the `priorities`
+        """
+        if not self.priorities:
+            return deque()
+        levels = sorted(set(self.priorities.values()) | {0}, reverse=True)
+        lanes = {}
+        def classify(llEvent):
+            name = eventName(llEvent)
+            lane = lanes.get(name)
+            if lane is None:
+                lane = lanes[name] = levels.index(self.priorityOf(name))
+            return lane
+        return PriorityBacklog(len(levels), classify, self.starvationLimit)
+
+    def priorityOf(self, name):
+        """
+        The priority of events called `name`: from `priorities`, by name, or
+        else the highest of the globs that match it, or 0
+        """
+        if name in self.priorities:
+            return self.priorities[name]
+        matched = [priority for (pattern, priority) in self.priorities.items()
+                if fnmatch.fnmatchcase(name, pattern)]
+        return max(matched) if matched else 0
+
+    def _newHealth(self):
+        return Health(Backoff(self.reconnectDelay, self.reconnectMaxDelay))
+
+    def _connect(self):
+        """
+        Make the docker client
+        """
+        return (self.clientFactory or docker.from_env)()
+
+    def _startEvents(self, since):
+        """
+        Begin polling or streaming docker events from `since`
+        """
+        if self.streaming:
+            self.callInThread(self._readStream, since)
+        else:
+            self._nextPeek = self.callLater(PEEK_INTERVAL_SECONDS,
+                    self._genEvents, since)
+
+    def _reconcile(self, since):
+        """
+        Dispatch synthetic events for the docker objects that already exist,
+        then begin listening for events from `since`
+        """
+        d = self.deferToThread(self._listExisting)
+        d.addCallback(self._inspectExisting)
+        d.addCallback(self._dispatchExisting)
+        d.addErrback(log.err, "Reconciling existing docker objects failed")
+        d.addCallback(lambda _: self._startEvents(since))
+        return d
+
+    def _listExisting(self):
+        """
+        List each kind of object to reconcile in one call apiece, returning
+        the docker-py objects and synthetic raw events for them
+        """
+        now = time.time()
+        nowNano = int(now * 1000000000)
+        ret = []
+        for kind in ('container', 'network', 'volume'):
+            if kind not in self.reconcile:
+                continue
+            action = RECONCILE_EVENTS[kind]
+            if kind == 'container':
+                found = self.client.containers.list(sparse=True)
+            else:
+                found = getattr(self.client, kind + 's').list()
+
+            for obj in found:
+                a = obj.attrs
+                if kind == 'container':
+                    attributes = dict(a.get('Labels') or {})
+                    attributes['image'] = a.get('Image')
+                    attributes['name'] = (a.get('Names') or ['/'])[0].lstrip('/')
+                    id = a['Id']
+                elif kind == 'network':
+                    attributes = {'name': a.get('Name'), 'type': a.get('Driver')}
+                    id = a['Id']
+                else:
+                    attributes = {'driver': a.get('Driver')}
+                    id = a['Name']
+                llEvent = {
+                    'status': 'reconcile',
+                    'id': id if kind == 'container' else None,
+                    'from': attributes.get('image'),
+                    'Type': kind,
+                    'Action': action,
+                    'Actor': {'ID': id, 'Attributes': attributes},
+                    'time': int(now),
+                    'timeNano': nowNano,
+                    }
+                ret.append((obj, llEvent))
+        return ret
+
+    def _inspectExisting(self, existing):
+        """
+        With a resource cache, fetch the full details of listed containers, a
+        few at a time, and cache them so handlers don't each ask again
+        """
+        if self.resourceCache is None:
+            return existing
+
+        sem = defer.DeferredSemaphore(self.reconcileConcurrency)
+        ds = []
+        for obj, llEvent in existing:
+            if llEvent['Type'] == 'container':
+                key = ('container', obj.id)
+                generation = self.resourceCache.generation(key)
+                d = sem.run(self.deferToThread, obj.reload)
+                d.addCallback(lambda _, key=key, obj=obj, generation=generation:
+                        self.resourceCache.put(key, obj, generation))
+                ds.append(d)
+        d = defer.gatherResults(ds, consumeErrors=True)
+        d.addCallback(lambda _: existing)
+        return d
+
+    def _dispatchExisting(self, existing):
+        """
+        Fire handlers for the synthetic events from reconciliation
+        """
+        for obj, llEvent in existing:
+            self._fire(llEvent)
+
+    def _shutdown(self):
+        """
+        The reactor is shutting down
+        """
+        self._shutdownTrigger = None
+        self.stop()
+
+    def stop(self):
+        """
+        Stop listening for docker events
+        """
+        self.running = False
+        if self._shutdownTrigger is not None:
+            self.removeSystemEventTrigger(self._shutdownTrigger)
+            self._shutdownTrigger = None
+        flowing = getattr(self, '_flowing', None)
+        if flowing is not None:
+            flowing.set()
+        stopping = getattr(self, '_stopping', None)
+        if stopping is not None:
+            stopping.set()
+        stream = getattr(self, '_stream', None)
+        if stream is not None:
+            stream.close()
+        nextPeek = getattr(self, '_nextPeek', None)
+        if nextPeek is not None and nextPeek.active():
+            nextPeek.cancel()
+        if self.threadPool is not None:
+            self.removeSystemEventTrigger(self._poolTrigger)
+            self.threadPool.stop()
+            self.threadPool = None
+        for coalescer in getattr(self, '_coalescers', {}).values():
+            coalescer.flush()
+        if self._nextCheckpoint is not None:
+            self._nextCheckpoint.cancel()
+            self._saveCheckpoint()
+
+    def deferToThread(self, f, *a, **kw):
+        """
+        Call f(*a, **kw) in this engine's thread pool, returning a Deferred
+        that fires with the result in the reactor thread
+        """
+        if self.threadPool is None:
+            self.threadPool = threadpool.ThreadPool(
+                    minthreads=0,
+                    maxthreads=self.threadPoolSize,
+                    name='dockerish')
+            self.threadPool.start()
+            self._poolTrigger = self.addSystemEventTrigger(
+                    'during', 'shutdown', self.threadPool.stop)
+        return threads.deferToThreadPool(reactor, self.threadPool, f, *a, **kw)
+
+    def _compileHandlers(self):
+        """
+        Resolve handler names to bound methods of the owner, once, into a table
+        of the callables to fire for each event name
+        """
+        self._dispatchTable = {}
+        self._handlerQueues = {}
+        self._coalescers = {}
+        self._wrappedHandlers = {}
+        for eventName in VALID_EVENTS:
+            if eventName != ALL_EVENTS:
+                self._dispatchTable[eventName] = self._resolveHandlers(eventName)
+        self._queues = tuple(self._handlerQueues.values())
+        self._filters = self.serverFilters()
+
+    def serverFilters(self):
+        """
+        The `filters` to send to the docker events API, so that the daemon
+        only sends events that some handler is listening for
+        """
+        filters = dict((k, list(v)) for (k, v) in self.eventFilters.items())
+        names = [name for (name, fns) in self.handlers.items() if fns]
+        if ALL_EVENTS in names:
+            return filters or None
+
+        types = set()
+        actions = set()
+        anyAction = False
+        for name in names:
+            eventType, action = name.split('.')
+            if eventType == 'dockerish':
+                continue
+            types.add(eventType)
+            if action == '*':
+                anyAction = True
+            else:
+                actions.add(action)
+
+        if not names:
+            return filters or None
+        if not types:
+            # only the engine's own events are wanted: keep talking to the
+            # daemon, to report its health, but ask it for nothing
+            filters['event'] = [NO_DOCKER_EVENTS]
+            return filters
+
+        if self.resourceCache is not None:
+            # the cache must still see the events that make it stale
+            for name, kind in INVALIDATING_EVENTS.items():
+                eventType, action = name.split('.')
+                if kind in types:
+                    types.add(eventType)
+                    actions.add(action)
+
+        filters.setdefault('type', sorted(types))
+        if not anyAction:
+            filters.setdefault('event', sorted(actions))
+        return filters
+
+    def _resolveHandlers(self, eventName):
+        """
+        The bound handlers for `eventName`: default handlers first, then
+        handlers for the event's category, then handlers for the event itself
+        """
+        category = eventName.split('.')[0] + '.*'
+        ret = []
+        for key in (ALL_EVENTS, category, eventName):
+            for func_name in self.handlers.get(key, ()):
+                ret.append((self._bindHandler(func_name),
+                    self.handlerPredicates.get((key, func_name))))
+        if any(predicate for (fn, predicate) in ret):
+            return HandlerIndex(ret)
+        return tuple(fn for (fn, predicate) in ret)
+
+    def _bindHandler(self, func_name):
+        """
+        The callable to fire for the handler named `func_name`: the owner's
+        bound method, or a queue or meter in front of it
+        """
+        options = self.handlerOptions.get(func_name) or {}
+        if func_name in self._wrappedHandlers:
+            return self._wrappedHandlers[func_name]
+
+        fn = getattr(self.owner, func_name)
+        if self.metrics is not None:
+            fn = metered(fn, self.metrics)
+        if not options and self.metrics is None:
+            return fn
+
+        if 'concurrency' in options or 'queueSize' in options:
+            fn = self._handlerQueues[func_name] = HandlerQueue(fn,
+                    concurrency=options.get('concurrency') or 1,
+                    queueSize=options.get('queueSize') or HANDLER_QUEUE_SIZE,
+                    onDrain=self._resume)
+        if 'coalesce' in options:
+            fn = self._coalescers[func_name] = Coalescer(fn,
+                    window=options['coalesce'],
+                    callLater=self.callLater,
+                    watch=self._watch,
+                    batch=options.get('batch', False))
+        self._wrappedHandlers[func_name] = fn
+        return fn
+
+    def _handlersFor(self, eventName):
+        """
+        The compiled handlers for `eventName`: a tuple, or a HandlerIndex when
+        some of them have predicates
+        """
+        if self._dispatchTable is None:
+            self._compileHandlers()
+
+        fns = self._dispatchTable.get(eventName)
+        if fns is None:
+            # docker has grown an event we haven't heard of
+            fns = self._dispatchTable[eventName] = self._resolveHandlers(eventName)
+        return fns
 
     def _callHandlers(self, eventName, event):
         """
         Fire all handlers that are listening for this event
         """
-        for func_name in self.handlers.get(ALL_EVENTS, ()):
-            getattr(self.owner, func_name)(event)
+        fns = self._handlersFor(eventName)
+        if isinstance(fns, HandlerIndex):
+            fns = fns.select(event.actor.attributes)
+        for fn in fns:
+            self._callHandler(fn, event)
+
+    def _callHandler(self, fn, event):
+        """
+        Fire one handler, logging its failure, so that one bad handler can't
+        stop the others or the events behind it
+        """
+        try:
+            result = fn(event)
+        except Exception:
+            log.err(None, "Handler %r failed" % fn.__name__)
+            return
+        if result is not None:
+            self._watch(fn.__name__, result)
+
+    def _dispatch(self, llEvent):
+        """
+        Build an Event from a raw docker-py event and fire its handlers
+        """
+        if self.metrics is not None:
+            self.metrics.eventDispatched(eventName(llEvent),
+                    time.time() - llEvent['timeNano'] / 1e9)
+
+        if self.checkpoint is not None:
+            self.dispatched.advance(llEvent)
+            if self.priorities:
+                self._recentlyDispatched.append(
+                        (llEvent['timeNano'], eventKey(llEvent)))
+            if self._nextCheckpoint is None:
+                self._nextCheckpoint = self.callLater(self.checkpointInterval,
+                        self._saveCheckpoint)
+
+        if self.resourceCache is not None:
+            host = llEvent.get('host')
+            for key in invalidatedKeys(llEvent):
+                if host is not None:
+                    key = (host,) + key
+                self.resourceCache.evict(key)
+
+        self._fire(llEvent)
+
+    def _fire(self, llEvent):
+        """
+        Build an Event from a raw event and fire its handlers
+        """
+        fns = self._handlersFor(eventName(llEvent))
+        if isinstance(fns, HandlerIndex):
+            fns = fns.select(llEvent['Actor'].get('Attributes'))
+        if not fns and self.history is None:
+            return
+        ev = Event.fromLowLevelEvent(self, llEvent)
+        if self.history is not None:
+            self.history.append(ev)
+        for fn in fns:
+            self._callHandler(fn, ev)
+
+    def _watch(self, name, result):
+        """
+        Log the failure of what the handler `name` returned, if it is
+        asynchronous
+        """
+        return watch(name, result)
 
-        for func_name in self.handlers.get(eventName, ()):
-            getattr(self.owner, func_name)(event)
+    @property
+    def saturated(self):
+        """
+        True when some handler's queue is full, and reading should pause
+        """
+        for queue in self._queues:
+            if queue.full:
+                return True
+        return False
+
+    def _enqueue(self, llEvent):
+        """
+        Add a raw event to the backlog and dispatch what the handlers have
+        room for
+        """
+        self._backlog.append(llEvent)
+        self._drain()
+
+    def _drain(self):
+        """
+        Dispatch events from the backlog until it is empty or a handler's queue
+        fills up; let the stream reader carry on only if there is room.
+
+        A queued handler that finishes synchronously resumes the engine while
+        its event is still being dispatched; the loop already running here
+        carries on instead, so that events are not dispatched out of order
+        or recursively.
+        """
+        if self._draining:
+            return
+        self._draining = True
+        backlog = self._backlog
+        try:
+            while backlog and not self.saturated:
+                self._dispatch(backlog.popleft())
+        finally:
+            self._draining = False
+        self._updateFlow()
+
+    def _updateFlow(self):
+        """
+        Let the stream reader carry on only if the backlog is empty, no
+        handler queue is full, and it hasn't handed over too many events
+        that the reactor has yet to take
+        """
+        with self._handOffLock:
+            if (self._backlog or self.saturated
+                    or self._handedOff >= STREAM_HANDOFF_LIMIT):
+                self._flowing.clear()
+            else:
+                self._flowing.set()
+
+    def _resume(self):
+        """
+        A handler queue has room again: dispatch more of the backlog, and
+        sample again if sampling was held up
+        """
+        self._drain()
+        if not self._backlog and self._pausedSince is not None:
+            since, self._pausedSince = self._pausedSince, None
+            self._peekAgain(since)
+
+    def _saveCheckpoint(self):
+        """
+        Save the position of the last event dispatched
+        """
+        self._nextCheckpoint = None
+        cursor = EventCursor(self.dispatched.timeNano, set(self.dispatched.seen))
+        if self.priorities:
+            # events in later lanes may be waiting behind the ones dispatched;
+            # save the position behind them, with the events already
+            # dispatched past it, so that a restart doesn't repeat those
+            oldest = self._backlog.oldest()
+            recent = self._recentlyDispatched
+            if oldest is not None and oldest <= cursor.timeNano:
+                recent = [e for e in recent if e[0] >= oldest - 1]
+                cursor = EventCursor(oldest - 1, ahead=set(recent))
+            else:
+                recent = []
+            self._recentlyDispatched = recent
+        self.checkpoint.save(cursor)
+
+    def clientFor(self, host):
+        """
+        The docker client for events from `host`
+        """
+        return self.client
+
+    def cursorFor(self, host):
+        """
+        The position in the event stream from `host`
+        """
+        return self.cursor
+
+    def healthFor(self, host):
+        """
+        Whether `host` can be reached
+        """
+        return self.health
+
+    def _lost(self, host, reason):
+        """
+        An attempt to get events from `host` failed with the Failure `reason`:
+        tell the handlers if it had been reachable until now
+        """
+        health = self.healthFor(host)
+        health.failures += 1
+        health.lastError = reason.getErrorMessage()
+        if health.connected is False:
+            log.msg("Docker at %s is still unreachable after %d attempts: %s" % (
+                host or 'default', health.failures, health.lastError))
+            return
+        log.err(reason, "Lost docker events from %s" % (host or 'default'))
+        health.connected = False
+        health.changed = time.time()
+        self._callHandlers('dockerish.disconnected',
+                self.dockerishEvent('disconnected', health.changed, host))
+
+    def _regained(self, host):
+        """
+        Events are coming from `host` again: tell the handlers, if it had been
+        unreachable
+        """
+        health = self.healthFor(host)
+        health.failures = 0
+        health.lastError = None
+        if health.connected:
+            return
+        wasLost = health.connected is False
+        health.connected = True
+        health.changed = time.time()
+        if wasLost:
+            self._callHandlers('dockerish.reconnected',
+                    self.dockerishEvent('reconnected', health.changed, host))
+
+    def getResource(self, kind, actor, host=None):
+        """
+        Get the docker-py object of type `kind` that `actor` refers to,
+        from the resource cache if possible
+        """
+        client = self.clientFor(host)
+        if self.resourceCache is None:
+            return lookupResource(client, kind, actor)
+
+        key = (kind, resourceKey(kind, actor))
+        if host is not None:
+            key = (host,) + key
+        generation = self.resourceCache.generation(key)
+        ret = self.resourceCache.get(key)
+        if ret is None:
+            ret = lookupResource(client, kind, actor)
+            if ret is not None:
+                self.resourceCache.put(key, ret, generation)
+        return ret
 
     def _genEvents(self, since):
         """
         Gather docker events, beginning from the timestamp `since`.
         """
         until = time.time()
-        for llEvent in self.client.events(
-                decode=True,
+        if self.threaded:
+            d = self.deferToThread(self._fetchEvents, since, until)
+        else:
+            d = defer.maybeDeferred(self._fetchEvents, since, until)
+        d.addCallback(self._fetched, until)
+        d.addCallbacks(self._polled, self._pollFailed,
+                callbackArgs=(until,), errbackArgs=(since,))
+        d.addErrback(log.err, "Dispatching docker events failed")
+        return d
+
+    def _polled(self, llEvents, until):
+        """
+        A sample arrived: dispatch it, and schedule the next from `until`
+        """
+        self.health.backoff.reset()
+        self._regained(None)
+        try:
+            self._dispatchBatch(llEvents)
+        finally:
+            self._peekWhenDrained(until)
+
+    def _pollFailed(self, reason, since):
+        """
+        A sample could not be fetched: try again after a backoff, from the
+        last event seen, so that nothing is missed in between
+        """
+        self._lost(None, reason)
+        if self.running:
+            self._nextPeek = self.callLater(self.health.backoff.next(),
+                    self._genEvents, self.cursor.since(since))
+
+    def _fetched(self, llEvents, started):
+        """
+        Report how long a poll took, if anyone is listening
+        """
+        if self.metrics is not None:
+            self.metrics.fetched(time.time() - started)
+        return llEvents
+
+    def _fetchEvents(self, since, until):
+        """
+        Get the docker events between `since` and `until` as a list
+        """
+        events = self.client.events(
+                decode=not self.rawEvents,
                 since=since,
-                until=until):
-            ev = Event.fromLowLevelEvent(self, llEvent)
+                until=until,
+                filters=self._filters)
+        return list(decodeStream(events) if self.rawEvents else events)
+
+    def _dispatchBatch(self, llEvents):
+        """
+        Fire handlers for each event in a sample that hasn't been seen yet
+        """
+        for llEvent in llEvents:
+            if self.cursor.advance(llEvent):
+                self._backlog.append(llEvent)
+        self._drain()
+
+    def _peekWhenDrained(self, since):
+        """
+        Schedule the next sample, unless handlers are still working through
+        this one, in which case _resume will schedule it
+        """
+        if self._backlog:
+            self._pausedSince = since
+        else:
+            self._peekAgain(since)
+
+    def _peekAgain(self, since):
+        """
+        Schedule the next sample
+        """
+        if self.running:
+            self._nextPeek = self.callLater(PEEK_INTERVAL_SECONDS, self._genEvents, since)
 
-            self._callHandlers(ev.name, ev)
+    def _readStream(self, since, host=None):
+        """
+        Hold an events connection open, beginning from the timestamp `since`,
+        and hand each event to the reactor as it arrives.
+
+        This blocks, so it runs in a thread. When the connection drops, open a
+        new one from the last event seen, after a backoff. While handler queues
+        are full, wait before reading more.
+        """
+        client = self.clientFor(host)
+        cursor = self.cursorFor(host)
+        backoff = self.healthFor(host).backoff
+        while self.running:
+            try:
+                stream = client.events(
+                        decode=not self.rawEvents,
+                        since=cursor.since(since),
+                        filters=self._filters)
+                self._setStream(host, stream)
+                backoff.reset()
+                self.callFromThread(self._regained, host)
+                if self.rawEvents:
+                    stream = decodeStream(stream)
+                for llEvent in stream:
+                    if cursor.advance(llEvent):
+                        self._handOff(host, llEvent)
+                    self._flowing.wait()
+                reason = failure.Failure(
+                        error.ConnectionDone("The docker event stream ended"))
+            except Exception:
+                reason = failure.Failure()
+
+            # stop() hangs up on the daemon
+            if self.running:
+                self.callFromThread(self._lost, host, reason)
+                # a daemon may be gone for a while; don't hold up stop(), and
+                # the reactor's shutdown, for the whole backoff
+                self._stopping.wait(backoff.next())
+
+    def _setStream(self, host, stream):
+        """
+        Remember the open events connection to `host`, to close it on stop()
+        """
+        self._stream = stream
+
+    def _handOff(self, host, llEvent):
+        """
+        Pass an event from the stream reader thread to the reactor, stopping
+        the reader once too many are on their way
+        """
+        with self._handOffLock:
+            self._handedOff += 1
+            if self._handedOff >= STREAM_HANDOFF_LIMIT:
+                self._flowing.clear()
+        sent = time.time() if self.metrics is not None else None
+        self.callFromThread(self._arrived, host, llEvent, sent)
 
-        self.callLater(PEEK_INTERVAL_SECONDS, self._genEvents, until)
+    def _arrived(self, host, llEvent, sent=None):
+        """
+        An event handed off by the stream reader has reached the reactor
+        """
+        with self._handOffLock:
+            self._handedOff -= 1
+        if sent is not None:
+            self._fetched(None, sent)
+        self._receive(host, llEvent)
 
-    def handler(self, eventName):
+    def _receive(self, host, llEvent):
+        """
+        An event has arrived on the reactor thread from the stream reader
+        """
+        self._enqueue(llEvent)
+
+    def handler(self, eventName, concurrency=None, queueSize=None,
+            coalesce=None, batch=False, image=None, labels=None, hasLabels=(),
+            name=None, signal=None):
         """
         Register a method or function as a handler for an event
 
         `eventName` must be specified as a dotted notation which categorizes
-        each event, such as `container.die` or `image.pull`.
+        each event, such as `container.die` or `image.pull`, or as a whole
+        category, such as `container.*`.
 
         The category determines what property is available on the event
         object, for example ".container" for container events.
+
+        A handler that returns a Deferred or coroutine can be limited to
+        `concurrency` events at a time, with at most `queueSize` more waiting.
+        Events for the same actor are handled one at a time, in order.
+
+        With `coalesce` seconds, events are held for that long after the
+        first, and only the latest one of each name for each actor is
+        handled. With
+        `batch=True` as well, the handler is called once per window with the
+        list of those events instead.
+
+        With any of `image` (a prefix), `labels` (a dict of label values),
+        `hasLabels`, `name` (a glob) or `signal`, the handler is only called
+        for events whose actor matches all of them.
         """
         def _deco(fn):
             print("Making %r a handler for %r" % (fn.__name__, eventName))
-            assert eventName in VALID_EVENTS, "%r is not a docker event" % eventName
+            assert eventName in VALID_EVENTS or eventName in WILDCARD_EVENTS, (
+                    "%r is not a docker event" % eventName)
             self.handlers.setdefault(eventName, []).append(fn.__name__)
+            assert not (batch and (concurrency or queueSize)), (
+                    "batch handlers can't be queued")
+            assert coalesce or not batch, "batch handlers must coalesce"
+            given = dict(concurrency=concurrency, queueSize=queueSize,
+                    coalesce=coalesce)
+            given = dict((k, v) for (k, v) in given.items() if v is not None)
+            if coalesce is not None:
+                given['batch'] = batch
+            if given:
+                self.handlerOptions.setdefault(fn.__name__, {}).update(given)
+            predicate = Predicate(image=image, labels=labels,
+                    hasLabels=hasLabels, name=name, signal=signal)
+            if predicate:
+                self.handlerPredicates[(eventName, fn.__name__)] = predicate
+            self._dispatchTable = None
             return fn
         return _deco
 
@@ -0,0 +1,151 @@
+"""
+A stand-in docker daemon that serves recorded events over the docker HTTP
+API on a unix socket
+
+    daemon = FakeDaemon('/tmp/docker.sock', llEvents)
+    await daemon.start()
+
+It answers GET /events like the real daemon, so anything that talks to the
+socket itself (docker-py, codado.dockerish.aio) can be tested and
+benchmarked against it.
+"""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from builtins import object
+
+import attr
+
+from codado.dockerish.replay import NANO, matchesFilters
+
+
+def parseSince(value):
+    """
+    The timeNano of a `since` or `until`: seconds, or "seconds.nanoseconds"
+    """
+    if '.' not in value:
+        return int(value) * NANO
+    seconds, fraction = value.split('.')
+    return int(seconds) * NANO + int(fraction.ljust(9, '0')[:9])
+
+
+@attr.s
+class FakeDaemon(object):
+    """
+    Serve `llEvents` (raw event dicts) on the unix socket `path`.
+
+    Each request for events gets the ones from its `since` (and up to its
+    `until`) that pass its `filters`, one per HTTP chunk. The response then
+    ends, or with `hold=True` is held open like the real daemon's until the
+    client hangs up. Without `chunked`, the body is sent as is and ended by
+    closing the connection.
+
+    The first `failures` requests for events are answered with a 500.
+    `requests` records the query of each request for events.
+    """
+    path = attr.ib()
+    llEvents = attr.ib(default=attr.Factory(list))
+    hold = attr.ib(default=False)
+    chunked = attr.ib(default=True)
+    failures = attr.ib(default=0)
+
+    def __attrs_post_init__(self):
+        self.requests = []
+        self.server = None
+        self._lines = [(e['timeNano'], e,
+            json.dumps(e, separators=(',', ':')).encode('utf-8') + b'\n')
+            for e in self.llEvents]
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def runInThread(self):
+        """
+        Serve from a thread with its own event loop, for blocking clients.
+        Returns a function that stops it.
+        """
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.close())
+            loop.close()
+
+        thread = threading.Thread(target=serve, name='fakedaemon', daemon=True)
+        thread.start()
+        started.wait()
+
+        def stop():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+        return stop
+
+    def _select(self, query):
+        since = parseSince(query['since']) if 'since' in query else None
+        until = parseSince(query['until']) if 'until' in query else None
+        filters = json.loads(query['filters']) if 'filters' in query else None
+        for timeNano, llEvent, line in self._lines:
+            if since is not None and timeNano < since:
+                continue
+            if until is not None and timeNano > until:
+                break
+            if matchesFilters(llEvent, filters):
+                yield line
+
+    async def _serve(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+        method, target, version = head.split(b'\r\n')[0].decode('ascii').split(' ')
+        url = urlsplit(target)
+        query = dict((k, v[0]) for (k, v) in parse_qs(url.query).items())
+
+        try:
+            if not url.path.endswith('/events'):
+                self._respond(writer, 404, b'{"message":"page not found"}\n')
+            elif self.failures:
+                self.requests.append(query)
+                self.failures -= 1
+                self._respond(writer, 500, b'{"message":"try again"}\n')
+            else:
+                self.requests.append(query)
+                await self._stream(reader, writer, query)
+            await writer.drain()
+        except ConnectionError:
+            # the client hung up
+            pass
+        writer.close()
+
+    def _respond(self, writer, status, body):
+        writer.write(b'HTTP/1.1 %d Oops\r\nContent-Type: application/json\r\n'
+                b'Content-Length: %d\r\nConnection: close\r\n\r\n%s' % (
+                    status, len(body), body))
+
+    async def _stream(self, reader, writer, query):
+        framing = (b'Transfer-Encoding: chunked' if self.chunked
+                else b'Connection: close')
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                b'%s\r\n\r\n' % framing)
+        for line in self._select(query):
+            if self.chunked:
+                writer.write(b'%x\r\n%s\r\n' % (len(line), line))
+            else:
+                writer.write(line)
+            await writer.drain()
+        if self.hold:
+            await reader.read()
+            return
+        if self.chunked:
+            writer.write(b'0\r\n\r\n')
@@ -0,0 +1,218 @@
+"""
+Flow control between docker events and the handlers that consume them
+"""
+from collections import OrderedDict, deque
+import inspect
+
+from builtins import object
+
+import attr
+
+from twisted.internet import defer
+from twisted.python import log
+
+
+HANDLER_QUEUE_SIZE = 1000
+
+# events taken from earlier lanes of a PriorityBacklog while a later lane
+# waits, before the later lane gets a turn
+STARVATION_LIMIT = 100
+
+
+def toDeferred(result):
+    """
+    Turn what a handler returned into a Deferred, if it is asynchronous at
+    all: a Deferred is returned as it is, a coroutine is wrapped, and
+    anything else gives None
+    """
+    if isinstance(result, defer.Deferred):
+        return result
+    if inspect.iscoroutine(result):
+        return defer.ensureDeferred(result)
+    return None
+
+
+def watch(name, result):
+    """
+    Log the failure of an asynchronous handler, which would otherwise go
+    unnoticed
+    """
+    d = toDeferred(result)
+    if d is not None:
+        d.addErrback(log.err, "Handler %r failed" % name)
+    return d
+
+
+@attr.s
+class HandlerQueue(object):
+    """
+    Run one handler for at most `concurrency` events at a time, queueing the
+    rest.
+
+    Two events for the same actor never run at the same time, and run in the
+    order they arrived.
+
+    The queue is `full` once `queueSize` events are waiting; the engine stops
+    reading events until `onDrain` is called.
+    """
+    fn = attr.ib()
+    concurrency = attr.ib(default=1)
+    queueSize = attr.ib(default=HANDLER_QUEUE_SIZE)
+    onDrain = attr.ib(default=None, repr=False)
+
+    def __attrs_post_init__(self):
+        self.__name__ = self.fn.__name__
+        self.pending = deque()
+        self.running = 0
+        self.busy = set()
+
+    @property
+    def full(self):
+        return len(self.pending) >= self.queueSize
+
+    def __call__(self, event):
+        self.pending.append(event)
+        self._pump()
+
+    def _pump(self):
+        """
+        Start as many waiting events as concurrency allows, skipping (but
+        keeping the place of) those whose actor is already busy
+        """
+        if not self.pending or self.running >= self.concurrency:
+            return
+
+        skipped = []
+        while self.pending and self.running < self.concurrency:
+            event = self.pending.popleft()
+            if event.actorId in self.busy:
+                skipped.append(event)
+                continue
+            self._start(event)
+        self.pending.extendleft(reversed(skipped))
+
+    def _start(self, event):
+        actorId = event.actorId
+        self.running += 1
+        self.busy.add(actorId)
+        try:
+            d = toDeferred(self.fn(event))
+        except Exception:
+            d = defer.fail()
+        if d is None:
+            d = defer.succeed(None)
+        d.addErrback(log.err, "Handler %r failed" % self.__name__)
+        d.addCallback(self._finished, actorId)
+
+    def _finished(self, _, actorId):
+        self.running -= 1
+        self.busy.discard(actorId)
+        self._pump()
+        if self.onDrain is not None and not self.full:
+            self.onDrain()
+
+
+@attr.s
+class Coalescer(object):
+    """
+    Hold a handler's events for `window` seconds after the first one arrives,
+    keeping only the latest event of each name for each actor, then fire the
+    handler once per actor and name, or, with `batch=True`, once with the
+    list of those events.
+    """
+    fn = attr.ib()
+    window = attr.ib()
+    callLater = attr.ib(repr=False)
+    batch = attr.ib(default=False)
+    watch = attr.ib(default=watch, repr=False)
+
+    def __attrs_post_init__(self):
+        self.__name__ = self.fn.__name__
+        self.latest = OrderedDict()
+        self._flush = None
+
+    def __call__(self, event):
+        # a handler for several events must still see each kind of event
+        key = (event.actorId, event.name)
+        self.latest.pop(key, None)
+        self.latest[key] = event
+        if self._flush is None:
+            self._flush = self.callLater(self.window, self.flush)
+
+    def flush(self):
+        """
+        Fire the handler now for the events being held
+        """
+        if self._flush is not None and self._flush.active():
+            self._flush.cancel()
+        self._flush = None
+        events = list(self.latest.values())
+        self.latest.clear()
+        if not events:
+            return
+        if self.batch:
+            self.watch(self.__name__, self.fn(events))
+            return
+        for event in events:
+            self.watch(self.__name__, self.fn(event))
+
+
+@attr.s
+class PriorityBacklog(object):
+    """
+    Raw events waiting to be dispatched, in `lanes` first-in first-out lanes.
+    `classify` gives the lane of each event, 0 first.
+
+    popleft() takes from the first lane that has events, so that those in an
+    early lane are not held up behind a flood of events in later ones. A lane
+    that has waited while `starvationLimit` events were taken ahead of it
+    gets the next turn, so that every lane keeps moving.
+    """
+    lanes = attr.ib()
+    classify = attr.ib(repr=False)
+    starvationLimit = attr.ib(default=STARVATION_LIMIT)
+
+    def __attrs_post_init__(self):
+        self._lanes = [deque() for n in range(self.lanes)]
+        self._skipped = [0] * self.lanes
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, llEvent):
+        self._lanes[self.classify(llEvent)].append(llEvent)
+        self._size += 1
+
+    def extend(self, llEvents):
+        for llEvent in llEvents:
+            self.append(llEvent)
+
+    def popleft(self):
+        if not self._size:
+            raise IndexError("pop from an empty backlog")
+        lanes = self._lanes
+        skipped = self._skipped
+        first = turn = None
+        for n, lane in enumerate(lanes):
+            if not lane:
+                skipped[n] = 0
+            elif first is None:
+                first = n
+            elif turn is None and skipped[n] >= self.starvationLimit:
+                turn = n
+        if turn is None:
+            turn = first
+        for n in range(first + 1, len(lanes)):
+            if lanes[n] and n != turn:
+                skipped[n] += 1
+        skipped[turn] = 0
+        self._size -= 1
+        return lanes[turn].popleft()
+
+    def oldest(self):
+        """
+        The timeNano of the oldest event waiting, or None
+        """
+        heads = [lane[0]['timeNano'] for lane in self._lanes if lane]
+        return min(heads) if heads else None
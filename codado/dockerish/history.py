@@ -0,0 +1,182 @@
+"""
+Remember recent docker events
+"""
+from bisect import bisect_left, bisect_right
+
+from builtins import object
+
+import attr
+
+
+DEFAULT_CAPACITY = 10000
+
+NANO = 1000000000
+
+
+class _Index(object):
+    """
+    The sequence numbers of some events in the history, in the order they
+    arrived, with their timeNanos alongside for bisecting.
+
+    Events usually arrive in time order, but not always (e.g. those
+    synthesized by reconciliation are stamped "now", ahead of a stream resumed
+    from a checkpoint). So the times kept are the latest timeNano seen so far,
+    which never go backwards, and `slack` is the furthest behind that any
+    event has arrived; a query must widen its range by that much and check
+    the real times.
+
+    Events only ever leave from the old end, so removal just moves `start`
+    forward; the dead prefix is dropped once it is half the list.
+    """
+    __slots__ = ('times', 'seqs', 'start', 'slack')
+
+    def __init__(self):
+        self.times = []
+        self.seqs = []
+        self.start = 0
+        self.slack = 0
+
+    def __len__(self):
+        return len(self.seqs) - self.start
+
+    def append(self, timeNano, seq):
+        times = self.times
+        if times and timeNano < times[-1]:
+            self.slack = max(self.slack, times[-1] - timeNano)
+            timeNano = times[-1]
+        times.append(timeNano)
+        self.seqs.append(seq)
+
+    def popOldest(self):
+        self.start += 1
+        if self.start > 32 and self.start * 2 > len(self.seqs):
+            del self.times[:self.start]
+            del self.seqs[:self.start]
+            self.start = 0
+
+    def between(self, sinceNano, untilNano):
+        """
+        The sequence numbers of events that may have sinceNano <= timeNano <=
+        untilNano; if I have any `slack`, some may not
+        """
+        lo = self.start
+        if sinceNano is not None:
+            lo = bisect_left(self.times, sinceNano, lo)
+        hi = len(self.times)
+        if untilNano is not None:
+            hi = bisect_right(self.times, untilNano + self.slack, lo)
+        return self.seqs[lo:hi]
+
+
+def _toNano(seconds):
+    if seconds is None:
+        return None
+    return int(seconds * NANO)
+
+
+@attr.s
+class EventHistory(object):
+    """
+    A ring buffer of the last `capacity` Events seen by a DockerEngine,
+    indexed by actor id and by event name.
+
+    Queries bisect on time within an index, so they cost O(log n) plus the
+    number of events returned. Memory is bounded by `capacity`: once full,
+    each new event pushes out the oldest.
+
+    Times given to queries are in seconds, like `Event.time`.
+
+    Events are kept compacted (see Event.compact), without their actors'
+    attributes, unless `keepAttributes` is set.
+    """
+    capacity = attr.ib(default=DEFAULT_CAPACITY)
+    keepAttributes = attr.ib(default=False)
+
+    def __attrs_post_init__(self):
+        self._events = [None] * self.capacity
+        self._keys = [None] * self.capacity
+        self._seq = 0
+        self._all = _Index()
+        self._byActor = {}
+        self._byName = {}
+
+    def __len__(self):
+        return len(self._all)
+
+    def append(self, event):
+        """
+        Remember `event`, forgetting the oldest event if I am full
+        """
+        seq = self._seq
+        slot = seq % self.capacity
+        if seq >= self.capacity:
+            self._forget(slot)
+
+        if not self.keepAttributes:
+            event = event.compact()
+        key = (event.actorId, event.name)
+        self._events[slot] = event
+        self._keys[slot] = key
+        timeNano = event.timeNano
+        self._all.append(timeNano, seq)
+        self._byActor.setdefault(key[0], _Index()).append(timeNano, seq)
+        self._byName.setdefault(key[1], _Index()).append(timeNano, seq)
+        self._seq = seq + 1
+
+    def _forget(self, slot):
+        """
+        Remove the oldest event, at `slot`, from the indexes
+        """
+        actorId, name = self._keys[slot]
+        self._all.popOldest()
+        for indexes, key in ((self._byActor, actorId), (self._byName, name)):
+            index = indexes[key]
+            index.popOldest()
+            if not index:
+                del indexes[key]
+
+    def query(self, actorId=None, name=None, since=None, until=None):
+        """
+        The events for the actor `actorId` and/or with the dotted `name`, that
+        happened between `since` and `until` (inclusive), in the order they
+        arrived
+        """
+        if actorId is not None:
+            index = self._byActor.get(actorId)
+        elif name is not None:
+            index = self._byName.get(name)
+        else:
+            index = self._all
+        if index is None:
+            return []
+
+        capacity = self.capacity
+        sinceNano, untilNano = _toNano(since), _toNano(until)
+        ret = [self._events[seq % capacity]
+                for seq in index.between(sinceNano, untilNano)]
+        if index.slack:
+            ret = [ev for ev in ret
+                    if (sinceNano is None or ev.timeNano >= sinceNano)
+                    and (untilNano is None or ev.timeNano <= untilNano)]
+        if actorId is not None and name is not None:
+            ret = [ev for ev in ret if ev.name == name]
+        return ret
+
+    def latest(self, actorId=None, name=None):
+        """
+        The most recent event for the actor `actorId` and/or with the dotted
+        `name`, or None
+        """
+        if actorId is not None and name is not None:
+            found = self.query(actorId=actorId, name=name)
+            return found[-1] if found else None
+
+        if actorId is not None:
+            index = self._byActor.get(actorId)
+        elif name is not None:
+            index = self._byName.get(name)
+        else:
+            index = self._all
+        if not index:
+            return None
+        return self._events[index.seqs[-1] % self.capacity]
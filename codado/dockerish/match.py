@@ -0,0 +1,201 @@
+"""
+Choose the handlers for an event by what its actor is, without calling them
+
+    @engine.handler("container.die", image='corydodt/noms',
+            labels={'com.example.role': 'web'})
+    def onDie(self, event):
+        ...
+
+The handlers for each event name are indexed by their predicates, so an
+event only costs a check of the handlers that could match it.
+"""
+import fnmatch
+import re
+
+from builtins import object
+
+import attr
+
+
+GLOB_CHARS = re.compile(r'[*?[]')
+
+
+def _labelItems(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _signal(signal):
+    return None if signal is None else str(signal)
+
+
+@attr.s
+class Predicate(object):
+    """
+    What an event's actor must be for a handler to see it: every one of these
+    that is given must hold.
+
+    - `image`: the image name starts with this
+    - `labels`: each of these labels has this value
+    - `hasLabels`: each of these labels is present, with any value
+    - `name`: the actor name matches this glob, e.g. 'noms_*'
+    - `signal`: the signal of a kill event, e.g. 9 or '9'
+    """
+    image = attr.ib(default=None)
+    labels = attr.ib(default=(), converter=_labelItems)
+    hasLabels = attr.ib(default=(), converter=tuple)
+    name = attr.ib(default=None)
+    signal = attr.ib(default=None, converter=_signal)
+
+    def __attrs_post_init__(self):
+        self._nameMatch = None
+        if self.name is not None and GLOB_CHARS.search(self.name):
+            self._nameMatch = re.compile(fnmatch.translate(self.name)).match
+
+    def __bool__(self):
+        return bool(self.image is not None or self.labels or self.hasLabels
+                or self.name is not None or self.signal is not None)
+
+    @property
+    def namePrefix(self):
+        """
+        The part of the `name` glob before its first wildcard
+        """
+        return GLOB_CHARS.split(self.name, 1)[0]
+
+    def __call__(self, attributes):
+        """
+        Does an actor with docker's `attributes` dict match?
+        """
+        if self.image is not None and not (
+                attributes.get('image') or '').startswith(self.image):
+            return False
+        for key, value in self.labels:
+            if attributes.get(key) != value:
+                return False
+        for key in self.hasLabels:
+            if key not in attributes:
+                return False
+        if self.name is not None:
+            name = attributes.get('name')
+            if name is None:
+                return False
+            if self._nameMatch is None:
+                if name != self.name:
+                    return False
+            elif self._nameMatch(name) is None:
+                return False
+        if self.signal is not None and attributes.get('signal') != self.signal:
+            return False
+        return True
+
+
+class PrefixTrie(object):
+    """
+    Values stored under string prefixes, to find all of those stored under a
+    prefix of some string
+    """
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, prefix, value):
+        node = self.root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node.setdefault(None, []).append(value)
+        self.size += 1
+
+    def under(self, s):
+        """
+        Everything stored under a prefix of `s`
+        """
+        node = self.root
+        found = list(node.get(None, ()))
+        for ch in s:
+            node = node.get(ch)
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        return found
+
+
+class HandlerIndex(object):
+    """
+    The handlers for one event name, some of which have Predicates.
+
+    Each predicate is indexed by one of its conditions: a label value or
+    exact name in a dict, an image or name glob prefix in a PrefixTrie. An
+    event is only checked against the handlers that its actor's attributes
+    find in those indexes, plus any without a predicate.
+    """
+    def __init__(self, handlers):
+        self.handlers = tuple(handlers)
+        self.always = []
+        self.byLabel = {}
+        self.byLabelKey = {}
+        self.byName = {}
+        self.bySignal = {}
+        self.images = PrefixTrie()
+        self.names = PrefixTrie()
+        for position, (fn, predicate) in enumerate(self.handlers):
+            self._add(position, predicate)
+
+    def _add(self, position, predicate):
+        if not predicate:
+            self.always.append(position)
+        elif predicate.labels:
+            key, value = predicate.labels[0]
+            self.byLabel.setdefault(key, {}).setdefault(value, []).append(position)
+        elif predicate.name is not None and predicate._nameMatch is None:
+            self.byName.setdefault(predicate.name, []).append(position)
+        elif predicate.signal is not None:
+            self.bySignal.setdefault(predicate.signal, []).append(position)
+        elif predicate.image is not None:
+            self.images.add(predicate.image, position)
+        elif predicate.hasLabels:
+            self.byLabelKey.setdefault(predicate.hasLabels[0], []).append(position)
+        else:
+            self.names.add(predicate.namePrefix, position)
+
+    def select(self, attributes):
+        """
+        The handlers whose predicates match an actor with docker's
+        `attributes` dict, in the order they were registered
+        """
+        attributes = attributes or {}
+        candidates = list(self.always)
+        for key, byValue in self.byLabel.items():
+            value = attributes.get(key)
+            if value is not None:
+                candidates.extend(byValue.get(value, ()))
+        for key, positions in self.byLabelKey.items():
+            if key in attributes:
+                candidates.extend(positions)
+        name = attributes.get('name')
+        if name is not None:
+            candidates.extend(self.byName.get(name, ()))
+            if self.names.size:
+                candidates.extend(self.names.under(name))
+        signal = attributes.get('signal')
+        if signal is not None:
+            candidates.extend(self.bySignal.get(signal, ()))
+        if self.images.size:
+            candidates.extend(self.images.under(attributes.get('image') or ''))
+
+        handlers = self.handlers
+        ret = []
+        for position in sorted(candidates):
+            fn, predicate = handlers[position]
+            if not predicate or predicate(attributes):
+                ret.append(fn)
+        return tuple(ret)
+
+    def wrapped(self, wrap):
+        """
+        A copy of this index with each handler `fn` replaced by `wrap(fn)`
+        """
+        return HandlerIndex((wrap(fn), predicate)
+                for (fn, predicate) in self.handlers)
+
+    def __len__(self):
+        return len(self.handlers)
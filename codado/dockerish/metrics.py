@@ -0,0 +1,241 @@
+"""
+Measure how far behind docker a DockerEngine is running, and how long its
+handlers take
+"""
+from bisect import bisect_left
+import functools
+import time
+
+from builtins import object
+
+import attr
+
+from twisted.python import failure
+
+from zope.interface import Interface, implementer
+
+from codado.dockerish.flow import toDeferred
+
+
+# seconds between docker reporting an event and the engine dispatching it
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+        10.0, 30.0, 60.0)
+
+# seconds for a poll of the daemon, or the hop from stream reader to reactor
+FETCH_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+        5.0)
+
+# seconds taken by one handler call
+HANDLER_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01,
+        0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class IMetricsSink(Interface):
+    """
+    Something that a DockerEngine reports its measurements to.
+
+    Every method is called on the reactor thread, for every event or handler
+    call, so must be cheap.
+    """
+    def eventDispatched(name, lag):
+        """
+        The event called `name` was dispatched `lag` seconds after docker says
+        it happened
+        """
+
+    def fetched(seconds):
+        """
+        A poll of the daemon, or an event's hop from the stream reader to the
+        reactor, took `seconds`
+        """
+
+    def handlerFinished(name, seconds, failed):
+        """
+        A call of the handler `name` took `seconds`, and `failed` or not
+        """
+
+
+@attr.s
+class Histogram(object):
+    """
+    Counts of observations no greater than each of `buckets`, with their sum
+    """
+    buckets = attr.ib()
+
+    def __attrs_post_init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """
+        The cumulative count for each bucket bound, ending with +Inf, and the
+        sum and count
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+
+@attr.s
+class HandlerMetrics(object):
+    calls = attr.ib(default=0)
+    errors = attr.ib(default=0)
+    latency = attr.ib(default=attr.Factory(lambda: Histogram(HANDLER_BUCKETS)))
+
+
+@implementer(IMetricsSink)
+@attr.s
+class MetricsRecorder(object):
+    """
+    Keep the measurements of a DockerEngine in memory, for snapshot() and
+    renderPrometheus()
+    """
+    clock = attr.ib(default=time.monotonic, repr=False)
+
+    def __attrs_post_init__(self):
+        self.events = {}
+        self.lag = Histogram(LAG_BUCKETS)
+        self.fetch = Histogram(FETCH_BUCKETS)
+        self.handlers = {}
+        self._lastCounts = {}
+        self._lastTime = self.clock()
+
+    def eventDispatched(self, name, lag):
+        events = self.events
+        try:
+            events[name] += 1
+        except KeyError:
+            events[name] = 1
+        self.lag.observe(lag)
+
+    def fetched(self, seconds):
+        self.fetch.observe(seconds)
+
+    def handlerFinished(self, name, seconds, failed):
+        handler = self.handlers.get(name)
+        if handler is None:
+            handler = self.handlers[name] = HandlerMetrics()
+        handler.calls += 1
+        if failed:
+            handler.errors += 1
+        handler.latency.observe(seconds)
+
+    def snapshot(self):
+        """
+        Everything measured so far, as plain data. The events/sec of each
+        event name is over the time since the last snapshot.
+        """
+        now = self.clock()
+        elapsed = now - self._lastTime
+        events = {}
+        for name, count in self.events.items():
+            recent = count - self._lastCounts.get(name, 0)
+            events[name] = {'count': count,
+                    'perSecond': recent / elapsed if elapsed > 0 else 0.0}
+        self._lastCounts = dict(self.events)
+        self._lastTime = now
+        return {
+            'events': events,
+            'lag': self.lag.snapshot(),
+            'fetch': self.fetch.snapshot(),
+            'handlers': dict((name, {
+                'calls': h.calls,
+                'errors': h.errors,
+                'latency': h.latency.snapshot(),
+                }) for (name, h) in self.handlers.items()),
+            }
+
+
+def metered(fn, sink, clock=time.perf_counter):
+    """
+    Wrap the handler `fn` to report each call to the IMetricsSink `sink`,
+    timing asynchronous handlers until their result arrives
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def meteredHandler(event):
+        start = clock()
+        try:
+            result = fn(event)
+        except Exception:
+            sink.handlerFinished(name, clock() - start, True)
+            raise
+        d = None if result is None else toDeferred(result)
+        if d is None:
+            sink.handlerFinished(name, clock() - start, False)
+            return result
+
+        def finished(result):
+            sink.handlerFinished(name, clock() - start,
+                    isinstance(result, failure.Failure))
+            return result
+        return d.addBoth(finished)
+    return meteredHandler
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\')
+            .replace('"', r'\"').replace('\n', r'\n'))
+            for (k, v) in sorted(labels.items()))
+
+
+def _bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _histogram(lines, metric, snap, **labels):
+    for bound, count in snap['buckets']:
+        lines.append('%s_bucket%s %d' % (metric,
+            _labels(le=_bound(bound), **labels), count))
+    lines.append('%s_sum%s %r' % (metric, _labels(**labels), snap['sum']))
+    lines.append('%s_count%s %d' % (metric, _labels(**labels), snap['count']))
+
+
+def renderPrometheus(snapshot, prefix='dockerish'):
+    """
+    The Prometheus text exposition format of a MetricsRecorder snapshot
+    """
+    lines = []
+    def header(name, kind, help):
+        lines.append('# HELP %s_%s %s' % (prefix, name, help))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+
+    header('events_total', 'counter', 'Docker events dispatched, by event name')
+    for name, e in sorted(snapshot['events'].items()):
+        lines.append('%s_events_total%s %d' % (prefix, _labels(event=name),
+            e['count']))
+
+    header('event_lag_seconds', 'histogram',
+            'Seconds from docker reporting an event to its dispatch')
+    _histogram(lines, prefix + '_event_lag_seconds', snapshot['lag'])
+
+    header('fetch_seconds', 'histogram',
+            'Seconds for a poll of docker, or an event to reach the reactor')
+    _histogram(lines, prefix + '_fetch_seconds', snapshot['fetch'])
+
+    handlers = sorted(snapshot['handlers'].items())
+    header('handler_calls_total', 'counter', 'Handler calls')
+    for name, h in handlers:
+        lines.append('%s_handler_calls_total%s %d' % (prefix,
+            _labels(handler=name), h['calls']))
+    header('handler_errors_total', 'counter', 'Handler calls that failed')
+    for name, h in handlers:
+        lines.append('%s_handler_errors_total%s %d' % (prefix,
+            _labels(handler=name), h['errors']))
+    header('handler_seconds', 'histogram', 'Seconds taken by handler calls')
+    for name, h in handlers:
+        _histogram(lines, prefix + '_handler_seconds', h['latency'],
+                handler=name)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,142 @@
+"""
+Watch the events of many docker daemons with one DockerEngine
+"""
+import itertools
+
+from builtins import object
+
+import attr
+
+from twisted.internet import reactor
+
+import docker
+
+from codado.dockerish.event import DockerEngine, EventCursor, Health
+
+
+MERGE_DELAY_SECONDS = 0.1
+
+# never reschedule a merge sooner than this, however close the next event is
+MIN_RELEASE_DELAY_SECONDS = 0.001
+
+
+def clientForURL(url):
+    """
+    A docker client for the daemon at `url`, e.g. unix:///var/run/docker.sock
+    or tcp://10.0.0.5:2376
+    """
+    return docker.DockerClient(base_url=url)
+
+
+@attr.s
+class Endpoint(object):
+    """
+    One daemon being watched: its client, its position in its own event
+    stream, and whether it can be reached
+    """
+    host = attr.ib()
+    client = attr.ib()
+    cursor = attr.ib(default=attr.Factory(EventCursor))
+    stream = attr.ib(default=None)
+    health = attr.ib(default=attr.Factory(Health))
+
+
+@attr.s
+class MultiDockerEngine(DockerEngine):
+    """
+    A DockerEngine over the daemons at `endpoints` (a list of docker URLs).
+
+    Each daemon gets its own streaming connection, read in its own thread and
+    reconnected on its own, so one slow or dead host does not hold up the
+    others. Events from every host are merged into one dispatch ordered by
+    timeNano: each is held back for `mergeDelay` seconds after it arrives so
+    that slightly earlier events from other hosts can overtake it, and is
+    then dispatched together with anything older still being held.
+
+    Every Event has `.host` set to the URL it came from, and its .container
+    etc. are looked up on that host. Each host is reconnected with its own
+    backoff, and healthFor(url) says whether it can be reached; the
+    `dockerish.disconnected` and `dockerish.reconnected` events have the
+    `.host` they are about.
+
+    `clientFactory` is called with each URL to make its client.
+    """
+    endpoints = attr.ib(default=attr.Factory(list))
+    mergeDelay = attr.ib(default=MERGE_DELAY_SECONDS)
+
+    seconds = reactor.seconds
+
+    _nextRelease = None
+
+    def run(self):
+        """
+        Connect to every docker daemon and begin listening for events
+        """
+        assert self.checkpoint is None, "checkpoints are per-daemon"
+        assert not self.reconcile, "reconciliation is per-daemon"
+        self._pending = []
+        self._arrivals = itertools.count()
+        DockerEngine.run(self)
+
+    def _connect(self):
+        """
+        Make a client for every daemon; there is no single client
+        """
+        factory = self.clientFactory or clientForURL
+        self._endpoints = dict((url, Endpoint(url, factory(url),
+                    health=self._newHealth())) for url in self.endpoints)
+        return None
+
+    def _startEvents(self, since):
+        for url in self.endpoints:
+            self.callInThread(self._readStream, since, url)
+
+    def stop(self):
+        DockerEngine.stop(self)
+        for endpoint in getattr(self, '_endpoints', {}).values():
+            if endpoint.stream is not None:
+                endpoint.stream.close()
+        if self._nextRelease is not None and self._nextRelease.active():
+            self._nextRelease.cancel()
+
+    def clientFor(self, host):
+        return self._endpoints[host].client
+
+    def cursorFor(self, host):
+        return self._endpoints[host].cursor
+
+    def healthFor(self, host):
+        return self._endpoints[host].health
+
+    def _setStream(self, host, stream):
+        self._endpoints[host].stream = stream
+
+    def _receive(self, host, llEvent):
+        """
+        Tag an event with its host and hold it for merging
+        """
+        llEvent['host'] = host
+        self._pending.append(
+                (llEvent['timeNano'], next(self._arrivals), self.seconds(), llEvent))
+        if self._nextRelease is None:
+            self._nextRelease = self.callLater(self.mergeDelay, self._release)
+        self._updateFlow()
+
+    def _release(self):
+        """
+        Dispatch the held events that have waited `mergeDelay`, along with any
+        that are older than them, in timeNano order
+        """
+        self._nextRelease = None
+        cutoff = self.seconds() - self.mergeDelay
+        due = [p for p in self._pending if p[2] <= cutoff]
+        if due:
+            mark = max(p[0] for p in due)
+            released = sorted(p for p in self._pending if p[0] <= mark)
+            self._pending = [p for p in self._pending if p[0] > mark]
+            self._backlog.extend(p[3] for p in released)
+            self._drain()
+        if self._pending:
+            wait = min(p[2] for p in self._pending) - cutoff
+            self._nextRelease = self.callLater(
+                    max(wait, MIN_RELEASE_DELAY_SECONDS), self._release)
@@ -0,0 +1,227 @@
+"""
+Record docker events to a file, and replay them to a DockerEngine without a
+docker daemon
+
+A recording is newline-delimited JSON: one raw docker-py event dict per line,
+exactly as `client.events(decode=True)` produced it.
+"""
+import json
+import time
+
+from builtins import object
+
+import attr
+
+
+NANO = 1000000000
+
+
+def dumpEvent(llEvent):
+    """
+    The compact recorded form of a raw event dict, with no newline
+    """
+    return json.dumps(llEvent, separators=(',', ':'), sort_keys=True)
+
+
+@attr.s
+class EventRecorder(object):
+    """
+    Write raw docker events to the open file `fp`
+    """
+    fp = attr.ib()
+    count = attr.ib(default=0, init=False)
+
+    def record(self, llEvent):
+        self.fp.write(dumpEvent(llEvent) + '\n')
+        self.count += 1
+
+
+@attr.s
+class EventStream(object):
+    """
+    An iterator of `events`, which, like docker-py's CancellableStream, a
+    DockerEngine can close() from another thread while a stream reader is
+    waiting on it: the `source` it reads from (if it has a close()) is
+    closed, and iteration ends.
+    """
+    events = attr.ib()
+    source = attr.ib(default=None)
+    closed = attr.ib(default=False, init=False)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        return next(self.events)
+
+    def close(self):
+        self.closed = True
+        close = getattr(self.source, 'close', None)
+        if close is not None:
+            close()
+
+
+@attr.s
+class RecordingClient(object):
+    """
+    Wrap a docker client so that every event it reads is also written to
+    `recorder`. Everything else is passed through to `client`.
+
+    Use `lambda: RecordingClient(docker.from_env(), recorder)` as a
+    DockerEngine's clientFactory to record a live engine.
+    """
+    client = attr.ib()
+    recorder = attr.ib()
+
+    def events(self, decode=None, **kw):
+        """
+        The client's events, recorded as they are read
+        """
+        stream = self.client.events(decode=True, **kw)
+        return EventStream(self._record(stream, decode), stream)
+
+    def _record(self, stream, decode):
+        for llEvent in stream:
+            # record first: the engine takes the dict apart as it dispatches
+            self.recorder.record(llEvent)
+            yield llEvent if decode else dumpEvent(llEvent).encode('utf-8') + b'\n'
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def matchesFilters(llEvent, filters):
+    """
+    Apply the type and event filters of the docker events API to a raw event
+    """
+    if not filters:
+        return True
+    if 'type' in filters and llEvent.get('Type') not in filters['type']:
+        return False
+    if 'event' in filters:
+        # like the daemon, "exec_start" matches "exec_start: /bin/sh ..."
+        action = llEvent.get('Action', '')
+        if (action not in filters['event']
+                and action.split(':')[0] not in filters['event']):
+            return False
+    return True
+
+
+@attr.s
+class ReplayClient(object):
+    """
+    A stand-in for a docker client whose `events` come from a recording.
+
+    `lines` are the lines of a recording. With `speed=None` they are replayed
+    as fast as possible: each call to `events` returns everything not yet
+    replayed. With a `speed` (1.0 is as recorded), the recording is shifted
+    to begin when the client is made, each event becomes available when its
+    shifted time comes around, and a stream without `until` sleeps between
+    events.
+    """
+    lines = attr.ib()
+    speed = attr.ib(default=None)
+    clock = attr.ib(default=time.time, repr=False)
+    sleep = attr.ib(default=time.sleep, repr=False)
+
+    def __attrs_post_init__(self):
+        self.lines = [line for line in self.lines if line.strip()]
+        self.position = 0
+        self.started = self.clock()
+        self._first = None
+        if self.lines:
+            self._first = json.loads(self.lines[0])['timeNano']
+
+    @classmethod
+    def fromFile(cls, path, **kw):
+        """
+        Replay the recording at `path`
+        """
+        with open(path, 'rb') as f:
+            return cls(f.readlines(), **kw)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def _decode(self, line):
+        llEvent = json.loads(line)
+        if self.speed is not None:
+            shifted = int(self.started * NANO) + int(round(
+                    (llEvent['timeNano'] - self._first) / self.speed))
+            llEvent['timeNano'] = shifted
+            llEvent['time'] = shifted // NANO
+        return llEvent
+
+    def events(self, decode=None, since=None, until=None, filters=None):
+        """
+        Replay the recorded events that haven't been replayed yet, like
+        docker-py's client.events: raw event dicts with `decode=True`, or else
+        the bytes of one event per line
+        """
+        if not decode:
+            return EventStream(self._replayRaw(until, filters))
+        return EventStream(llEvent for llEvent in self._replay(until)
+                if matchesFilters(llEvent, filters))
+
+    def _replayRaw(self, until, filters):
+        if self.speed is None and not filters:
+            # as recorded, so there is no need to decode anything
+            while self.position < len(self.lines):
+                line = self.lines[self.position]
+                self.position += 1
+                if not isinstance(line, bytes):
+                    line = line.encode('utf-8')
+                yield line.rstrip(b'\n') + b'\n'
+            return
+        for llEvent in self._replay(until):
+            if matchesFilters(llEvent, filters):
+                yield dumpEvent(llEvent).encode('utf-8') + b'\n'
+
+    def _replay(self, until):
+        while self.position < len(self.lines):
+            llEvent = self._decode(self.lines[self.position])
+            if self.speed is not None:
+                due = llEvent['timeNano'] / float(NANO)
+                if until is not None:
+                    if due > float(until):
+                        return
+                else:
+                    wait = due - self.clock()
+                    if wait > 0:
+                        self.sleep(wait)
+            self.position += 1
+            yield llEvent
+
+
+def synthesize(count, containers=100, start=1500000000):
+    """
+    Make `count` raw events of the sort a busy docker host produces, mostly
+    health check exec events, spread over `containers` containers
+    """
+    check = 'exec_%s: /bin/sh -c curl -f http://localhost/ || exit 1'
+    actions = [check % 'create', check % 'start', 'exec_die',
+            'health_status: healthy',
+            check % 'create', check % 'start', 'exec_die',
+            'start', 'die', 'stop']
+    ret = []
+    for n in range(count):
+        cid = '%064x' % (n % containers)
+        timeNano = start * NANO + n * 1000
+        action = actions[n % len(actions)]
+        ret.append({
+            'status': action,
+            'id': cid,
+            'from': 'corydodt/noms',
+            'Type': 'container',
+            'Action': action,
+            'Actor': {'ID': cid, 'Attributes': {
+                'image': 'corydodt/noms',
+                'name': 'noms_%d' % (n % containers),
+                'com.example.role': 'web'}},
+            'scope': 'local',
+            'time': timeNano // NANO,
+            'timeNano': timeNano,
+            })
+    return ret
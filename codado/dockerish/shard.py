@@ -0,0 +1,364 @@
+"""
+Run the handlers of a DockerEngine in worker processes
+
+    engine = ShardedDockerEngine(ownerName='mymodule:MyMonitor', workers=4)
+    engine.run()
+
+Each worker is `python -m codado.dockerish.shard mymodule:MyMonitor`,
+speaking AMP on stdin/stdout.
+"""
+from __future__ import print_function
+
+from collections import deque
+import functools
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+import zlib
+
+from builtins import object
+
+import attr
+
+from twisted.internet import defer, endpoints, reactor, stdio
+from twisted.protocols import amp
+from twisted.python import log
+
+from codado.tx import JSON
+from codado.dockerish.event import ALL_EVENTS, DockerEngine, Event, eventName
+from codado.dockerish.flow import toDeferred
+
+
+SHARD_WORKERS = 4
+
+# events waiting for one worker before the engine stops reading more
+SHARD_QUEUE_SIZE = 1000
+
+# batches sent to one worker that it has yet to answer
+SHARD_IN_FLIGHT = 2
+
+# keep each batch under AMP's limit of 65535 bytes per value
+SHARD_BATCH_BYTES = 60000
+
+
+def shardFor(actorId, count):
+    """
+    The worker, of `count`, that handles events for the actor `actorId`. This
+    is the same in every process, unlike hash().
+    """
+    return zlib.crc32((actorId or '').encode('utf-8')) % count
+
+
+def encodeEvent(llEvent):
+    """
+    The compact form of a raw event dict that is shipped to a worker
+    """
+    return json.dumps(llEvent, separators=(',', ':')).encode('utf-8')
+
+
+def ownerClass(spec):
+    """
+    Import the class named by "module:Class"
+    """
+    moduleName, className = spec.split(':')
+    return getattr(importlib.import_module(moduleName), className)
+
+
+class Dispatch(amp.Command):
+    """
+    Dispatch a batch of raw events, one compact JSON document per line.
+
+    Answers with the calls, errors and total seconds of each handler, and the
+    handler failures, since the last answer.
+    """
+    arguments = [(b'events', amp.String())]
+    response = [(b'timings', JSON()), (b'errors', JSON())]
+
+
+class ShardWorker(amp.AMP):
+    """
+    The worker end: dispatches the events it is sent to its own instance of
+    the owner class, timing each handler
+    """
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, owner, onLost=None):
+        amp.AMP.__init__(self)
+        self.owner = owner
+        self.onLost = onLost
+        # an engine of its own, so that workers can share a process in tests
+        self.engine = owner.engine = attr.evolve(owner.engine)
+        self.engine.owner = owner
+        self.timings = {}
+        self.errors = []
+        self._waiting = []
+        names = set()
+        for fnNames in self.engine.handlers.values():
+            names.update(fnNames)
+        # the engine binds these in place of the owner's own methods
+        for name in names:
+            setattr(owner, name, self._timed(name, getattr(owner, name)))
+
+    def start(self):
+        """
+        Connect to docker for the handlers' lookups, and fire dockerish.init
+        """
+        engine = self.engine
+        try:
+            engine.client = engine._connect()
+        except Exception:
+            log.err(None, "Worker could not connect to docker")
+            engine.client = None
+        # queued handlers resume the engine when they drain
+        engine._startFlow()
+        engine._compileHandlers()
+        engine._callHandlers('dockerish.init', engine.initEvent(time.time()))
+
+    def _timed(self, name, fn):
+        @functools.wraps(fn)
+        def timedHandler(event):
+            start = self.clock()
+            try:
+                d = toDeferred(fn(event))
+            except Exception:
+                self._failed(name, event, traceback.format_exc())
+                self._record(name, start)
+                return None
+            if d is None:
+                self._record(name, start)
+                return None
+            d.addErrback(lambda f: self._failed(name, event, f.getTraceback()))
+            d.addBoth(lambda _: self._record(name, start))
+            self._waiting.append(d)
+            return d
+        return timedHandler
+
+    def _record(self, name, start):
+        timing = self.timings.setdefault(name, [0, 0, 0.0])
+        timing[0] += 1
+        timing[2] += self.clock() - start
+
+    def _failed(self, name, event, text):
+        self.timings.setdefault(name, [0, 0, 0.0])[1] += 1
+        self.errors.append([name, event.name, event.actorId, text])
+
+    @Dispatch.responder
+    def dispatch(self, events):
+        fire = self.engine._fire
+        for line in events.splitlines():
+            fire(json.loads(line))
+        waiting, self._waiting = self._waiting, []
+        d = defer.DeferredList(waiting)
+        d.addCallback(lambda _: self._report())
+        return d
+
+    def _report(self):
+        ret = dict(timings=self.timings, errors=self.errors)
+        self.timings = {}
+        self.errors = []
+        return ret
+
+    def connectionLost(self, reason):
+        amp.AMP.connectionLost(self, reason)
+        self.engine.stop()
+        if self.onLost is not None:
+            self.onLost()
+
+
+class WorkerProtocol(amp.AMP):
+    """
+    The engine end of the AMP connection to a worker process
+    """
+    def makeConnection(self, transport):
+        # a process transport has no addresses, which amp.AMP asks for
+        self._transportPeer = self._transportHost = None
+        amp.BinaryBoxProtocol.makeConnection(self, transport)
+
+
+def spawnWorker(ownerName, index):
+    """
+    Start worker process number `index`, returning a Deferred that fires with
+    the AMP protocol connected to it
+    """
+    ep = endpoints.ProcessEndpoint(reactor, sys.executable,
+            [sys.executable, '-m', 'codado.dockerish.shard', ownerName],
+            env=os.environ)
+    return endpoints.connectProtocol(ep, WorkerProtocol())
+
+
+@attr.s
+class HandlerStats(object):
+    """
+    The calls, errors and time taken of one handler, across all workers
+    """
+    name = attr.ib()
+    calls = attr.ib(default=0)
+    errors = attr.ib(default=0)
+    seconds = attr.ib(default=0.0)
+
+
+@attr.s
+class Shard(object):
+    """
+    The engine end of one worker: the events waiting for it, sent to it in
+    batches of up to SHARD_BATCH_BYTES, with at most SHARD_IN_FLIGHT
+    unanswered.
+
+    `full` once `queueSize` events are waiting; `onDrain` is called when there
+    is room again.
+    """
+    index = attr.ib()
+    onReply = attr.ib(repr=False)
+    queueSize = attr.ib(default=SHARD_QUEUE_SIZE)
+    onDrain = attr.ib(default=None, repr=False)
+
+    def __attrs_post_init__(self):
+        self.protocol = None
+        self.pending = deque()
+        self.inFlight = 0
+
+    @property
+    def full(self):
+        return len(self.pending) >= self.queueSize
+
+    def connected(self, protocol):
+        self.protocol = protocol
+        self._pump()
+        return protocol
+
+    def send(self, line):
+        self.pending.append(line)
+        self._pump()
+
+    def _pump(self):
+        pending = self.pending
+        while (self.protocol is not None and pending
+                and self.inFlight < SHARD_IN_FLIGHT):
+            batch = [pending.popleft()]
+            size = len(batch[0])
+            while pending and size + len(pending[0]) + 1 <= SHARD_BATCH_BYTES:
+                line = pending.popleft()
+                batch.append(line)
+                size += len(line) + 1
+            self.inFlight += 1
+            d = self.protocol.callRemote(Dispatch, events=b'\n'.join(batch))
+            d.addCallback(self.onReply, self)
+            d.addErrback(log.err, "Worker %d failed to dispatch" % self.index)
+            d.addBoth(self._answered)
+
+    def _answered(self, _):
+        self.inFlight -= 1
+        self._pump()
+        if self.onDrain is not None and not self.full:
+            self.onDrain()
+
+    def close(self):
+        if self.protocol is not None:
+            self.protocol.transport.loseConnection()
+            self.protocol = None
+
+
+@attr.s
+class ShardedDockerEngine(DockerEngine):
+    """
+    A DockerEngine that runs the handlers of the owner class `ownerName`
+    ("module:Class", whose `engine` holds the handlers) in `workers` worker
+    processes, for handlers that do enough CPU work to hold up the reactor.
+
+    Each worker makes its own instance of the owner. Events are sent to
+    workers by a hash of their actor id, so all the events for one container
+    go to the same worker, in order.
+
+    `handlerStats` collects the calls, errors and time taken of each handler
+    from every worker, and handler failures are logged here.
+
+    `spawn(ownerName, index)` starts a worker and returns a Deferred of the
+    AMP protocol connected to it.
+    """
+    ownerName = attr.ib(default=None)
+    workers = attr.ib(default=SHARD_WORKERS)
+    spawn = attr.ib(default=spawnWorker)
+    handlerStats = attr.ib(default=attr.Factory(dict))
+
+    def run(self):
+        """
+        Start the workers, and begin listening for docker events
+        """
+        template = ownerClass(self.ownerName).engine
+        self.handlers = template.handlers
+        self.eventFilters = dict(template.eventFilters, **self.eventFilters)
+        self._shards = []
+        for index in range(self.workers):
+            shard = Shard(index, onReply=self._reply, onDrain=self._resume)
+            d = self.spawn(self.ownerName, index)
+            d.addCallback(shard.connected)
+            d.addErrback(log.err, "Worker %d failed to start" % index)
+            self._shards.append(shard)
+        DockerEngine.run(self)
+
+    def stop(self):
+        DockerEngine.stop(self)
+        for shard in getattr(self, '_shards', ()):
+            shard.close()
+
+    def _compileHandlers(self):
+        """
+        Note which events have handlers; the workers do the rest
+        """
+        self._dispatchTable = {}
+        self._wrappedHandlers = {}
+        self._wanted = set(name for (name, fns) in self.handlers.items() if fns)
+        self._queues = tuple(self._shards)
+        self._filters = self.serverFilters()
+
+    def _callHandlers(self, eventName, event):
+        """
+        Workers fire their own dockerish.init
+        """
+
+    def _fire(self, llEvent):
+        """
+        Send a raw event to the worker for its actor
+        """
+        wanted = self._wanted
+        name = eventName(llEvent)
+        if not (ALL_EVENTS in wanted or name in wanted
+                or name.split('.')[0] + '.*' in wanted):
+            return
+        line = encodeEvent(llEvent)
+        if self.history is not None:
+            self.history.append(Event.fromLowLevelEvent(self, dict(llEvent)))
+        actorId = llEvent.get('Actor', {}).get('ID')
+        self._shards[shardFor(actorId, len(self._shards))].send(line)
+
+    def _reply(self, response, shard):
+        """
+        Collect a worker's handler timings, and log its handler failures
+        """
+        for name, (calls, errors, seconds) in response['timings'].items():
+            stats = self.handlerStats.setdefault(name, HandlerStats(name))
+            stats.calls += calls
+            stats.errors += errors
+            stats.seconds += seconds
+        for name, evName, actorId, text in response['errors']:
+            log.msg("Handler %r failed in worker %d for %s of %s:\n%s" % (
+                name, shard.index, evName, actorId, text), isError=True)
+
+
+def workerMain(ownerName):
+    """
+    Run a worker for the owner class `ownerName` on stdin/stdout, until the
+    engine hangs up
+    """
+    log.startLogging(sys.stderr)
+    worker = ShardWorker(ownerClass(ownerName)(), onLost=reactor.stop)
+    worker.start()
+    stdio.StandardIO(worker)
+    reactor.run()
+
+
+if __name__ == '__main__':  # pragma: nocover
+    workerMain(sys.argv[1])
@@ -0,0 +1,193 @@
+"""
+Compile a JSON schema into a Python function that checks values against it
+
+    validate = compileSchema({'type': 'object', 'required': ['id'],
+        'properties': {'id': {'type': 'string', 'maxLength': 64}}})
+    validate({'id': 'abc'})  # or raises ValidationError
+
+The schema is turned into the source of one function, with a plain test
+for each of its rules, so that checking a value doesn't walk the schema.
+It understands this subset of JSON Schema: type, enum, properties, required,
+additionalProperties, items, minimum, maximum, minLength, maxLength,
+minItems and maxItems.
+"""
+from builtins import object
+
+
+class ValidationError(ValueError):
+    """
+    A value does not match a schema
+    """
+
+
+# how to test that the value in `v` is each JSON type
+TYPE_TESTS = {
+    'object': 'type(%(v)s) is dict',
+    'array': 'type(%(v)s) is list',
+    'string': 'type(%(v)s) is str',
+    'integer': 'type(%(v)s) is int',
+    'number': '(type(%(v)s) is int or type(%(v)s) is float)',
+    'boolean': 'type(%(v)s) is bool',
+    'null': '%(v)s is None',
+}
+
+# the rules that only apply to values of one type
+TYPE_RULES = {
+    'object': ('properties', 'required', 'additionalProperties'),
+    'array': ('items', 'minItems', 'maxItems'),
+    'string': ('minLength', 'maxLength'),
+    'number': ('minimum', 'maximum'),
+}
+
+KNOWN_RULES = set(['type', 'enum', 'description', 'title']).union(
+        *TYPE_RULES.values())
+
+
+class _Compiler(object):
+    """
+    Build up the source of a validating function
+    """
+    def __init__(self):
+        self.lines = []
+        self.constants = {}
+        self.names = 0
+
+    def name(self, prefix):
+        self.names += 1
+        return '%s%d' % (prefix, self.names)
+
+    def constant(self, value):
+        name = self.name('C')
+        self.constants[name] = value
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def fail(self, indent, path, message, *args):
+        """
+        Emit a raise of ValidationError, with `message` % (path, *args)
+        """
+        self.emit(indent, 'raise ValidationError(%r %% (%s))' % (
+            message, ', '.join((path,) + args)))
+
+    def rule(self, schema, v, path, indent):
+        """
+        Emit the tests of the value in the variable `v`, whose location in
+        the document is the Python expression `path`
+        """
+        unknown = set(schema) - KNOWN_RULES
+        if unknown:
+            raise ValueError("Unsupported schema rules: %s" % ', '.join(sorted(unknown)))
+
+        types = schema.get('type')
+        if types is not None:
+            if not isinstance(types, list):
+                types = [types]
+            for t in types:
+                if t not in TYPE_TESTS:
+                    raise ValueError("Unknown schema type %r" % t)
+            test = ' or '.join(TYPE_TESTS[t] % {'v': v} for t in types)
+            self.emit(indent, 'if not (%s):' % test)
+            self.fail(indent + 1, path, '%s: expected %s, got %s',
+                    repr(' or '.join(types)), 'type(%s).__name__' % v)
+
+        if 'enum' in schema:
+            self.emit(indent, 'if %s not in %s:' % (v, self.constant(list(schema['enum']))))
+            self.fail(indent + 1, path, '%s: %r is not one of %r', v,
+                    repr(list(schema['enum'])))
+
+        for kind in ('object', 'array', 'string', 'number'):
+            if not any(r in schema for r in TYPE_RULES[kind]):
+                continue
+            inner = indent
+            if types is None or len(types) > 1 or (
+                    types[0] != kind and not (kind == 'number' and types[0] == 'integer')):
+                # the rules only apply to values of their type
+                self.emit(indent, 'if %s:' % (TYPE_TESTS[kind] % {'v': v}))
+                inner = indent + 1
+            getattr(self, kind)(schema, v, path, inner)
+
+    def object(self, schema, v, path, indent):
+        properties = schema.get('properties', {})
+        for key in schema.get('required', ()):
+            self.emit(indent, 'if %r not in %s:' % (key, v))
+            self.fail(indent + 1, path, '%s: missing %r', repr(key))
+
+        extra = schema.get('additionalProperties', True)
+        if extra is not True:
+            k = self.name('k')
+            self.emit(indent, 'for %s in %s:' % (k, v))
+            self.emit(indent + 1, 'if %s not in %s:' % (k,
+                self.constant(frozenset(properties))))
+            if extra is False:
+                self.fail(indent + 2, path, '%s: unexpected key %r', k)
+            else:
+                self.rule(extra, '%s[%s]' % (v, k), '%s + "." + %s' % (path, k),
+                        indent + 2)
+
+        for key, subschema in sorted(properties.items()):
+            sub = self.name('v')
+            if key in schema.get('required', ()):
+                self.emit(indent, '%s = %s[%r]' % (sub, v, key))
+                self.rule(subschema, sub, '%s + %r' % (path, '.' + key), indent)
+            else:
+                self.emit(indent, '%s = %s.get(%r, MISSING)' % (sub, v, key))
+                self.emit(indent, 'if %s is not MISSING:' % sub)
+                self.emit(indent + 1, 'pass')
+                self.rule(subschema, sub, '%s + %r' % (path, '.' + key), indent + 1)
+
+    def array(self, schema, v, path, indent):
+        if 'minItems' in schema:
+            self.emit(indent, 'if len(%s) < %d:' % (v, schema['minItems']))
+            self.fail(indent + 1, path, '%s: fewer than %d items',
+                    repr(schema['minItems']))
+        if 'maxItems' in schema:
+            self.emit(indent, 'if len(%s) > %d:' % (v, schema['maxItems']))
+            self.fail(indent + 1, path, '%s: more than %d items',
+                    repr(schema['maxItems']))
+        if 'items' in schema:
+            i = self.name('i')
+            item = self.name('v')
+            self.emit(indent, 'for %s, %s in enumerate(%s):' % (i, item, v))
+            self.emit(indent + 1, 'pass')
+            self.rule(schema['items'], item, '%s + "[%%d]" %% %s' % (path, i),
+                    indent + 1)
+
+    def string(self, schema, v, path, indent):
+        if 'minLength' in schema:
+            self.emit(indent, 'if len(%s) < %d:' % (v, schema['minLength']))
+            self.fail(indent + 1, path, '%s: shorter than %d',
+                    repr(schema['minLength']))
+        if 'maxLength' in schema:
+            self.emit(indent, 'if len(%s) > %d:' % (v, schema['maxLength']))
+            self.fail(indent + 1, path, '%s: longer than %d',
+                    repr(schema['maxLength']))
+
+    def number(self, schema, v, path, indent):
+        if 'minimum' in schema:
+            self.emit(indent, 'if %s < %r:' % (v, schema['minimum']))
+            self.fail(indent + 1, path, '%s: %r is less than %r', v,
+                    repr(schema['minimum']))
+        if 'maximum' in schema:
+            self.emit(indent, 'if %s > %r:' % (v, schema['maximum']))
+            self.fail(indent + 1, path, '%s: %r is more than %r', v,
+                    repr(schema['maximum']))
+
+
+def compileSchema(schema):
+    """
+    A function that checks a decoded JSON value against `schema`, raising
+    ValidationError, or raises ValueError if the schema has rules that
+    aren't understood. Its `source` is the Python it was compiled from.
+    """
+    compiler = _Compiler()
+    compiler.emit(1, 'pass')
+    compiler.rule(schema, 'v0', '"$"', 1)
+    source = 'def validate(v0):\n%s\n' % '\n'.join(compiler.lines)
+    namespace = dict(compiler.constants, ValidationError=ValidationError,
+            MISSING=object())
+    exec(compile(source, '<schema>', 'exec'), namespace)
+    validate = namespace['validate']
+    validate.source = source
+    return validate
@@ -0,0 +1,265 @@
+"""
+Fixtures shared by the dockerish tests
+"""
+from builtins import object
+
+from pytest import fixture
+
+from mock import MagicMock, patch
+
+import docker
+
+from codado.dockerish import event
+
+
+@fixture
+def mkEvent():
+    """
+    Build the low-level dict of a docker event at `timeNano`, for an actor
+    """
+    def mkEvent(timeNano, actorId, action='start', kind='container'):
+        return {"Type": kind, "Action": action,
+                "Actor": {"ID": actorId, "Attributes": {}},
+                "time": timeNano // 1000000000, "timeNano": timeNano}
+    return mkEvent
+
+
+@fixture
+def dockerClientLowLevel():
+    """
+    A docker client mock
+    """
+    cli = MagicMock()
+    class Items(object):
+        def __init__(self, dct):
+            self.dct = dct
+
+        def get(self, key):
+            ret = self.dct.get(key)
+            if ret is None:
+                raise docker.errors.NotFound(key)
+            return ret
+ 
+    cli.images = Items({'sha256:12345': 'animage'})
+    cli.containers = Items({'12347': 'acontainer'})
+    cli.networks = Items({'12349': 'anetwork'})
+    cli.volumes = Items({'12351': 'avolume'})
+    cli.plugins = Items({"vieux/sshfs": 'aplugin'})
+    return cli
+
+
+@fixture
+def fromEnv():
+    """
+    Keep DockerEngine.run() from connecting to a real docker daemon
+    """
+    class FakeClient(object):
+        def events(self, decode=None, since=None, until=None, filters=None):
+            return iter(())
+
+    with patch.object(docker, 'from_env', autospec=True,
+            side_effect=FakeClient) as m:
+        yield m
+
+
+@fixture
+def engine(dockerClientLowLevel):
+    """
+    A DockerEngine already connected to the docker client mock
+    """
+    eng = event.DockerEngine()
+    eng.client = dockerClientLowLevel
+    return eng
+
+
+@fixture
+def imageActorLowLevel():
+    """
+    The low-level dict of an image event actor from docker
+    """
+    return {"ID": "sha256:12345","Attributes": {"name": "sha256:12345"}}
+
+
+@fixture
+def imageEventLowLevel(imageActorLowLevel):
+    """
+    A low-level event from a docker image
+    """
+    return {
+            "status": "delete",
+            "id": "sha256:12345",
+            "Type": "image",
+            "Action": "delete",
+            "Actor": imageActorLowLevel,
+            "time": 1497218060,
+            "timeNano": 1497218060835756369
+            }
+
+
+@fixture
+def containerActorLowLevel():
+    """
+    The low-level dict of a container event actor from docker
+    """
+    return {
+            "ID": "12347",
+            "Attributes": {
+                "image": "twist",
+                "name": "peaceful_booth"
+                }
+            }
+
+
+@fixture
+def containerEventLowLevel(containerActorLowLevel):
+    """
+    A low-level event from a docker container
+    """
+    return {"status": "create",
+            "id": "12347",
+            "from": "abc123",
+            "Type": "container",
+            "Action": "create",
+            "Actor": containerActorLowLevel,
+            "time": 1497218188,
+            "timeNano": 1497218188361178103
+            }
+
+
+@fixture
+def containerActorDestroyLowLevel():
+    """
+    The low-level dict of a container event actor from docker
+    """
+    return {
+            "ID": "deadbeef",
+            "Attributes": {
+                "image": "twist",
+                "name": "peaceful_booth"
+                }
+            }
+
+
+@fixture
+def containerEventDestroyLowLevel(containerActorDestroyLowLevel):
+    """
+    A low-level event from a docker container
+    """
+    return {"status": "create",
+            "id": "deadbeef",
+            "from": "abc123",
+            "Type": "container",
+            "Action": "destroy",
+            "Actor": containerActorDestroyLowLevel,
+            "time": 1497218188,
+            "timeNano": 1497218188361178103
+            }
+
+
+@fixture
+def networkActorLowLevel():
+    return {
+            "ID": "12349",
+            "Attributes":
+                {"container": "12347",
+                 "name": "bridge",
+                 "type": "bridge"
+                 }
+            }
+
+
+@fixture
+def networkEventLowLevel(networkActorLowLevel):
+    return {
+            "Type": "network",
+            "Action": "connect",
+            "Actor": networkActorLowLevel,
+            "time": 1497218188,
+            "timeNano": 1497218188440356384
+            }
+
+
+@fixture
+def networkActorDestroyLowLevel():
+    return {
+            "ID": "deadcafe",
+            "Attributes":
+                {"container": "12347",
+                 "name": "bridge",
+                 "type": "bridge"
+                 }
+            }
+
+
+@fixture
+def networkEventDestroyLowLevel(networkActorDestroyLowLevel):
+    return {
+            "Type": "network",
+            "Action": "destroy",
+            "Actor": networkActorDestroyLowLevel,
+            "time": 1497218188,
+            "timeNano": 1497218188440356384
+            }
+
+
+@fixture
+def daemonActorLowLevel():
+    """
+    This is a total guess, there doesn't seem to be any information about the
+    'daemon.reload' event in the wild, and kill -HUP doesn't trigger it, so I
+    don't know how to actually see one.
+    """
+    return {
+            "ID": "0",
+            "Attributes": {},
+            }
+
+
+@fixture
+def daemonEventLowLevel(daemonActorLowLevel):
+    return {
+            "Type": "daemon",
+            "Action": "reload",
+            "Actor": daemonActorLowLevel,
+            "time": 1497218188,
+            "timeNano": 1497218188440356384
+            }
+
+
+@fixture
+def volumeActorLowLevel():
+    """
+    This is a total guess, there doesn't seem to be any information about the
+    'daemon.reload' event in the wild, and kill -HUP doesn't trigger it, so I
+    don't know how to actually see one.
+    """
+    return {"ID": "12351",
+            "Attributes": {"driver": "local"}
+            }
+
+
+@fixture
+def volumeEventLowLevel(volumeActorLowLevel):
+    return {"Type": "volume",
+            "Action": "create",
+            "Actor": volumeActorLowLevel,
+            "time": 1497225755,
+            "timeNano": 1497225755984676913
+            }
+
+
+@fixture
+def pluginActorLowLevel():
+    return {"ID": "vieux/sshfs:latest",
+            "Attributes":{"name": "vieux/sshfs"}
+            }
+
+
+@fixture
+def pluginEventLowLevel(pluginActorLowLevel):
+    return {"Type": "plugin",
+            "Action": "pull",
+            "Actor": pluginActorLowLevel,
+            "time": 1497225462,
+            "timeNano": 1497225462002014924
+            }
@@ -0,0 +1,340 @@
+"""
+Tests of the asyncio DockerEngine, against a fake daemon on a unix socket
+"""
+import asyncio
+import os
+
+from builtins import object
+
+from pytest import fixture, raises
+
+from mock import MagicMock, patch
+
+import docker
+
+from codado.dockerish import aio, event
+from codado.dockerish.cache import ResourceCache
+from codado.dockerish.checkpoint import FileCheckpointStore
+from codado.dockerish.fakedaemon import FakeDaemon, parseSince
+from codado.dockerish.replay import synthesize
+
+
+NOW = 1600000000
+
+
+@fixture
+def llEvents():
+    """
+    Events from a second in the past, so that they come after the engine's
+    `since`
+    """
+    return synthesize(20, containers=4, start=NOW)
+
+
+@fixture
+def socketPath(tmp_path):
+    return str(tmp_path / 'docker.sock')
+
+
+def later(seconds=0.01):
+    return asyncio.sleep(seconds)
+
+
+def test_parseSince():
+    """
+    Do I understand the daemon's times?
+    """
+    assert parseSince('12') == 12000000000
+    assert parseSince('12.5') == 12500000000
+    assert parseSince('12.000000001') == 12000000001
+
+
+def test_dockerAddress():
+    """
+    Do I find the daemon the way docker does?
+    """
+    with patch.dict(os.environ, {'DOCKER_HOST': 'tcp://docker.example:1234'}):
+        assert aio.dockerAddress() == ('tcp', ('docker.example', 1234))
+    with patch.dict(os.environ, clear=True):
+        assert aio.dockerAddress() == ('unix', '/var/run/docker.sock')
+    assert aio.dockerAddress('tcp://localhost') == ('tcp', ('localhost', 2375))
+    with raises(ValueError):
+        aio.dockerAddress('ssh://docker.example')
+
+
+def test_fakeDaemonDockerPy(llEvents, socketPath):
+    """
+    Does docker-py understand the fake daemon?
+    """
+    daemon = FakeDaemon(socketPath, llEvents)
+    stop = daemon.runInThread()
+    try:
+        client = docker.DockerClient(base_url='unix://' + socketPath,
+                version='1.41')
+        got = list(client.events(decode=True, since=NOW,
+            until=parseSince('%d.000002' % NOW) / 1e9,
+            filters={'type': ['container'], 'event': ['exec_die']}))
+        assert [e['timeNano'] for e in got] == [llEvents[2]['timeNano']]
+        with raises(docker.errors.NotFound):
+            client.containers.get('abc')
+        assert daemon.requests[0]['filters'] == (
+                '{"type": ["container"], "event": ["exec_die"]}')
+    finally:
+        stop()
+
+
+def test_engine(llEvents, socketPath, tmp_path):
+    """
+    Do I dispatch every event to sync and coroutine handlers, reconnect from
+    the last event seen, telling handlers when the daemon goes and comes
+    back, and log handler failures?
+    """
+    calls = []
+    checkpoint = FileCheckpointStore(str(tmp_path / 'checkpoint.json'))
+    eng = aio.AsyncDockerEngine(dockerHost='unix://' + socketPath,
+            clientFactory=MagicMock, checkpoint=checkpoint, checkpointInterval=60,
+            reconnectDelay=0.01)
+
+    class Monitor(object):
+        engine = eng
+
+        @engine.handler("dockerish.init")
+        def onInit(self, event):
+            calls.append('init')
+
+        @engine.handler("dockerish.disconnected")
+        @engine.handler("dockerish.reconnected")
+        def onHealth(self, event):
+            calls.append(event.action)
+
+        @engine.handler("container.start")
+        async def onStart(self, event):
+            await later()
+            calls.append(('start', event.actorId[-1]))
+
+        @engine.handler("container.die", name='*_2')
+        def onDie(self, event):
+            calls.append(('die', event.actor.name))
+            # a lookup in the loop's executor
+            return event.fetchContainer()
+
+        @engine.handler("container.stop")
+        async def onStop(self, event):
+            await later()
+            raise ValueError("oops")
+
+        @engine.handler("container.health_status", coalesce=0.001)
+        def onHealthStatus(self, event):
+            calls.append(('health', event.actorId[-1]))
+
+    async def main():
+        daemon = FakeDaemon(socketPath, llEvents, failures=1)
+        await daemon.start()
+        app = Monitor()
+        with patch.object(event.time, 'time', return_value=NOW), \
+                patch.object(aio.log, 'err') as mErr:
+            run = asyncio.ensure_future(app.engine.run())
+            while len(daemon.requests) < 3:
+                await later()
+            eng.stop()
+            await run
+        await daemon.close()
+        return daemon, mErr
+
+    daemon, mErr = asyncio.run(main())
+    # a failed request, then one that ends, then the reconnection
+    sinces = [r['since'] for r in daemon.requests]
+    assert sinces[:2] == [str(NOW)] * 2
+    assert set(sinces[2:]) == {'%d.000019000' % NOW}
+    assert eval(daemon.requests[0]['filters'])['type'] == ['container']
+    # the first request failed, and each response that ended was a
+    # disconnection
+    transitions = [c for c in calls if isinstance(c, str)]
+    assert transitions[:5] == ['init'] + ['disconnected', 'reconnected'] * 2
+    assert set(transitions[1::2]) == {'disconnected'}
+    assert set(transitions[2::2]) == {'reconnected'}
+    assert sorted(c for c in calls if isinstance(c, tuple)) == [
+            ('die', 'noms_2'), ('health', '1'), ('health', '3'),
+            ('start', '1'), ('start', '3')]
+    assert sorted(set(c[0][1] for c in mErr.call_args_list)) == [
+            "Handler 'onStop' failed",
+            "Lost docker events from default",
+            ]
+    assert eng.health.connected is (transitions[-1] == 'reconnected')
+    # stop() saved the position of the last event
+    assert checkpoint.load().timeNano == llEvents[-1]['timeNano']
+
+
+def test_events(llEvents, socketPath):
+    """
+    Can I iterate over Events with async for, from a daemon that doesn't
+    chunk its responses?
+    """
+    async def main():
+        daemon = FakeDaemon(socketPath, llEvents, chunked=False, hold=True)
+        await daemon.start()
+        eng = aio.AsyncDockerEngine(dockerHost='unix://' + socketPath)
+        got = []
+        with patch.object(event.time, 'time', return_value=NOW):
+            async for ev in eng.events():
+                got.append(ev)
+                if len(got) == 20:
+                    break
+        # the daemon notices the hang up
+        await later()
+        await daemon.close()
+        return got
+
+    got = asyncio.run(main())
+    assert [e.timeNano for e in got] == [e['timeNano'] for e in synthesize(20,
+        containers=4, start=NOW)]
+    assert got[7].name == 'container.start'
+
+
+def test_stopFromHandler(llEvents, socketPath):
+    """
+    When a handler stops the engine, do I dispatch nothing after it, even
+    what was already read?
+    """
+    calls = []
+    eng = aio.AsyncDockerEngine(dockerHost='unix://' + socketPath)
+
+    class Monitor(object):
+        engine = eng
+
+        @engine.handler("container.*")
+        def onContainer(self, event):
+            calls.append(event.name)
+            if event.name == 'container.start':
+                self.engine.stop()
+
+    async def main():
+        daemon = FakeDaemon(socketPath, llEvents)
+        await daemon.start()
+        with patch.object(event.time, 'time', return_value=NOW):
+            await Monitor().engine.run()
+        await daemon.close()
+
+    asyncio.run(main())
+    assert calls[-1] == 'container.start'
+    assert len(calls) == 8
+
+
+def test_readEvents():
+    """
+    Do I read a body that ends with an unterminated line, and raise the
+    daemon's errors?
+    """
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'HTTP/1.1 200 OK\r\n\r\n{"a":1}\n\n{"a":2}')
+        reader.feed_eof()
+        got = [e async for e in aio.readEvents(reader)]
+
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'HTTP/1.1 404 Not Found\r\nContent-Length: 3\r\n\r\nno\n')
+        reader.feed_eof()
+        with raises(aio.DaemonError) as e:
+            [e async for e in aio.readEvents(reader)]
+        return got, e.value.args
+
+    assert asyncio.run(main()) == ([{'a': 1}, {'a': 2}], (404, 'no'))
+
+
+def test_reconcile(socketPath):
+    """
+    Do I dispatch events for the containers that already exist, inspecting
+    them into the cache, before the stream?
+    """
+    container = MagicMock(id='c1', attrs={'Id': 'c1', 'Image': 'noms',
+        'Names': ['/noms_1']})
+    client = MagicMock()
+    client.containers.list.return_value = [container]
+    calls = []
+    eng = aio.AsyncDockerEngine(dockerHost='unix://' + socketPath,
+            clientFactory=lambda: client, reconcile=('container',),
+            resourceCache=ResourceCache())
+
+    class Monitor(object):
+        engine = eng
+
+        @engine.handler("container.start")
+        async def onStart(self, event):
+            event.engine.stop()
+            await later()
+            calls.append(event.actor.name)
+
+    async def main():
+        daemon = FakeDaemon(socketPath)
+        await daemon.start()
+        await Monitor().engine.run()
+        await daemon.close()
+
+        # a failure is logged, and the engine carries on
+        with patch.object(aio.log, 'err') as mErr, patch.object(eng,
+                'deferToThread', side_effect=RuntimeError("no")):
+            await eng._reconcileAsync()
+        return mErr
+
+    mErr = asyncio.run(main())
+    assert calls == ['noms_1']
+    container.reload.assert_called_once_with()
+    assert eng.resourceCache.get(('container', 'c1')) is container
+    mErr.assert_called_once_with(None,
+            "Reconciling existing docker objects failed")
+
+
+def test_unsupported():
+    """
+    Do I refuse the options that need Twisted, or a backlog?
+    """
+    eng = aio.AsyncDockerEngine()
+    eng.handler("container.start", concurrency=2)(lambda self, event: None)
+    with raises(ValueError):
+        asyncio.run(eng.run())
+    with raises(ValueError):
+        asyncio.run(aio.AsyncDockerEngine(metrics=object()).run())
+    with raises(ValueError):
+        asyncio.run(aio.AsyncDockerEngine(
+            priorities={'container.die': 1}).run())
+
+
+def test_tcp():
+    """
+    Can I reach a daemon over TCP?
+    """
+    async def main():
+        writer = MagicMock()
+        with patch.object(aio.asyncio, 'open_connection',
+                return_value=('reader', writer)) as mOpen:
+            eng = aio.AsyncDockerEngine(dockerHost='tcp://docker.example:2375')
+            got = await eng._request('/events', {'since': '1'})
+        mOpen.assert_called_once_with('docker.example', 2375)
+        return got, writer.write.call_args[0][0]
+
+    (reader, writer), request = asyncio.run(main())
+    assert reader == 'reader'
+    assert request.startswith(b'GET /events?since=1 HTTP/1.1\r\n')
+
+
+def test_fakeDaemonHangUp(socketPath):
+    """
+    Do I put up with clients that hang up early?
+    """
+    async def main():
+        daemon = FakeDaemon(socketPath)
+        await daemon.start()
+        reader, writer = await asyncio.open_unix_connection(socketPath)
+        writer.close()
+        await later()
+
+        writer = MagicMock()
+        writer.drain.side_effect = ConnectionResetError()
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'GET /events HTTP/1.1\r\n\r\n')
+        await daemon._serve(reader, writer)
+        await daemon.close()
+        return writer
+
+    writer = asyncio.run(main())
+    writer.close.assert_called_once_with()
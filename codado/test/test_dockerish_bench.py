@@ -0,0 +1,91 @@
+"""
+Tests of the dockerish dispatch benchmark
+"""
+from codado.dockerish import bench, replay
+from codado.dockerish.event import DockerEngine
+
+
+class PredicateOwner(object):
+    """
+    An owner whose handlers choose containers by label and name
+    """
+    engine = DockerEngine()
+
+    @engine.handler("container.start", labels={'com.example.role': 'web'})
+    def onWebStart(self, event):
+        event.actor.name
+
+    @engine.handler("container.start", name='noms_1*')
+    def onNomsStart(self, event):
+        event.actor.name
+
+    @engine.handler("container.start")
+    def onStart(self, event):
+        event.actor.name
+
+
+def test_benchmark():
+    """
+    Do I dispatch every event and time every handler?
+    """
+    client = replay.ReplayClient(
+            [replay.dumpEvent(e) for e in replay.synthesize(100)])
+    result = bench.benchmark(bench.SampleOwner(), client)
+    assert result.events == 100
+    assert result.eventsPerSecond > 0
+    assert len(result.handlers['onAnything'].samples) == 100
+    assert len(result.handlers['onLifecycle'].samples) == 20
+    assert len(result.handlers['onHealth'].samples) == 10
+    report = result.report()
+    assert '100 events' in report
+    assert 'onHealth' in report
+
+    client = replay.ReplayClient(
+            [replay.dumpEvent(e) for e in replay.synthesize(10)])
+    result = bench.benchmark(bench.SampleOwner(), client, timeHandlers=False)
+    assert result.handlers == {}
+
+    client = replay.ReplayClient(
+            [replay.dumpEvent(e) for e in replay.synthesize(10)])
+    result = bench.benchmark(bench.SampleOwner(), client, raw=True)
+    assert result.events == 10
+    assert len(result.handlers['onAnything'].samples) == 10
+
+
+def test_benchmarkPredicates(capsys):
+    """
+    Do I time handlers with predicates, only for the events they match?
+    """
+    client = replay.ReplayClient(
+            [replay.dumpEvent(e) for e in replay.synthesize(100, containers=20)])
+    result = bench.benchmark(PredicateOwner(), client)
+    # only container.start events are asked for
+    assert result.events == 10
+    assert len(result.handlers['onStart'].samples) == 10
+    assert len(result.handlers['onWebStart'].samples) == 10
+    # noms_7 and noms_17 take turns to start
+    assert len(result.handlers['onNomsStart'].samples) == 5
+
+    assert bench.Options.main(['--synthetic', '30',
+        '--owner', 'codado.test.test_dockerish_bench:PredicateOwner']) == 0
+    assert 'onWebStart' in capsys.readouterr()[0]
+
+
+def test_main(tmp_path, capsys):
+    """
+    Do I benchmark a recording, or a synthetic one, from the command line?
+    """
+    path = tmp_path / 'events.jsonl'
+    path.write_text(''.join(
+        replay.dumpEvent(e) + '\n' for e in replay.synthesize(50)))
+    assert bench.Options.main([
+        '--owner', 'codado.dockerish.bench:SampleOwner', str(path)]) == 0
+    out = capsys.readouterr()[0]
+    assert '50 events' in out
+
+    assert bench.Options.main(['--synthetic', '30', '--no-handler-timing',
+        '--raw']) == 0
+    assert '30 events' in capsys.readouterr()[0]
+
+    assert bench.Options.main(['--synthetic', '30', '--min-rate', '1e12']) == 1
+    assert 'below' in capsys.readouterr()[0]
@@ -0,0 +1,118 @@
+"""
+Tests of the dockerish resource cache
+"""
+from pytest import fixture
+
+from codado.dockerish import cache
+
+
+@fixture
+def clock():
+    """
+    A fake monotonic clock for the cache
+    """
+    class Clock(object):
+        now = 100.0
+
+        def __call__(self):
+            return self.now
+
+    return Clock()
+
+
+@fixture
+def rcache(clock):
+    rc = cache.ResourceCache(ttl=10, maxSize=2)
+    rc.clock = clock
+    return rc
+
+
+def test_getPut(rcache, clock):
+    """
+    Do I keep objects until their TTL runs out?
+    """
+    assert rcache.get(('container', 'abc')) is None
+    rcache.put(('container', 'abc'), 'acontainer')
+    assert rcache.get(('container', 'abc')) == 'acontainer'
+    clock.now += 9.9
+    assert rcache.get(('container', 'abc')) == 'acontainer'
+    clock.now += 0.1
+    assert rcache.get(('container', 'abc')) is None
+    assert len(rcache) == 0
+
+
+def test_maxSize(rcache):
+    """
+    Do I push out the least recently used object when I'm full?
+    """
+    rcache.put(('container', 'a'), 1)
+    rcache.put(('container', 'b'), 2)
+    assert rcache.get(('container', 'a')) == 1
+    rcache.put(('container', 'c'), 3)
+    assert len(rcache) == 2
+    assert rcache.get(('container', 'b')) is None
+    assert rcache.get(('container', 'a')) == 1
+    assert rcache.get(('container', 'c')) == 3
+
+
+def test_evictClear(rcache):
+    """
+    Can I forget one object, or everything?
+    """
+    rcache.put(('image', 'a'), 1)
+    rcache.put(('image', 'b'), 2)
+    rcache.evict(('image', 'a'))
+    rcache.evict(('image', 'nope'))
+    assert rcache.get(('image', 'a')) is None
+    assert rcache.get(('image', 'b')) == 2
+    rcache.clear()
+    assert len(rcache) == 0
+
+
+def test_generation(rcache):
+    """
+    Do I refuse to cache an object looked up before its key was evicted?
+    """
+    key = ('container', 'a')
+    gen = rcache.generation(key)
+    rcache.evict(key)
+    rcache.put(key, 'stale', gen)
+    assert rcache.get(key) is None
+    gen = rcache.generation(key)
+    rcache.evict(('container', 'b'))
+    rcache.put(key, 'fresh', gen)
+    assert rcache.get(key) == 'fresh'
+
+    gen = rcache.generation(key)
+    rcache.clear()
+    rcache.put(key, 'stale', gen)
+    assert rcache.get(key) is None
+
+    # only the last maxSize evictions are remembered, but a lookup that
+    # outlives them is still refused
+    gen = rcache.generation(key)
+    for id in 'abcd':
+        rcache.evict(('container', id))
+    assert len(rcache._evictions) == 2
+    rcache.put(key, 'stale', gen)
+    assert rcache.get(key) is None
+
+
+def test_invalidatedKeys():
+    """
+    Do I know which cached objects an event makes stale?
+    """
+    def ev(type, action, id, **attributes):
+        return {'Type': type, 'Action': action,
+                'Actor': {'ID': id, 'Attributes': attributes}}
+
+    assert cache.invalidatedKeys(ev('container', 'destroy', 'c1', name='web')
+            ) == [('container', 'c1')]
+    assert cache.invalidatedKeys(ev('container', 'exec_start', 'c1')) == []
+    assert cache.invalidatedKeys(ev('image', 'untag', 'sha256:1', name='x:latest')
+            ) == [('image', 'sha256:1'), ('image', 'x:latest')]
+    assert cache.invalidatedKeys(ev('network', 'connect', 'n1', container='c1')
+            ) == [('network', 'n1'), ('container', 'c1')]
+    assert cache.invalidatedKeys(ev('network', 'destroy', 'n1')
+            ) == [('network', 'n1')]
+    assert cache.invalidatedKeys({'Type': 'daemon', 'Action': 'reload'}) == []
@@ -0,0 +1,107 @@
+"""
+Tests of dockerish checkpoints
+"""
+from pytest import raises
+
+from mock import patch
+
+from twisted.internet import task
+
+from zope.interface import implementer
+from zope.interface.verify import verifyObject
+
+from codado.dockerish import event
+from codado.dockerish.checkpoint import ICheckpointStore, FileCheckpointStore
+
+
+def test_fileCheckpointStore(tmp_path, mkEvent):
+    """
+    Do I save and load a cursor through a file, atomically?
+    """
+    store = FileCheckpointStore(str(tmp_path / 'checkpoint.json'))
+    assert verifyObject(ICheckpointStore, store)
+    assert store.load() is None
+
+    cursor = event.EventCursor()
+    cursor.advance(mkEvent(1500000000000000001, 'a'))
+    cursor.advance(mkEvent(1500000000000000001, 'b'))
+    # events without an actor id, e.g. from the daemon itself
+    cursor.advance(mkEvent(1500000000000000001, None))
+    store.save(cursor)
+    assert store.load() == cursor
+
+    # events dispatched past a position held back by a lagging lane
+    held = event.EventCursor(1500000000000000000, ahead={
+        (1500000000000000001, ('container', 'die', 'a')),
+        (1500000000000000002, ('daemon', 'reload', None))})
+    store.save(held)
+    assert store.load() == held
+    store.save(cursor)
+
+    with patch('os.replace', side_effect=OSError("disk full")):
+        cursor.advance(mkEvent(1500000000000000002, 'c'))
+        with raises(OSError):
+            store.save(cursor)
+    # the old checkpoint survives a failed save
+    assert store.load().timeNano == 1500000000000000001
+
+
+@implementer(ICheckpointStore)
+class MemoryCheckpointStore(object):
+    def __init__(self, cursor=None):
+        self.saved = [cursor] if cursor else []
+
+    def load(self):
+        return self.saved[-1] if self.saved else None
+
+    def save(self, cursor):
+        self.saved.append(cursor)
+
+
+def test_resume(fromEnv, mkEvent):
+    """
+    Do I resume from the checkpoint, skip the events already dispatched at
+    its boundary, and save new positions in coalesced batches?
+    """
+    last = mkEvent(1500000000000000001, 'a')
+    saved = event.EventCursor()
+    saved.advance(last)
+    store = MemoryCheckpointStore(saved)
+
+    eng = event.DockerEngine(checkpoint=store, checkpointInterval=5)
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.*")
+        def onContainer(self, event):
+            calls.append(event.actorId)
+
+    app = EventConsumerApp()
+    app.engine.run()
+
+    llEvents = [dict(last), mkEvent(1500000000000000001, 'b'),
+            mkEvent(1500000000000000002, 'c')]
+    with patch.object(eng.client, 'events', autospec=True,
+            return_value=llEvents) as mEvents:
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+        assert mEvents.call_args[1]['since'] == '1500000000.000000001'
+    assert calls == ['b', 'c']
+    # nothing saved until the interval is up, then all at once
+    assert len(store.saved) == 1
+    clock.advance(5)
+    assert len(store.saved) == 2
+    assert store.load() == event.EventCursor(
+            1500000000000000002, {('container', 'start', 'c')})
+
+    with patch.object(eng.client, 'events', autospec=True,
+            return_value=[mkEvent(1500000000000000003, 'd')]):
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+    assert len(store.saved) == 2
+    # stopping saves right away
+    eng.stop()
+    assert len(store.saved) == 3
+    assert store.load().timeNano == 1500000000000000003
+    assert not clock.getDelayedCalls()
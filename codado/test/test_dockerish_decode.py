@@ -0,0 +1,35 @@
+"""
+Tests of decoding raw docker event streams
+"""
+import json
+
+from codado.dockerish import decode
+
+
+def test_decodeStream():
+    """
+    Do I decode events however the stream splits them into chunks?
+    """
+    one = b'{"Action":"start","timeNano":1}\n'
+    two = b'{"Action":"die","timeNano":2}\n'
+    expected = [{'Action': 'start', 'timeNano': 1},
+            {'Action': 'die', 'timeNano': 2}]
+
+    assert list(decode.decodeStream([one, two])) == expected
+    assert list(decode.decodeStream([one + two])) == expected
+    assert list(decode.decodeStream([one[:5], one[5:] + two[:3], two[3:]])) == expected
+    # a byte at a time
+    assert list(decode.decodeStream([bytes([b]) for b in one + two])) == expected
+    # blank lines, and a last line with no newline
+    assert list(decode.decodeStream([b'\n' + one + b'\r\n\n', two[:-1]])) == expected
+    assert list(decode.decodeStream([b'\n', one, b'\r\n', two])) == expected
+    assert list(decode.decodeStream([])) == []
+    assert list(decode.decodeStream([one + two], loads=json.loads)) == expected
+
+
+def test_parser():
+    """
+    Do I use orjson when it is installed?
+    """
+    assert decode.PARSER == 'orjson'
+    assert decode.loads(b'{"a":[1]}') == {'a': [1]}
@@ -1,236 +1,24 @@
 """
 Tests of the dockerish event bus
 """
+import json
+import threading
 import time
 
 from builtins import object
 
-from pytest import fixture, mark
+from pytest import mark, raises
 
-from mock import MagicMock, patch
+import pytest_twisted
 
-from twisted.internet import task
+from mock import MagicMock, call, patch
 
-import docker
+from twisted.internet import defer, error, reactor, task
 
 from codado.dockerish import event
-
-
-@fixture
-def dockerClientLowLevel():
-    """
-    A docker client mock
-    """
-    cli = MagicMock()
-    class Items(object):
-        def __init__(self, dct):
-            self.dct = dct
-
-        def get(self, key):
-            ret = self.dct.get(key)
-            if ret is None:
-                raise docker.errors.NotFound(key)
-            return ret
- 
-    cli.images = Items({'sha256:12345': 'animage'})
-    cli.containers = Items({'12347': 'acontainer'})
-    cli.networks = Items({'12349': 'anetwork'})
-    cli.volumes = Items({'12351': 'avolume'})
-    cli.plugins = Items({"vieux/sshfs": 'aplugin'})
-    return cli
-
-
-@fixture
-def imageActorLowLevel():
-    """
-    The low-level dict of an image event actor from docker
-    """
-    return {"ID": "sha256:12345","Attributes": {"name": "sha256:12345"}}
-
-
-@fixture
-def imageEventLowLevel(imageActorLowLevel):
-    """
-    A low-level event from a docker image
-    """
-    return {
-            "status": "delete",
-            "id": "sha256:12345",
-            "Type": "image",
-            "Action": "delete",
-            "Actor": imageActorLowLevel,
-            "time": 1497218060,
-            "timeNano": 1497218060835756369
-            }
-
-
-@fixture
-def containerActorLowLevel():
-    """
-    The low-level dict of a container event actor from docker
-    """
-    return {
-            "ID": "12347",
-            "Attributes": {
-                "image": "twist",
-                "name": "peaceful_booth"
-                }
-            }
-
-
-@fixture
-def containerEventLowLevel(containerActorLowLevel):
-    """
-    A low-level event from a docker container
-    """
-    return {"status": "create",
-            "id": "12347",
-            "from": "abc123",
-            "Type": "container",
-            "Action": "create",
-            "Actor": containerActorLowLevel,
-            "time": 1497218188,
-            "timeNano": 1497218188361178103
-            }
-
-
-@fixture
-def containerActorDestroyLowLevel():
-    """
-    The low-level dict of a container event actor from docker
-    """
-    return {
-            "ID": "deadbeef",
-            "Attributes": {
-                "image": "twist",
-                "name": "peaceful_booth"
-                }
-            }
-
-
-@fixture
-def containerEventDestroyLowLevel(containerActorDestroyLowLevel):
-    """
-    A low-level event from a docker container
-    """
-    return {"status": "create",
-            "id": "deadbeef",
-            "from": "abc123",
-            "Type": "container",
-            "Action": "destroy",
-            "Actor": containerActorDestroyLowLevel,
-            "time": 1497218188,
-            "timeNano": 1497218188361178103
-            }
-
-
-@fixture
-def networkActorLowLevel():
-    return {
-            "ID": "12349",
-            "Attributes":
-                {"container": "12347",
-                 "name": "bridge",
-                 "type": "bridge"
-                 }
-            }
-
-
-@fixture
-def networkEventLowLevel(networkActorLowLevel):
-    return {
-            "Type": "network",
-            "Action": "connect",
-            "Actor": networkActorLowLevel,
-            "time": 1497218188,
-            "timeNano": 1497218188440356384
-            }
-
-
-@fixture
-def networkActorDestroyLowLevel():
-    return {
-            "ID": "deadcafe",
-            "Attributes":
-                {"container": "12347",
-                 "name": "bridge",
-                 "type": "bridge"
-                 }
-            }
-
-
-@fixture
-def networkEventDestroyLowLevel(networkActorDestroyLowLevel):
-    return {
-            "Type": "network",
-            "Action": "destroy",
-            "Actor": networkActorDestroyLowLevel,
-            "time": 1497218188,
-            "timeNano": 1497218188440356384
-            }
-
-
-@fixture
-def daemonActorLowLevel():
-    """
-    This is a total guess, there doesn't seem to be any information about the
-    'daemon.reload' event in the wild, and kill -HUP doesn't trigger it, so I
-    don't know how to actually see one.
-    """
-    return {
-            "ID": "0",
-            "Attributes": {},
-            }
-
-
-@fixture
-def daemonEventLowLevel(daemonActorLowLevel):
-    return {
-            "Type": "daemon",
-            "Action": "reload",
-            "Actor": daemonActorLowLevel,
-            "time": 1497218188,
-            "timeNano": 1497218188440356384
-            }
-
-
-@fixture
-def volumeActorLowLevel():
-    """
-    This is a total guess, there doesn't seem to be any information about the
-    'daemon.reload' event in the wild, and kill -HUP doesn't trigger it, so I
-    don't know how to actually see one.
-    """
-    return {"ID": "12351",
-            "Attributes": {"driver": "local"}
-            }
-
-
-@fixture
-def volumeEventLowLevel(volumeActorLowLevel):
-    return {"Type": "volume",
-            "Action": "create",
-            "Actor": volumeActorLowLevel,
-            "time": 1497225755,
-            "timeNano": 1497225755984676913
-            }
-
-
-@fixture
-def pluginActorLowLevel():
-    return {"ID": "vieux/sshfs:latest",
-            "Attributes":{"name": "vieux/sshfs"}
-            }
-
-
-@fixture
-def pluginEventLowLevel(pluginActorLowLevel):
-    return {"Type": "plugin",
-            "Action": "pull",
-            "Actor": pluginActorLowLevel,
-            "time": 1497225462,
-            "timeNano": 1497225462002014924
-            }
+from codado.dockerish.cache import ResourceCache
+from codado.dockerish.match import HandlerIndex
+from codado.dockerish.metrics import MetricsRecorder
 
 
 def test_fromLowLevelActor(imageActorLowLevel):
@@ -269,26 +57,26 @@ def test_eventActorFromEventActor(imageActorLowLevel):
     ['containerEventDestroyLowLevel', 'container', None, 'container.destroy'],
     ['networkEventDestroyLowLevel', 'network', None, 'network.destroy'],
     ])
-def test_eventProperties(dockerClientLowLevel, llEvent, actorAttribute,
+def test_eventProperties(engine, llEvent, actorAttribute,
         expected, name, request):
     """
     Do I get the right thing from the docker engine when I get a property
     from the event?
     """
-    eng = MagicMock(client=dockerClientLowLevel)
+    eng = engine
     llEvent = request.getfixturevalue(llEvent)
     ev = event.Event.fromLowLevelEvent(eng, llEvent)
     assert getattr(ev, actorAttribute) == expected
     assert ev.name == name
 
 
-def test_daemonEvent(dockerClientLowLevel, daemonEventLowLevel):
+def test_daemonEvent(engine, daemonEventLowLevel):
     """
     Does the daemon.reload event work?
 
     n.b. I haven't been able to test this code in the wild.
     """
-    eng = MagicMock(client=dockerClientLowLevel)
+    eng = engine
     ev = event.Event.fromLowLevelEvent(eng, daemonEventLowLevel)
     assert ev.daemon is eng.client
     assert ev.name == 'daemon.reload'
@@ -313,6 +101,7 @@ def test_dockerEngineDescriptor():
 
 
 def test_dockerEngineBindEvent(
+        fromEnv,
         containerEventDestroyLowLevel,
         networkEventDestroyLowLevel):
     """
@@ -362,3 +151,1183 @@ def test_dockerEngineBindEvent(
                 ('onAnyEvent', 'network.destroy', None),
                 ('onDestroy', 'network.destroy', None),
                 ]
+
+
+def test_eventCursor(containerEventLowLevel, networkEventLowLevel,
+        networkEventDestroyLowLevel):
+    """
+    Do I deliver each event once, even when a stream repeats the events at
+    the `since` boundary?
+    """
+    cursor = event.EventCursor()
+    assert cursor.since(12.5) == 12.5
+    assert cursor.advance(networkEventLowLevel)
+    assert cursor.since(12.5) == '1497218188.440356384'
+    # same timeNano, different event
+    assert cursor.advance(networkEventDestroyLowLevel)
+    # repeats at the boundary, and anything older
+    assert not cursor.advance(networkEventLowLevel)
+    assert not cursor.advance(networkEventDestroyLowLevel)
+    assert not cursor.advance(containerEventLowLevel)
+    later = dict(containerEventLowLevel, timeNano=1497218189000000005)
+    assert cursor.advance(later)
+    assert cursor.since(None) == '1497218189.000000005'
+
+
+def test_dockerEngineStreaming(fromEnv,
+        containerEventLowLevel,
+        containerEventDestroyLowLevel,
+        networkEventDestroyLowLevel):
+    """
+    In streaming mode, do I read one connection in a thread, and reconnect
+    from the last event seen without repeating it, backing off and telling
+    handlers while the daemon is away?
+    """
+    eng = event.DockerEngine(streaming=True)
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    threaded = []
+    eng.callInThread = lambda f, *a: threaded.append((f, a))
+    eng.callFromThread = lambda f, *a: f(*a)
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.create")
+        @engine.handler("container.destroy")
+        @engine.handler("network.destroy")
+        def onEvent(self, event):
+            calls.append((event.name, event.timeNano))
+
+        @engine.handler("dockerish.disconnected")
+        @engine.handler("dockerish.reconnected")
+        def onHealth(self, event):
+            calls.append((event.name, eng.health.connected))
+
+    app = EventConsumerApp()
+    app.engine.run()
+    eng.health.backoff.random = lambda: 1.0
+    [(readStream, (since,))] = threaded
+
+    class SecondStream(object):
+        """
+        The daemon repeats the boundary event on reconnect
+        """
+        closed = False
+
+        def __iter__(self):
+            yield dict(containerEventDestroyLowLevel)
+            yield dict(networkEventDestroyLowLevel)
+            eng.stop()
+
+        def close(self):
+            self.closed = True
+
+    streams = [
+        iter([dict(containerEventLowLevel), dict(containerEventDestroyLowLevel)]),
+        IOError("connection reset"),
+        SecondStream(),
+        ]
+    def events(**kw):
+        assert kw['decode'] is True
+        ret = streams.pop(0)
+        if isinstance(ret, Exception):
+            raise ret
+        return ret
+
+    pClientEvents = patch.object(eng.client, 'events', side_effect=events)
+    pSleep = patch.object(eng._stopping, 'wait')
+    with pClientEvents as mEvents, pSleep as mSleep, patch.object(event.log, 'err') as mErr:
+        readStream(since)
+        sinces = [c[1]['since'] for c in mEvents.call_args_list]
+        assert sinces == [since] + ['1497218188.361178103'] * 2
+        # the stream ended, then the next connection failed
+        assert mSleep.call_args_list == [call(1.0), call(2.0)]
+        [((reason, message), kw)] = mErr.call_args_list
+        assert reason.check(error.ConnectionDone)
+        assert message == "Lost docker events from default"
+
+    assert calls == [
+            ('container.create', 1497218188361178103),
+            ('container.destroy', 1497218188361178103),
+            ('dockerish.disconnected', False),
+            ('dockerish.reconnected', True),
+            ('network.destroy', 1497218188440356384),
+            ]
+    assert eng.health.failures == 0
+    assert eng.health.backoff.attempts == 0
+    assert eng._stream.closed
+
+
+def test_streamStopDuringBackoff(fromEnv):
+    """
+    Does stop() wake a stream reader waiting to reconnect to a daemon that is
+    gone, so that it doesn't hold up the reactor's thread pool?
+    """
+    eng = event.DockerEngine(streaming=True, reconnectDelay=60.0)
+    eng.callLater = task.Clock().callLater
+    threaded = []
+    eng.callInThread = lambda f, *a: threaded.append((f, a))
+    eng.callFromThread = lambda f, *a: None
+    eng.run()
+    [(readStream, (since,))] = threaded
+    waiting = threading.Event()
+
+    def events(**kw):
+        waiting.set()
+        raise IOError("no daemon")
+
+    with patch.object(eng.client, 'events', side_effect=events):
+        reader = threading.Thread(target=readStream, args=(since,))
+        start = time.time()
+        reader.start()
+        waiting.wait(5)
+        eng.stop()
+        reader.join(5)
+    assert not reader.is_alive()
+    assert time.time() - start < 5
+
+
+def test_backoff():
+    """
+    Do reconnection delays grow up to a cap, jittered between half and all
+    of that?
+    """
+    jitter = iter([0.0, 1.0, 0.5, 1.0, 1.0, 1.0, 1.0])
+    backoff = event.Backoff(1.0, 5.0, random=lambda: next(jitter))
+    assert [backoff.next() for n in range(5)] == [0.5, 2.0, 3.0, 5.0, 5.0]
+    backoff.reset()
+    assert backoff.next() == 1.0
+    backoff.attempts = 10000
+    assert backoff.next() == 5.0
+
+
+def test_pollReconnect(fromEnv, containerEventLowLevel,
+        containerEventDestroyLowLevel):
+    """
+    When a poll fails, do I keep trying with a growing backoff, tell handlers
+    once when the daemon goes and when it is back, and then dispatch what
+    happened in between?
+    """
+    eng = event.DockerEngine(reconnectDelay=2.0)
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.create")
+        @engine.handler("container.destroy")
+        @engine.handler("dockerish.disconnected")
+        @engine.handler("dockerish.reconnected")
+        def onEvent(self, event):
+            calls.append(event.name)
+
+    app = EventConsumerApp()
+    app.engine.run()
+    eng.health.backoff.random = lambda: 1.0
+    results = [[dict(containerEventLowLevel)], IOError("gone"),
+            IOError("still gone"),
+            [dict(containerEventLowLevel), dict(containerEventDestroyLowLevel)]]
+    def events(**kw):
+        ret = results.pop(0)
+        if isinstance(ret, Exception):
+            raise ret
+        return iter(ret)
+
+    with patch.object(eng.client, 'events', side_effect=events) as mEvents, \
+            patch.object(event.log, 'err') as mErr, \
+            patch.object(event.log, 'msg') as mMsg:
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+        assert eng.health.connected
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+        assert eng.health.connected is False
+        assert clock.getDelayedCalls()[-1].getTime() == clock.seconds() + 2.0
+        clock.advance(2.0)
+        assert eng.health.failures == 2
+        clock.advance(4.0)
+        assert not results
+        assert mErr.call_count == 1
+        mMsg.assert_called_once_with("Docker at default is still unreachable "
+                "after 2 attempts: still gone")
+        sinces = [c[1]['since'] for c in mEvents.call_args_list]
+        assert sinces[2:] == ['1497218188.361178103'] * 2
+
+    assert calls == ['container.create', 'dockerish.disconnected',
+            'dockerish.reconnected', 'container.destroy']
+    assert eng.health == event.Health(eng.health.backoff, True, 0, None,
+            eng.health.changed)
+    assert eng.health.backoff.attempts == 0
+    eng.stop()
+
+
+def test_dispatchFailed(fromEnv, containerEventLowLevel):
+    """
+    Does a handler that raises only fail its own event, leaving the rest of
+    the sample dispatched, the daemon connected, and polling going on?
+    """
+    eng = event.DockerEngine()
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    seen = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.create")
+        def onCreate(self, event):
+            seen.append(event.timeNano)
+            if len(seen) == 1:
+                raise ValueError("oops")
+
+    app = EventConsumerApp()
+    app.engine.run()
+    sample = [dict(containerEventLowLevel, timeNano=containerEventLowLevel['timeNano'] + n)
+            for n in range(2)]
+    times = [e['timeNano'] for e in sample]
+    with patch.object(eng.client, 'events', return_value=iter(sample)), \
+            patch.object(event.log, 'err') as mErr:
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+    [((reason, message), _)] = mErr.call_args_list
+    assert reason is None
+    assert message == "Handler 'onCreate' failed"
+    assert seen == times
+    assert not eng._backlog
+    assert eng._pausedSince is None
+    assert eng.health.connected
+    assert eng._nextPeek.active()
+
+    # and the next sample is fetched and dispatched
+    later = dict(containerEventLowLevel, timeNano=times[-1] + 1)
+    with patch.object(eng.client, 'events', return_value=iter([later])) as mEvents:
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+    assert mEvents.call_count == 1
+    assert seen == times + [times[-1] + 1]
+    eng.stop()
+
+
+def test_dockerEngineStop(fromEnv):
+    """
+    Do I stop polling when stopped?
+    """
+    eng = event.DockerEngine()
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    eng.run()
+    assert eng.running
+    # one empty peek, then stop
+    clock.advance(event.PEEK_INTERVAL_SECONDS)
+    eng.stop()
+    assert not eng.running
+    with patch.object(eng.client, 'events') as mEvents:
+        clock.advance(5)
+    assert mEvents.call_count == 0
+
+
+def test_dockerEngineShutdown(fromEnv):
+    """
+    Do I stop when the reactor shuts down, so that a stream reader isn't left
+    blocking the reactor's thread pool; and forget the trigger when stopped
+    first?
+    """
+    eng = event.DockerEngine(streaming=True)
+    eng.callLater = task.Clock().callLater
+    eng.callInThread = lambda f, *a: None
+    triggers = []
+    eng.addSystemEventTrigger = lambda *a: triggers.append(a) or len(triggers)
+    eng.removeSystemEventTrigger = MagicMock()
+    eng.run()
+    [(phase, eventType, shutdown)] = triggers
+    assert (phase, eventType) == ('before', 'shutdown')
+    eng._stream = MagicMock()
+    shutdown()
+    assert not eng.running
+    eng._stream.close.assert_called_once_with()
+    assert eng.removeSystemEventTrigger.call_count == 0
+
+    eng.run()
+    eng.stop()
+    eng.removeSystemEventTrigger.assert_called_once_with(2)
+
+
+@mark.parametrize('llEvent,fetch,expected', [
+    ['containerEventLowLevel', 'fetchContainer', 'acontainer'],
+    ['networkEventLowLevel', 'fetchNetwork', 'anetwork'],
+    ['imageEventLowLevel', 'fetchImage', 'animage'],
+    ['pluginEventLowLevel', 'fetchPlugin', 'aplugin'],
+    ['volumeEventLowLevel', 'fetchVolume', 'avolume'],
+    ])
+def test_eventFetch(engine, llEvent, fetch, expected, request):
+    """
+    Do the fetch* methods look up the same things as the properties, through
+    the engine's thread pool?
+    """
+    eng = engine
+    eng.deferToThread = defer.maybeDeferred
+    llEvent = request.getfixturevalue(llEvent)
+    ev = event.Event.fromLowLevelEvent(eng, llEvent)
+    d = getattr(ev, fetch)()
+    assert d.result == expected
+    with raises(ValueError):
+        ev._lookup('service')
+
+
+@pytest_twisted.inlineCallbacks
+def test_deferToThread():
+    """
+    Do I run blocking calls in a bounded thread pool of my own?
+    """
+    eng = event.DockerEngine(threadPoolSize=2)
+    res = yield eng.deferToThread(lambda x: (x, threading.current_thread()), 1)
+    assert res[0] == 1
+    assert res[1] is not threading.current_thread()
+    assert eng.threadPool.max == 2
+    pool = eng.threadPool
+    eng.stop()
+    assert eng.threadPool is None
+    # the reactor won't stop the pool a second time at shutdown
+    assert (pool.stop, (), {}) not in reactor._eventTriggers['shutdown'].during
+
+
+def test_dockerEngineThreaded(fromEnv,
+        containerEventDestroyLowLevel,
+        networkEventDestroyLowLevel):
+    """
+    With threaded=True, do I fetch samples through the thread pool, and keep
+    sampling when a fetch fails, from the last event seen?
+    """
+    eng = event.DockerEngine(threaded=True)
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    pending = []
+    def deferToThread(f, *a):
+        d = defer.Deferred()
+        pending.append((f, a, d))
+        return d
+    eng.deferToThread = deferToThread
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.destroy")
+        @engine.handler("network.destroy")
+        @engine.handler("dockerish.disconnected")
+        @engine.handler("dockerish.reconnected")
+        def onDestroy(self, event):
+            calls.append(event.name)
+
+    app = EventConsumerApp()
+    app.engine.run()
+    eng.health.backoff.random = lambda: 1.0
+
+    clock.advance(event.PEEK_INTERVAL_SECONDS)
+    [(f, (since, until), d)] = pending
+    assert f == eng._fetchEvents
+    with patch.object(eng.client, 'events', autospec=True,
+            return_value=iter([containerEventDestroyLowLevel])):
+        llEvents = f(since, until)
+    assert llEvents == [containerEventDestroyLowLevel]
+    # handlers only run when the result arrives in the reactor thread
+    assert calls == []
+    d.callback(llEvents)
+    assert calls == ['container.destroy']
+
+    with patch.object(event.log, 'err') as mErr:
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+        (f, (since2, until2), d) = pending[-1]
+        assert since2 == until
+        d.errback(IOError("daemon went away"))
+        assert mErr.call_count == 1
+    assert eng.health.connected is False
+    assert eng.health.lastError == "daemon went away"
+
+    clock.advance(eng.reconnectDelay)
+    (f, (since3, until3), d) = pending[-1]
+    assert since3 == '1497218188.361178103'
+    d.callback([networkEventDestroyLowLevel])
+    assert calls == ['container.destroy', 'dockerish.disconnected',
+            'dockerish.reconnected', 'network.destroy']
+    assert eng.health.connected
+
+
+def test_resourceCache(engine, containerEventLowLevel,
+        containerEventDestroyLowLevel, networkEventLowLevel, imageEventLowLevel):
+    """
+    Do repeated lookups for one actor hit the daemon once, until an event
+    makes the cached object stale?
+    """
+    engine.resourceCache = ResourceCache(ttl=60)
+    containers = engine.client.containers
+    containers.get = MagicMock(side_effect=containers.get)
+
+    ev = event.Event.fromLowLevelEvent(engine, dict(containerEventLowLevel))
+    assert ev.container == 'acontainer'
+    assert ev.container == 'acontainer'
+    assert containers.get.call_count == 1
+
+    # not found is not cached
+    dead = event.Event.fromLowLevelEvent(engine, dict(containerEventDestroyLowLevel))
+    assert dead.container is None
+    assert dead.container is None
+    assert containers.get.call_count == 3
+
+    # connecting the container to a network changes it
+    engine._callHandlers = lambda *a: None
+    engine._dispatch(dict(networkEventLowLevel))
+    assert ev.container == 'acontainer'
+    assert containers.get.call_count == 4
+
+    # the container's own events do too
+    engine._dispatch(dict(containerEventLowLevel, Action='start'))
+    assert ev.container == 'acontainer'
+    assert containers.get.call_count == 5
+
+    # ..but not every event
+    engine._dispatch(dict(containerEventLowLevel, Action='exec_start'))
+    assert ev.container == 'acontainer'
+    assert containers.get.call_count == 5
+
+    # images are cached by name
+    img = event.Event.fromLowLevelEvent(engine, dict(imageEventLowLevel))
+    assert img.image == 'animage'
+    assert engine.resourceCache.get(('image', 'sha256:12345')) == 'animage'
+
+
+def test_resourceCacheRace(engine, containerEventLowLevel):
+    """
+    If an event makes an object stale while it is being looked up, is the
+    stale object kept out of the cache?
+    """
+    engine.resourceCache = ResourceCache(ttl=60)
+    engine._callHandlers = lambda *a: None
+    containers = engine.client.containers
+    def get(id):
+        # the daemon answers, then the destroy event is dispatched before
+        # the lookup thread gets to put() the answer in the cache
+        engine._dispatch(dict(containerEventLowLevel, Action='destroy'))
+        return 'stale container'
+    containers.get = MagicMock(side_effect=get)
+
+    ev = event.Event.fromLowLevelEvent(engine, dict(containerEventLowLevel))
+    assert ev.container == 'stale container'
+    assert engine.resourceCache.get(('container', '12347')) is None
+
+
+def test_dispatchTable(fromEnv):
+    """
+    Do I resolve handlers once, including category wildcards, and again only
+    when handlers change?
+    """
+    eng = event.DockerEngine()
+    eng.callLater = task.Clock().callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.*")
+        def onContainer(self, event):
+            calls.append(('onContainer', event))
+
+        @engine.handler("container.die")
+        def onDie(self, event):
+            calls.append(('onDie', event))
+
+        @engine.defaultHandler
+        def onAnyEvent(self, event):
+            calls.append(('onAnyEvent', event))
+
+    app = EventConsumerApp()
+    app.engine.run()
+    table = eng._dispatchTable
+    assert table['container.die'] == (app.onAnyEvent, app.onContainer, app.onDie)
+    assert table['container.start'] == (app.onAnyEvent, app.onContainer)
+    assert table['image.pull'] == (app.onAnyEvent,)
+
+    with patch.object(eng, '_resolveHandlers', wraps=eng._resolveHandlers) as mResolve:
+        eng._callHandlers('container.die', 1)
+        eng._callHandlers('container.start', 2)
+        assert mResolve.call_count == 0
+        # an event docker added after this was written
+        eng._callHandlers('container.prune', 3)
+        eng._callHandlers('container.prune', 4)
+        assert mResolve.call_count == 1
+    assert calls == [
+            ('onAnyEvent', 1), ('onContainer', 1), ('onDie', 1),
+            ('onAnyEvent', 2), ('onContainer', 2),
+            ('onAnyEvent', 3), ('onContainer', 3),
+            ('onAnyEvent', 4), ('onContainer', 4),
+            ]
+
+    # accessing the engine through the same owner keeps the table
+    assert app.engine._dispatchTable is table
+    # adding a handler, or a new owner, throws it away
+    eng.handler("image.*")(EventConsumerApp.onDie)
+    assert eng._dispatchTable is None
+    eng._callHandlers('image.pull', 5)
+    table = eng._dispatchTable
+    assert table is not None
+    EventConsumerApp().engine
+    assert eng._dispatchTable is None
+
+    with raises(AssertionError):
+        eng.handler("bogus.*")(EventConsumerApp.onDie)
+
+
+def test_serverFilters():
+    """
+    Do I only ask the daemon for events that I have handlers for?
+    """
+    eng = event.DockerEngine()
+    fn = lambda self, event: None
+    assert eng.serverFilters() is None
+
+    # the framework's own events aren't docker's, so none are wanted
+    eng.handler("dockerish.init")(fn)
+    assert eng.serverFilters() == {'event': [event.NO_DOCKER_EVENTS]}
+    eng.eventFilters = {'label': ['com.example.monitored']}
+    assert eng.serverFilters() == {'event': [event.NO_DOCKER_EVENTS],
+            'label': ['com.example.monitored']}
+    eng.eventFilters = {}
+
+    eng.handler("container.die")(fn)
+    eng.handler("container.start")(fn)
+    assert eng.serverFilters() == {
+            'type': ['container'], 'event': ['die', 'start']}
+
+    eng.eventFilters = {'label': ['com.example.monitored']}
+    eng.handler("network.*")(fn)
+    assert eng.serverFilters() == {
+            'type': ['container', 'network'],
+            'label': ['com.example.monitored']}
+
+    eng.defaultHandler(fn)
+    assert eng.serverFilters() == {'label': ['com.example.monitored']}
+
+
+def test_serverFiltersCache():
+    """
+    With a resource cache, do I still ask for events that make it stale?
+    """
+    eng = event.DockerEngine(resourceCache=ResourceCache())
+    eng.handler("image.pull")(lambda self, event: None)
+    filters = eng.serverFilters()
+    assert filters['type'] == ['image']
+    assert set(filters['event']) == {
+            'pull', 'delete', 'import', 'load', 'tag', 'untag'}
+
+
+def test_dispatchFiltered(fromEnv, containerEventLowLevel,
+        containerEventDestroyLowLevel):
+    """
+    Do I send the filters to the daemon, and skip building Events that no
+    handler is listening for?
+    """
+    eng = event.DockerEngine()
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.destroy")
+        def onDestroy(self, event):
+            calls.append(event.name)
+
+    app = EventConsumerApp()
+    app.engine.run()
+    pClientEvents = patch.object(eng.client, 'events', autospec=True,
+            return_value=[containerEventLowLevel, containerEventDestroyLowLevel])
+    pFromLowLevel = patch.object(event.Event, 'fromLowLevelEvent',
+            wraps=event.Event.fromLowLevelEvent)
+    with pClientEvents as mEvents, pFromLowLevel as mFromLowLevel:
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+        assert mEvents.call_args[1]['filters'] == {
+                'type': ['container'], 'event': ['destroy']}
+        assert mFromLowLevel.call_count == 1
+    assert calls == ['container.destroy']
+
+
+def test_priorities(fromEnv):
+    """
+    Are events of a higher priority in a sample dispatched first, and does a
+    checkpoint only move past events that have all been dispatched?
+    """
+    checkpoint = MagicMock()
+    checkpoint.load.return_value = None
+    eng = event.DockerEngine(checkpoint=checkpoint, priorities={
+        'container.die': 10, 'daemon.reload': 10, 'container.exec_*': -1})
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.defaultHandler
+        def onEvent(self, event):
+            calls.append(event.name)
+
+    app = EventConsumerApp()
+    app.engine.run()
+    assert eng.priorityOf('container.exec_start') == -1
+    assert eng.priorityOf('container.die') == 10
+    assert eng.priorityOf('container.start') == 0
+
+    def mkEvent(n, kind, action):
+        return {"Type": kind, "Action": action,
+                "Actor": {"ID": "c%d" % n, "Attributes": {}},
+                "time": 1500000000, "timeNano": 1500000000000000000 + n}
+    sample = [mkEvent(0, 'container', 'exec_create'),
+            mkEvent(1, 'container', 'exec_start: sh -c true'),
+            mkEvent(2, 'container', 'start'),
+            mkEvent(3, 'container', 'die'),
+            mkEvent(4, 'daemon', 'reload')]
+    with patch.object(eng.client, 'events', return_value=iter(sample)):
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+    assert calls == ['dockerish.init', 'container.die', 'daemon.reload',
+            'container.start', 'container.exec_create', 'container.exec_start']
+
+    # an exec event still waiting holds the checkpoint back
+    eng._backlog.append(mkEvent(5, 'container', 'exec_die'))
+    eng._dispatch(mkEvent(6, 'container', 'die'))
+    eng._saveCheckpoint()
+    saved = checkpoint.save.call_args[0][0]
+    # with the events past it that were dispatched already
+    assert saved == event.EventCursor(1500000000000000004, set(), {
+        (1500000000000000004, ('daemon', 'reload', 'c4')),
+        (1500000000000000006, ('container', 'die', 'c6'))})
+    eng._drain()
+    eng._saveCheckpoint()
+    assert checkpoint.save.call_args[0][0].timeNano == 1500000000000000006
+    assert checkpoint.save.call_args[0][0].ahead == set()
+    eng.stop()
+
+    # restarted from the held-back checkpoint, only what was still waiting
+    # is dispatched again
+    checkpoint.load.return_value = saved
+    eng2 = event.DockerEngine(checkpoint=checkpoint,
+            priorities={'container.exec_*': -1})
+    eng2.callLater = clock.callLater
+    del calls[:]
+    class RestartedApp(object):
+        engine = eng2
+
+        @engine.defaultHandler
+        def onEvent(self, event):
+            calls.append(event.name)
+
+    RestartedApp().engine.run()
+    replayed = [mkEvent(4, 'daemon', 'reload'),
+            mkEvent(5, 'container', 'exec_die'),
+            mkEvent(6, 'container', 'die'),
+            mkEvent(7, 'container', 'stop')]
+    with patch.object(eng2.client, 'events', return_value=iter(replayed)):
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+    assert calls == ['dockerish.init', 'container.stop', 'container.exec_die']
+    assert eng2.cursor.ahead == set()
+    eng2.stop()
+
+
+def test_dispatchPredicates(fromEnv, containerEventLowLevel,
+        containerEventDestroyLowLevel):
+    """
+    Do I only call a handler with a predicate for the events whose actor
+    matches it, without building Events that nothing matches?
+    """
+    eng = event.DockerEngine()
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.create", name='peaceful_*')
+        @engine.handler("container.destroy", image='twi')
+        def onTwist(self, event):
+            calls.append(('onTwist', event.name))
+
+        @engine.handler("container.*", labels={'com.example.role': 'web'})
+        def onWeb(self, event):
+            calls.append(('onWeb', event.name))
+
+        @engine.handler("container.destroy")
+        @engine.handler("dockerish.init", image='nothing')
+        def onDestroy(self, event):
+            calls.append(('onDestroy', event.name))
+
+    app = EventConsumerApp()
+    app.engine.run()
+    clock.advance(0)
+    assert calls == []
+    assert isinstance(eng._dispatchTable['container.destroy'], HandlerIndex)
+    assert eng._dispatchTable['image.pull'] == ()
+
+    web = dict(containerEventLowLevel, Actor={'ID': '1', 'Attributes': {
+        'image': 'nginx', 'name': 'frontend', 'com.example.role': 'web'}})
+    pFromLowLevel = patch.object(event.Event, 'fromLowLevelEvent',
+            wraps=event.Event.fromLowLevelEvent)
+    with pFromLowLevel as mFromLowLevel:
+        eng._fire(dict(containerEventLowLevel, Actor={'ID': '2',
+            'Attributes': {'image': 'mongo', 'name': 'db'}}))
+        assert mFromLowLevel.call_count == 0
+        eng._fire(containerEventLowLevel)
+        eng._fire(containerEventDestroyLowLevel)
+        eng._fire(web)
+    assert calls == [
+            ('onTwist', 'container.create'),
+            ('onTwist', 'container.destroy'),
+            ('onDestroy', 'container.destroy'),
+            ('onWeb', 'container.create'),
+            ]
+
+
+def test_eventLazyActor(engine, containerEventLowLevel, containerActorLowLevel):
+    """
+    Do I keep the actor raw until it's needed, and still compare equal to an
+    Event built with a decoded actor?
+    """
+    ev = event.Event.fromLowLevelEvent(engine,
+            dict(containerEventLowLevel, scope='local'))
+    assert not hasattr(ev, '__dict__')
+    assert ev._actor is containerActorLowLevel
+    assert ev.actorId == '12347'
+    assert ev.scope == 'local'
+
+    decoded = event.EventActor.fromLowLevelActor(containerActorLowLevel)
+    ev2 = event.Event.fromLowLevelEvent(engine,
+            dict(containerEventLowLevel, Actor=decoded, scope='local'))
+    assert ev == ev2
+
+    assert ev.actor == decoded
+    assert ev.actor is ev.actor
+    assert ev.actorId == '12347'
+    assert ev.actor.attributes == {'image': 'twist', 'name': 'peaceful_booth'}
+    assert ev == ev2
+
+    # a compact copy keeps neither the raw actor nor its attributes
+    compact = ev2.compact()
+    assert compact == ev
+    assert compact.actor is not decoded
+    assert compact.actor.attributes is None
+    assert ev2.actor is decoded
+    withId = event.Event.fromLowLevelEvent(engine,
+            dict(containerEventLowLevel, id=u''.join(['1234', '7'])))
+    assert withId.compact().actor.id is withId.id
+
+
+class FakeModel(object):
+    """
+    Something like a docker-py Model, as returned by .list()
+    """
+    def __init__(self, **attrs):
+        self.attrs = attrs
+        self.reloads = 0
+
+    @property
+    def id(self):
+        return self.attrs['Id']
+
+    def reload(self):
+        self.reloads += 1
+        self.attrs['Config'] = {}
+
+
+def test_reconcile(fromEnv):
+    """
+    Do I list existing objects in bulk and dispatch synthetic events for
+    them, before listening for events?
+    """
+    eng = event.DockerEngine(
+            reconcile=('container', 'network', 'volume'),
+            resourceCache=ResourceCache(),
+            reconcileConcurrency=2)
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    eng.deferToThread = defer.maybeDeferred
+    containers = [
+        FakeModel(Id='c%d' % n, Names=['/web%d' % n], Image='nginx',
+            Labels={'com.example.role': 'web'}) for n in range(5)]
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.start")
+        def onStart(self, event):
+            calls.append((event.name, event.status, event.actor.name,
+                event.actor.attributes.get('com.example.role'),
+                event.container))
+
+        @engine.handler("network.create")
+        @engine.handler("volume.create")
+        @engine.handler("dockerish.init")
+        def onOther(self, event):
+            calls.append((event.name, event.status, event.actorId))
+
+    app = EventConsumerApp()
+    app.engine.run()
+    client = eng.client
+    client.containers = MagicMock()
+    client.containers.list.return_value = containers
+    client.networks = MagicMock()
+    client.networks.list.return_value = [
+            FakeModel(Id='n1', Name='bridge', Driver='bridge')]
+    client.volumes = MagicMock()
+    client.volumes.list.return_value = [FakeModel(Name='v1', Driver='local')]
+    with patch.object(eng, '_startEvents') as mStart:
+        clock.advance(0)
+        assert mStart.call_count == 1
+
+    client.containers.list.assert_called_once_with(sparse=True)
+    # each container was inspected once, and the handlers never asked again
+    assert [c.reloads for c in containers] == [1] * 5
+    assert client.containers.get.call_count == 0
+    assert calls[0] == ('dockerish.init', 'init', None)
+    assert calls[1:6] == [
+            ('container.start', 'reconcile', 'web%d' % n, 'web', containers[n])
+            for n in range(5)]
+    assert calls[6:] == [
+            ('network.create', 'reconcile', 'n1'),
+            ('volume.create', 'reconcile', 'v1'),
+            ]
+
+
+def test_reconcileFailed(fromEnv):
+    """
+    If listing fails, do I still start listening for events?
+    """
+    eng = event.DockerEngine(reconcile=('container',))
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    eng.deferToThread = defer.maybeDeferred
+    class EventConsumerApp(object):
+        engine = eng
+
+    app = EventConsumerApp()
+    app.engine.run()
+    eng.client.containers = MagicMock()
+    eng.client.containers.list.side_effect = IOError("no daemon")
+    with patch.object(eng, '_startEvents') as mStart, patch.object(event.log, 'err'):
+        clock.advance(0)
+        assert mStart.call_count == 1
+
+
+def test_reconcileNoCache(fromEnv):
+    """
+    Without a resource cache, do I dispatch without inspecting?
+    """
+    eng = event.DockerEngine(reconcile=('container',))
+    eng.client = MagicMock()
+    container = FakeModel(Id='c1', Names=['/web'], Image='nginx')
+    eng.client.containers.list.return_value = [container]
+    eng._fire = MagicMock()
+    existing = eng._listExisting()
+    assert eng._inspectExisting(existing) is existing
+    eng._dispatchExisting(existing)
+    assert container.reloads == 0
+    assert eng._fire.call_args[0][0]['Actor']['Attributes'] == {
+            'image': 'nginx', 'name': 'web'}
+
+
+def test_backpressure(fromEnv):
+    """
+    When a handler's queue fills, do I stop sampling until it drains, and
+    keep the rest of the sample waiting?
+    """
+    eng = event.DockerEngine()
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    running = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.start", concurrency=1, queueSize=1)
+        def onStart(self, event):
+            d = defer.Deferred()
+            running.append((event.actorId, d))
+            return d
+
+        @engine.handler("container.die")
+        async def onDie(self, event):
+            raise ValueError("async failure")
+
+    app = EventConsumerApp()
+    app.engine.run()
+    assert eng.handlerOptions == {'onStart': {'concurrency': 1, 'queueSize': 1}}
+    assert eng.saturated is False
+
+    def mkEvent(n, action='start'):
+        return {"Type": "container", "Action": action,
+                "Actor": {"ID": "c%d" % n, "Attributes": {}},
+                "time": 1500000000, "timeNano": 1500000000000000000 + n}
+
+    with patch.object(eng.client, 'events', autospec=True,
+            return_value=[mkEvent(n) for n in range(4)]) as mEvents:
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+        assert mEvents.call_count == 1
+        # c0 running, c1 queued (full), c2 and c3 held in the backlog
+        assert [r[0] for r in running] == ['c0']
+        assert len(eng._backlog) == 2
+        assert eng.saturated
+        assert not eng._flowing.is_set()
+        clock.advance(event.PEEK_INTERVAL_SECONDS * 10)
+        assert mEvents.call_count == 1
+
+        running[0][1].callback(None)
+        assert [r[0] for r in running] == ['c0', 'c1']
+        assert len(eng._backlog) == 1
+        running[1][1].callback(None)
+        running[2][1].callback(None)
+        assert [r[0] for r in running] == ['c0', 'c1', 'c2', 'c3']
+        assert not eng._backlog
+        assert eng._flowing.is_set()
+        # sampling starts again
+        mEvents.return_value = [mkEvent(4, 'die')]
+        with patch.object(event, 'watch', wraps=event.watch) as mWatch, \
+                patch('codado.dockerish.flow.log.err') as mErr:
+            clock.advance(event.PEEK_INTERVAL_SECONDS)
+            assert mEvents.call_count == 2
+            assert mWatch.call_args[0][0] == 'onDie'
+            assert mErr.call_count == 1
+
+    # _callHandlers watches results too
+    with patch.object(event, 'watch') as mWatch:
+        eng._callHandlers('container.start', event.Event.fromLowLevelEvent(eng, mkEvent(5)))
+        assert mWatch.call_count == 0
+        eng._callHandlers('container.die', event.Event.fromLowLevelEvent(eng, mkEvent(6, 'die')))
+        assert mWatch.call_count == 1
+        mWatch.call_args[0][1].close()
+
+
+def test_streamHandOff(fromEnv):
+    """
+    Does the stream reader stop reading once it has handed the reactor more
+    events than it has taken, without waiting for the reactor to say so?
+    """
+    eng = event.DockerEngine(streaming=True)
+    eng.callLater = task.Clock().callLater
+    readers = []
+    eng.callInThread = lambda f, *a: readers.append((f, a))
+    handedOff = []
+    def callFromThread(f, *a):
+        if f == eng._arrived:
+            handedOff.append((f, a))
+        else:
+            f(*a)
+    eng.callFromThread = callFromThread
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.start")
+        def onStart(self, event):
+            calls.append(event.actorId)
+
+    calls = []
+    app = EventConsumerApp()
+    app.engine.run()
+    stream = [{"Type": "container", "Action": "start",
+        "Actor": {"ID": "c%d" % n, "Attributes": {}},
+        "time": 1500000000, "timeNano": 1500000000000000000 + n}
+        for n in range(10)]
+    [(readStream, args)] = readers
+    def events(**kw):
+        for llEvent in stream:
+            yield llEvent
+        eng.running = False
+    with patch.object(event, 'STREAM_HANDOFF_LIMIT', 4), \
+            patch.object(eng.client, 'events', side_effect=events):
+        reader = threading.Thread(target=readStream, args=args)
+        reader.start()
+        try:
+            for n in range(100):
+                time.sleep(0.01)
+                if len(handedOff) == 4 and not eng._flowing.is_set():
+                    break
+            # ..and stays stopped
+            time.sleep(0.05)
+            assert len(handedOff) == 4
+            assert not eng._flowing.is_set()
+
+            # the reactor takes them, and the reader carries on
+            eng.callFromThread = lambda f, *a: f(*a)
+            for f, a in handedOff:
+                f(*a)
+            reader.join(5)
+            assert not reader.is_alive()
+            assert calls == ['c%d' % n for n in range(10)]
+            assert eng._handedOff == 0
+            assert eng._flowing.is_set()
+        finally:
+            eng.running = False
+            eng._flowing.set()
+
+
+def test_rawEvents(fromEnv, containerEventLowLevel, containerEventDestroyLowLevel):
+    """
+    With rawEvents, do I decode the bytes of the events stream myself, when
+    polling and when streaming?
+    """
+    raw = [(json.dumps(e) + '\n').encode('utf-8')
+            for e in (containerEventLowLevel, containerEventDestroyLowLevel)]
+    eng = event.DockerEngine(rawEvents=True)
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.create")
+        @engine.handler("container.destroy")
+        def onEvent(self, event):
+            calls.append(event.name)
+
+    app = EventConsumerApp()
+    app.engine.run()
+    with patch.object(eng.client, 'events', autospec=True,
+            return_value=iter([raw[0][:10], raw[0][10:] + raw[1]])) as mEvents:
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+    assert mEvents.call_args[1]['decode'] is False
+    assert calls == ['container.create', 'container.destroy']
+
+    del calls[:]
+    eng.streaming = True
+    eng.callFromThread = lambda f, *a: f(*a)
+    later = (json.dumps(dict(containerEventLowLevel, timeNano=2 * 10 ** 18)) + '\n'
+            ).encode('utf-8')
+    def events(**kw):
+        assert kw['decode'] is False
+        yield later[:7]
+        yield later[7:]
+        eng.running = False
+    with patch.object(eng.client, 'events', side_effect=events):
+        eng._readStream(0)
+    assert calls == ['container.create']
+
+
+def test_metrics(fromEnv, containerEventLowLevel):
+    """
+    With metrics, do I report event lag, fetch times and handler calls?
+    """
+    rec = MetricsRecorder()
+    eng = event.DockerEngine(metrics=rec)
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    eng.callFromThread = lambda f, *a: f(*a)
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.create")
+        def onCreate(self, event):
+            pass
+
+        @engine.handler("container.create", coalesce=1)
+        def onCreateLater(self, event):
+            pass
+
+    app = EventConsumerApp()
+    app.engine.run()
+    with patch.object(eng.client, 'events', autospec=True,
+            return_value=[dict(containerEventLowLevel)]):
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+    clock.advance(1)
+    # as if from a stream reader
+    eng._handOff(None, dict(containerEventLowLevel, timeNano=1497218188361178104))
+    snap = rec.snapshot()
+    assert snap['events']['container.create']['count'] == 2
+    assert snap['lag']['count'] == 2
+    assert snap['lag']['sum'] > 0
+    # two polls, and one hop from the reader
+    assert snap['fetch']['count'] == 3
+    assert snap['handlers']['onCreate']['calls'] == 2
+    assert snap['handlers']['onCreateLater']['calls'] == 1
+
+
+def test_drainReentrant(fromEnv):
+    """
+    When a queued handler finishes synchronously, do the other handlers still
+    see events in order, without recursing once per event?
+    """
+    eng = event.DockerEngine()
+    eng.callLater = task.Clock().callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.start", concurrency=2)
+        def q(self, event):
+            pass
+
+        @engine.handler("container.start")
+        def plain(self, event):
+            calls.append(event.actorId)
+
+    app = EventConsumerApp()
+    app.engine.run()
+    storm = [{"Type": "container", "Action": "start",
+        "Actor": {"ID": "c%d" % n, "Attributes": {}},
+        "time": 1500000000, "timeNano": 1500000000000000000 + n}
+        for n in range(2000)]
+    eng._dispatchBatch(storm)
+    assert calls == ['c%d' % n for n in range(2000)]
+    assert eng._flowing.is_set()
+
+
+def test_coalesce(fromEnv):
+    """
+    Do coalescing handlers see far fewer events during a storm?
+    """
+    eng = event.DockerEngine()
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.health_status", coalesce=2)
+        @engine.handler("container.exec_start", coalesce=2)
+        def onHealth(self, event):
+            calls.append(('onHealth', event.actorId, event.name))
+
+        @engine.handler("container.exec_start", coalesce=2, batch=True)
+        def onExecs(self, events):
+            calls.append(('onExecs', [e.actorId for e in events]))
+
+        @engine.handler("container.exec_start")
+        def onEvery(self, event):
+            calls.append(('onEvery',))
+
+    app = EventConsumerApp()
+    app.engine.run()
+
+    storm = []
+    for n in range(300):
+        storm.append({"Type": "container",
+            "Action": ('exec_start: /bin/check %d' % n if n < 299
+                else 'health_status: healthy'),
+            "Actor": {"ID": "c%d" % (n % 3), "Attributes": {}},
+            "time": 1500000000, "timeNano": 1500000000000000000 + n})
+    with patch.object(eng.client, 'events', autospec=True, return_value=storm):
+        clock.advance(event.PEEK_INTERVAL_SECONDS)
+    assert len(calls) == 299
+    clock.advance(2)
+    # c2's health_status does not swallow its exec_start
+    assert calls[299:] == [
+            ('onHealth', 'c2', 'container.exec_start'),
+            ('onHealth', 'c0', 'container.exec_start'),
+            ('onHealth', 'c1', 'container.exec_start'),
+            ('onHealth', 'c2', 'container.health_status'),
+            ('onExecs', ['c2', 'c0', 'c1']),
+            ]
+
+    # anything held is flushed when the engine stops
+    eng._dispatch({"Type": "container", "Action": "exec_start",
+        "Actor": {"ID": "c0", "Attributes": {}},
+        "time": 1600000000, "timeNano": 1600000000000000000})
+    eng.stop()
+    assert calls[-2:] == [('onHealth', 'c0', 'container.exec_start'),
+            ('onExecs', ['c0'])]
+    # the details of each exec don't make a new event name apiece
+    assert 'container.exec_start: /bin/check 0' not in eng._dispatchTable
+
+    with raises(AssertionError):
+        eng.handler("container.die", batch=True)(EventConsumerApp.onEvery)
+    with raises(AssertionError):
+        eng.handler("container.die", batch=True, coalesce=1, concurrency=2)(
+                EventConsumerApp.onEvery)
@@ -0,0 +1,185 @@
+"""
+Tests of flow control between docker events and handlers
+"""
+from mock import patch
+
+from pytest import raises
+
+from twisted.internet import defer, task
+
+from codado.dockerish import flow
+
+
+class FakeEvent(object):
+    def __init__(self, actorId, n, name='container.start'):
+        self.actorId = actorId
+        self.n = n
+        self.name = name
+
+    def __repr__(self):
+        return '%s%d' % (self.actorId, self.n)
+
+
+def test_toDeferred():
+    """
+    Do I recognize asynchronous results?
+    """
+    d = defer.Deferred()
+    assert flow.toDeferred(d) is d
+    assert flow.toDeferred(None) is None
+    assert flow.toDeferred(12) is None
+
+    async def coro():
+        return 1
+    assert flow.toDeferred(coro()).result == 1
+
+
+def test_watch():
+    """
+    Do I log asynchronous handler failures?
+    """
+    with patch.object(flow.log, 'err') as mErr:
+        assert flow.watch('onDie', None) is None
+        flow.watch('onDie', defer.fail(ValueError()))
+        assert mErr.call_args[0][1] == "Handler 'onDie' failed"
+
+
+@patch.object(flow.log, 'err')
+def test_handlerQueue(mErr):
+    """
+    Do I run a handler at most `concurrency` times at once, one event per
+    actor at a time and in order, and report when I have room again?
+    """
+    running = {}
+    def onEvent(event):
+        d = running[repr(event)] = defer.Deferred()
+        return d
+    drained = []
+    q = flow.HandlerQueue(onEvent, concurrency=2, queueSize=2,
+            onDrain=lambda: drained.append(len(q.pending)))
+    assert q.__name__ == 'onEvent'
+
+    for ev in [FakeEvent('a', 1), FakeEvent('a', 2), FakeEvent('b', 1),
+            FakeEvent('c', 1)]:
+        q(ev)
+    # a2 waits for a1; b1 gets the second slot; c1 waits for a slot
+    assert sorted(running) == ['a1', 'b1']
+    assert list(map(repr, q.pending)) == ['a2', 'c1']
+    assert q.full
+
+    running.pop('b1').callback(None)
+    # a2 still can't run, c1 can
+    assert sorted(running) == ['a1', 'c1']
+    assert list(map(repr, q.pending)) == ['a2']
+    assert drained == [1]
+
+    running.pop('a1').errback(ValueError())
+    assert mErr.call_count == 1
+    assert sorted(running) == ['a2', 'c1']
+    assert not q.pending
+
+
+def test_handlerQueueSync():
+    """
+    Do synchronous handlers, and handlers that raise, pass through?
+    """
+    calls = []
+    def onEvent(event):
+        calls.append(event.n)
+        if event.n == 2:
+            raise ValueError()
+    q = flow.HandlerQueue(onEvent)
+    with patch.object(flow.log, 'err') as mErr:
+        for n in range(3):
+            q(FakeEvent('a', n))
+        assert mErr.call_count == 1
+    assert calls == [0, 1, 2]
+    assert q.running == 0
+
+
+def test_coalescer():
+    """
+    Do I collapse an actor's events within the window to the latest one?
+    """
+    clock = task.Clock()
+    calls = []
+    c = flow.Coalescer(lambda ev: calls.append(repr(ev)), window=1,
+            callLater=clock.callLater)
+    for ev in [FakeEvent('a', 1), FakeEvent('b', 1), FakeEvent('a', 2),
+            FakeEvent('a', 3)]:
+        c(ev)
+    assert calls == []
+    clock.advance(0.5)
+    c(FakeEvent('b', 2))
+    clock.advance(0.5)
+    # a's latest, then b's latest, ordered by their last arrival
+    assert calls == ['a3', 'b2']
+    clock.advance(5)
+    assert calls == ['a3', 'b2']
+
+    c(FakeEvent('c', 1))
+    c.flush()
+    assert calls[-1] == 'c1'
+    assert not clock.getDelayedCalls()
+    c.flush()
+    assert len(calls) == 3
+
+    # different kinds of event for one actor are not collapsed together
+    c(FakeEvent('d', 1, 'container.start'))
+    c(FakeEvent('d', 2, 'container.die'))
+    c(FakeEvent('d', 3, 'container.start'))
+    clock.advance(1)
+    assert calls[3:] == ['d2', 'd3']
+
+
+def test_coalescerBatch():
+    """
+    In batch mode, do I deliver the window's events in one call?
+    """
+    clock = task.Clock()
+    calls = []
+    c = flow.Coalescer(lambda evs: calls.append(list(map(repr, evs))),
+            window=1, callLater=clock.callLater, batch=True)
+    for n in range(100):
+        c(FakeEvent('abc'[n % 3], n))
+    clock.advance(1)
+    assert calls == [['b97', 'c98', 'a99']]
+
+
+def mkEvent(lane, n):
+    return {'lane': lane, 'timeNano': n}
+
+
+def test_priorityBacklog():
+    """
+    Do I take events from the first lane that has any, in order, but give a
+    later lane a turn when it has waited long enough?
+    """
+    backlog = flow.PriorityBacklog(3, lambda e: e['lane'], starvationLimit=3)
+    with raises(IndexError):
+        backlog.popleft()
+    assert backlog.oldest() is None
+    backlog.extend(mkEvent(2, n) for n in range(3))
+    backlog.extend(mkEvent(0, n) for n in range(3, 10))
+    backlog.append(mkEvent(1, 10))
+    assert len(backlog) == 11
+    assert backlog.oldest() == 0
+
+    taken = []
+    while backlog:
+        e = backlog.popleft()
+        taken.append((e['lane'], e['timeNano']))
+    assert taken == [
+            (0, 3), (0, 4), (0, 5),
+            # lanes 1 and 2 have both waited for 3
+            (1, 10),
+            (2, 0),
+            (0, 6), (0, 7), (0, 8),
+            (2, 1),
+            (0, 9),
+            (2, 2),
+            ]
+
+    # a lane that empties starts waiting afresh
+    backlog.extend([mkEvent(0, 11), mkEvent(0, 12), mkEvent(1, 13)])
+    assert [backlog.popleft()['timeNano'] for n in range(3)] == [11, 12, 13]
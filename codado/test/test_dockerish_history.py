@@ -0,0 +1,143 @@
+"""
+Tests of the dockerish event history
+"""
+from pytest import fixture
+
+from twisted.internet import task
+
+from codado.dockerish import event
+from codado.dockerish.history import EventHistory
+
+
+@fixture
+def containerEvent(mkEvent):
+    """
+    A container event `n` seconds after the epoch of these tests
+    """
+    def containerEvent(n, actorId, action='start'):
+        return event.Event.fromLowLevelEvent(None,
+                mkEvent((1000 + n) * 1000000000, actorId, action))
+    return containerEvent
+
+
+@fixture
+def history(containerEvent):
+    h = EventHistory(capacity=4)
+    for n, (actorId, action) in enumerate([
+            ('a', 'create'), ('a', 'start'), ('b', 'start'), ('a', 'die')]):
+        h.append(containerEvent(n, actorId, action))
+    return h
+
+
+def actions(events):
+    return [(e.actorId, e.action, e.time) for e in events]
+
+
+def test_query(history):
+    """
+    Can I find events by actor, name and time?
+    """
+    assert len(history) == 4
+    assert actions(history.query(actorId='a')) == [
+            ('a', 'create', 1000), ('a', 'start', 1001), ('a', 'die', 1003)]
+    assert actions(history.query(actorId='a', since=1001)) == [
+            ('a', 'start', 1001), ('a', 'die', 1003)]
+    assert actions(history.query(name='container.start', until=1001.5)) == [
+            ('a', 'start', 1001)]
+    assert actions(history.query(since=1002)) == [
+            ('b', 'start', 1002), ('a', 'die', 1003)]
+    assert actions(history.query(actorId='a', name='container.start')) == [
+            ('a', 'start', 1001)]
+    assert history.query(actorId='nobody') == []
+
+    assert history.latest(actorId='a').action == 'die'
+    assert history.latest(name='container.start').actorId == 'b'
+    assert history.latest().time == 1003
+    assert history.latest(actorId='b', name='container.start').time == 1002
+    assert history.latest(actorId='b', name='container.die') is None
+    assert history.latest(name='container.destroy') is None
+
+
+def test_keepAttributes(containerEvent):
+    """
+    Do I keep compact copies of events, unless asked to keep attributes?
+    """
+    ev = containerEvent(0, 'a')
+    compact, full = EventHistory(), EventHistory(keepAttributes=True)
+    compact.append(ev)
+    full.append(ev)
+    assert compact.latest() == ev
+    assert compact.latest().actor.attributes is None
+    assert full.latest() is ev
+
+
+def test_ringBuffer(history, containerEvent):
+    """
+    Once I'm full, do I forget the oldest events, and their index entries?
+    """
+    history.append(containerEvent(4, 'c'))
+    history.append(containerEvent(5, 'c'))
+    assert len(history) == 4
+    assert actions(history.query()) == [
+            ('b', 'start', 1002), ('a', 'die', 1003),
+            ('c', 'start', 1004), ('c', 'start', 1005)]
+    assert actions(history.query(actorId='a')) == [('a', 'die', 1003)]
+    assert 'container.create' not in history._byName
+
+    # cycle many times through the buffer; the indexes stay bounded
+    for n in range(6, 1000):
+        history.append(containerEvent(n, 'c'))
+    assert actions(history.query(actorId='c', since=1998)) == [
+            ('c', 'start', 1998), ('c', 'start', 1999)]
+    assert list(history._byActor) == ['c']
+    index = history._byActor['c']
+    assert len(index) == 4
+    assert len(index.seqs) < 100
+
+
+def test_outOfOrder(containerEvent):
+    """
+    Do time queries still find events that arrived out of time order, e.g.
+    reconciled "now" ahead of a stream resumed from a checkpoint?
+    """
+    h = EventHistory(capacity=10)
+    h.append(containerEvent(100, 'a', 'start'))
+    for n in (5, 6, 7):
+        h.append(containerEvent(n, 'b'))
+    h.append(containerEvent(101, 'a', 'die'))
+    assert actions(h.query(since=1006, until=1050)) == [
+            ('b', 'start', 1006), ('b', 'start', 1007)]
+    assert actions(h.query(until=1005)) == [('b', 'start', 1005)]
+    assert actions(h.query(since=1100)) == [
+            ('a', 'start', 1100), ('a', 'die', 1101)]
+    assert actions(h.query(actorId='b', since=1006)) == [
+            ('b', 'start', 1006), ('b', 'start', 1007)]
+
+
+def test_engineHistory(fromEnv, containerEventLowLevel,
+        containerEventDestroyLowLevel):
+    """
+    Does the engine remember every event it receives, even ones no handler
+    is listening for?
+    """
+    eng = event.DockerEngine(history=EventHistory())
+    eng.callLater = task.Clock().callLater
+    seen = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.destroy")
+        def onDestroy(self, event):
+            seen.append(self.engine.history.query(actorId=event.actorId))
+
+    app = EventConsumerApp()
+    app.engine.run()
+    eng._dispatch(dict(containerEventLowLevel))
+    eng._dispatch(dict(containerEventDestroyLowLevel))
+    eng._dispatch(dict(containerEventLowLevel, Action='die'))
+    assert len(eng.history) == 3
+    [[destroyed]] = seen
+    assert destroyed.name == 'container.destroy'
+    assert [e.name for e in eng.history.query(actorId='12347')] == [
+            'container.create', 'container.die']
+
@@ -0,0 +1,85 @@
+"""
+Tests of choosing handlers by predicates
+"""
+from codado.dockerish.match import HandlerIndex, Predicate, PrefixTrie
+
+
+def attrs(**kw):
+    ret = {'image': 'corydodt/noms:latest', 'name': 'noms_1',
+            'com.example.role': 'web'}
+    ret.update(kw)
+    return ret
+
+
+def test_predicate():
+    """
+    Do I match an actor only when every condition holds?
+    """
+    assert not Predicate()
+    assert Predicate(signal=9)
+    assert Predicate(signal=9).signal == '9'
+    assert Predicate(labels={'b': '2', 'a': '1'}).labels == (('a', '1'), ('b', '2'))
+
+    assert Predicate()(attrs())
+    assert Predicate(image='corydodt/')(attrs())
+    assert not Predicate(image='corydodt/x')(attrs())
+    assert not Predicate(image='corydodt/')({})
+    assert Predicate(labels={'com.example.role': 'web'})(attrs())
+    assert not Predicate(labels={'com.example.role': 'db'})(attrs())
+    assert Predicate(hasLabels=['com.example.role'])(attrs())
+    assert not Predicate(hasLabels=['com.example.other'])(attrs())
+    assert Predicate(name='noms_1')(attrs())
+    assert not Predicate(name='noms_2')(attrs())
+    assert Predicate(name='noms_*')(attrs())
+    assert not Predicate(name='noms_?x')(attrs())
+    assert not Predicate(name='noms_*')({})
+    assert Predicate(signal=9)(attrs(signal='9'))
+    assert not Predicate(signal=15)(attrs(signal='9'))
+    assert not Predicate(image='corydodt/', name='other')(attrs())
+    assert Predicate(name='[n]oms_*').namePrefix == ''
+    assert Predicate(name='noms_?').namePrefix == 'noms_'
+
+
+def test_prefixTrie():
+    """
+    Do I find everything stored under a prefix of a string?
+    """
+    trie = PrefixTrie()
+    for prefix in ('', 'a', 'ab', 'abc', 'b', 'abd'):
+        trie.add(prefix, prefix)
+    assert trie.size == 6
+    assert trie.under('abcd') == ['', 'a', 'ab', 'abc']
+    assert trie.under('ax') == ['', 'a']
+    assert trie.under('') == ['']
+    assert PrefixTrie().under('abc') == []
+
+
+def test_handlerIndex():
+    """
+    Do I select exactly the matching handlers, in the order they were
+    registered, whatever condition each one is indexed by?
+    """
+    predicates = [
+        None,
+        Predicate(labels={'com.example.role': 'web'}, name='noms_*'),
+        Predicate(labels={'com.example.role': 'db'}),
+        Predicate(name='noms_1'),
+        Predicate(signal=9),
+        Predicate(image='corydodt/'),
+        Predicate(image='corydodt/noms', hasLabels=['x']),
+        Predicate(hasLabels=['com.example.role']),
+        Predicate(name='noms_?'),
+        Predicate(name='*_1'),
+        Predicate(name='other'),
+        ]
+    index = HandlerIndex([(n, p) for (n, p) in enumerate(predicates)])
+    assert len(index) == 11
+    assert index.select(attrs()) == (0, 1, 3, 5, 7, 8, 9)
+    assert index.select(attrs(signal='9', x='')) == (0, 1, 3, 4, 5, 6, 7, 8, 9)
+    assert index.select(attrs(name='other', image='mongo')) == (0, 7, 10)
+    assert index.select(None) == (0,)
+
+    # nothing to look up in the tries
+    index = HandlerIndex([('a', Predicate(labels={'k': 'v'}))])
+    assert index.select({'k': 'v'}) == ('a',)
+    assert index.select({'k': 'w'}) == ()
@@ -0,0 +1,127 @@
+"""
+Tests of dockerish metrics
+"""
+from pytest import raises
+
+from twisted.internet import defer
+
+from zope.interface.verify import verifyObject
+
+from codado.dockerish import metrics
+
+
+class Clock(object):
+    now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_histogram():
+    """
+    Do I count observations into cumulative buckets?
+    """
+    h = metrics.Histogram((0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v)
+    assert h.snapshot() == {
+            'buckets': [(0.1, 2), (1.0, 3), (float('inf'), 4)],
+            'sum': 3.65,
+            'count': 4,
+            }
+
+
+def test_recorder():
+    """
+    Do I keep counts, latencies and per-second rates of events and handlers?
+    """
+    clock = Clock()
+    rec = metrics.MetricsRecorder(clock=clock)
+    assert verifyObject(metrics.IMetricsSink, rec)
+
+    for n in range(10):
+        rec.eventDispatched('container.start', 0.002)
+    rec.eventDispatched('container.die', 2)
+    rec.fetched(0.003)
+    rec.handlerFinished('onStart', 0.0002, False)
+    rec.handlerFinished('onStart', 0.02, True)
+    clock.now += 2
+    snap = rec.snapshot()
+    assert snap['events'] == {
+            'container.start': {'count': 10, 'perSecond': 5.0},
+            'container.die': {'count': 1, 'perSecond': 0.5},
+            }
+    assert snap['lag']['count'] == 11
+    assert snap['fetch']['count'] == 1
+    assert snap['handlers']['onStart']['calls'] == 2
+    assert snap['handlers']['onStart']['errors'] == 1
+    assert snap['handlers']['onStart']['latency']['sum'] == 0.0202
+
+    # rates are since the last snapshot
+    rec.eventDispatched('container.die', 0.001)
+    clock.now += 1
+    snap = rec.snapshot()
+    assert snap['events']['container.start'] == {'count': 10, 'perSecond': 0.0}
+    assert snap['events']['container.die'] == {'count': 2, 'perSecond': 1.0}
+    assert rec.snapshot()['events']['container.die']['perSecond'] == 0.0
+
+
+def test_metered():
+    """
+    Do I report every handler call, including failures and asynchronous
+    ones, without changing what the handler does?
+    """
+    rec = metrics.MetricsRecorder()
+    clock = iter(range(100)).__next__
+
+    def sync(event):
+        return event * 2
+
+    def broken(event):
+        raise ValueError(event)
+
+    waiting = []
+    def later(event):
+        d = defer.Deferred()
+        waiting.append(d)
+        return d
+
+    assert metrics.metered(sync, rec, clock)(21) == 42
+    with raises(ValueError):
+        metrics.metered(broken, rec, clock)(1)
+    d1 = metrics.metered(later, rec, clock)(1)
+    d2 = metrics.metered(later, rec, clock)(2)
+    assert rec.handlers['sync'].calls == 1
+    assert rec.handlers['broken'].errors == 1
+    assert 'later' not in rec.handlers
+    waiting[0].callback('ok')
+    waiting[1].errback(RuntimeError())
+    assert d1.result == 'ok'
+    d2.addErrback(lambda f: f.trap(RuntimeError))
+    assert rec.handlers['later'].calls == 2
+    assert rec.handlers['later'].errors == 1
+    assert metrics.metered(later, rec).__name__ == 'later'
+
+
+def test_renderPrometheus():
+    """
+    Do I render a snapshot in the Prometheus text format?
+    """
+    rec = metrics.MetricsRecorder()
+    rec.eventDispatched('container.start', 0.002)
+    rec.handlerFinished('on"Start', 0.00002, False)
+    text = metrics.renderPrometheus(rec.snapshot())
+    lines = text.splitlines()
+    assert text.endswith('\n')
+    assert '# TYPE dockerish_events_total counter' in lines
+    assert 'dockerish_events_total{event="container.start"} 1' in lines
+    assert 'dockerish_event_lag_seconds_bucket{le="0.001"} 0' in lines
+    assert 'dockerish_event_lag_seconds_bucket{le="0.005"} 1' in lines
+    assert 'dockerish_event_lag_seconds_bucket{le="+Inf"} 1' in lines
+    assert 'dockerish_event_lag_seconds_sum 0.002' in lines
+    assert 'dockerish_fetch_seconds_count 0' in lines
+    assert 'dockerish_handler_calls_total{handler="on\\"Start"} 1' in lines
+    assert 'dockerish_handler_errors_total{handler="on\\"Start"} 0' in lines
+    assert ('dockerish_handler_seconds_bucket{handler="on\\"Start",le="5e-05"} 1'
+            in lines)
+    assert 'dockerish_handler_seconds_count{handler="on\\"Start"} 1' in lines
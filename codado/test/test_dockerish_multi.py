@@ -0,0 +1,138 @@
+"""
+Tests of watching many docker daemons at once
+"""
+from mock import MagicMock, patch
+
+from pytest import raises
+
+from twisted.internet import task
+
+from codado.dockerish import event, multi, replay
+from codado.dockerish.cache import ResourceCache
+
+
+def recording(*llEvents):
+    return [replay.dumpEvent(e) for e in llEvents]
+
+
+def test_fanIn(mkEvent):
+    """
+    Do I stream from each daemon separately, and dispatch their events
+    merged in time order, tagged with their host?
+    """
+    base = 1500000000000000000
+    daemons = {
+        'unix:///a.sock': replay.ReplayClient(recording(
+            mkEvent(base + 1, 'a1'), mkEvent(base + 4, 'a2'))),
+        'tcp://b:2376': replay.ReplayClient(recording(
+            mkEvent(base + 2, 'b1'), mkEvent(base + 3, 'b2'),
+            mkEvent(base + 9, 'b3'))),
+        }
+    eng = multi.MultiDockerEngine(endpoints=sorted(daemons),
+            clientFactory=daemons.get, mergeDelay=0.1)
+    clock = task.Clock()
+    eng.callLater = clock.callLater
+    eng.seconds = clock.seconds
+    readers = []
+    eng.callInThread = lambda f, *a: readers.append((f, a))
+    eng.callFromThread = lambda f, *a: f(*a)
+    calls = []
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.start")
+        def onStart(self, event):
+            calls.append((event.host, event.actorId))
+
+    app = EventConsumerApp()
+    app.engine.run()
+    assert [a[1] for f, a in readers] == sorted(daemons)
+    assert eng.clientFor('tcp://b:2376') is daemons['tcp://b:2376']
+
+    def sleep(seconds):
+        eng.running = False
+    with patch.object(eng._stopping, 'wait', side_effect=sleep):
+        for f, a in readers:
+            eng.running = True
+            f(*a)
+            # each reader has its own position
+            assert eng.cursorFor(a[1]).timeNano is not None
+
+    # each stream ended, and each host is retried with its own backoff
+    assert [eng.healthFor(a[1]).connected for f, a in readers] == [False, False]
+    assert eng.healthFor('unix:///a.sock') is not eng.healthFor('tcp://b:2376')
+
+    # nothing is dispatched until it has had time to be overtaken
+    assert calls == []
+    clock.advance(0.1)
+    assert calls == [
+            ('unix:///a.sock', 'a1'),
+            ('tcp://b:2376', 'b1'),
+            ('tcp://b:2376', 'b2'),
+            ('unix:///a.sock', 'a2'),
+            ('tcp://b:2376', 'b3'),
+            ]
+
+    # an earlier event arriving inside the window overtakes a later one,
+    # and is not held up longer than the later one
+    eng._receive('tcp://b:2376', mkEvent(base + 20, 'b4'))
+    clock.advance(0.05)
+    eng._receive('unix:///a.sock', mkEvent(base + 10, 'a3'))
+    eng._receive('unix:///a.sock', mkEvent(base + 25, 'a4'))
+    clock.advance(0.05)
+    assert calls[5:] == [('unix:///a.sock', 'a3'), ('tcp://b:2376', 'b4')]
+    # a newer event waits its own full window
+    clock.advance(0.04)
+    assert calls[7:] == []
+    clock.advance(0.02)
+    assert calls[7:] == [('unix:///a.sock', 'a4')]
+
+    streams = [MagicMock(), MagicMock()]
+    eng._setStream('tcp://b:2376', streams[0])
+    eng._receive('tcp://b:2376', mkEvent(base + 30, 'b5'))
+    eng.stop()
+    streams[0].close.assert_called_once_with()
+    assert not clock.getDelayedCalls()
+
+
+def test_perHostLookups(mkEvent):
+    """
+    Are resources looked up, cached and evicted per host?
+    """
+    clients = {'a': MagicMock(), 'b': MagicMock()}
+    clients['a'].containers.get.return_value = 'container on a'
+    clients['b'].containers.get.return_value = 'container on b'
+    eng = multi.MultiDockerEngine(endpoints=['a', 'b'], clientFactory=clients.get,
+            resourceCache=ResourceCache())
+    eng.callLater = task.Clock().callLater
+    eng.callInThread = lambda f, *a: None
+    eng.run()
+
+    evA = event.Event.fromLowLevelEvent(eng, dict(mkEvent(1, 'c1'), host='a'))
+    evB = event.Event.fromLowLevelEvent(eng, dict(mkEvent(1, 'c1'), host='b'))
+    assert evA.container == 'container on a'
+    assert evB.container == 'container on b'
+    assert evA.container == 'container on a'
+    assert clients['a'].containers.get.call_count == 1
+    assert evA.daemon is clients['a']
+    assert evB.daemon is clients['b']
+
+    eng._dispatch(dict(mkEvent(2, 'c1', 'destroy'), host='a'))
+    assert eng.resourceCache.get(('a', 'container', 'c1')) is None
+    assert eng.resourceCache.get(('b', 'container', 'c1')) == 'container on b'
+
+
+def test_notSupported():
+    """
+    Do I refuse per-daemon features that can't span daemons?
+    """
+    with raises(AssertionError):
+        multi.MultiDockerEngine(checkpoint=object()).run()
+    with raises(AssertionError):
+        multi.MultiDockerEngine(reconcile=('container',)).run()
+
+
+def test_clientForURL():
+    with patch.object(multi.docker, 'DockerClient') as mClient:
+        multi.clientForURL('tcp://b:2376')
+        mClient.assert_called_once_with(base_url='tcp://b:2376')
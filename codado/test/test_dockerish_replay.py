@@ -0,0 +1,186 @@
+"""
+Tests of recording and replaying docker events
+"""
+import io
+import json
+import threading
+
+from pytest import fixture
+
+from mock import MagicMock
+
+from twisted.internet import task
+
+from codado.dockerish import event, replay
+
+
+@fixture
+def recording():
+    return [replay.dumpEvent(e) + '\n' for e in replay.synthesize(20, containers=4)]
+
+
+def test_recordingClient():
+    """
+    Do I write each event as it is read, before the engine consumes it?
+    """
+    llEvents = replay.synthesize(3)
+    client = MagicMock()
+    client.events.return_value = iter([dict(e) for e in llEvents])
+    fp = io.StringIO()
+    recorder = replay.EventRecorder(fp)
+    recording = replay.RecordingClient(client, recorder)
+
+    for llEvent in recording.events(decode=True, since=5):
+        llEvent.pop('Actor')
+    client.events.assert_called_once_with(decode=True, since=5)
+    assert recorder.count == 3
+    lines = fp.getvalue().splitlines()
+    assert lines == [replay.dumpEvent(e) for e in llEvents]
+    assert '", "' not in lines[0] and '": ' not in lines[0]
+    # everything else is passed through
+    assert recording.containers is client.containers
+
+    # the raw bytes, as docker-py gives them with decode=False
+    client.events.return_value = iter([dict(llEvents[0])])
+    [raw] = recording.events(decode=False)
+    assert raw == (replay.dumpEvent(llEvents[0]) + '\n').encode('utf-8')
+
+
+def test_streamClose():
+    """
+    Can a stream be closed from another thread while a reader is waiting on
+    it, hanging up on the docker client's stream?
+    """
+    class Source(object):
+        """
+        A docker-py event stream whose daemon has nothing more to send
+        """
+        def __init__(self):
+            self.hungUp = threading.Event()
+            self.reading = threading.Event()
+
+        def __iter__(self):
+            yield replay.synthesize(1)[0]
+            self.reading.set()
+            self.hungUp.wait(5)
+            raise IOError("connection closed")
+
+        def close(self):
+            self.hungUp.set()
+
+    source = Source()
+    client = MagicMock()
+    client.events.return_value = source
+    stream = replay.RecordingClient(client, replay.EventRecorder(io.StringIO())
+            ).events(decode=True)
+    got = []
+
+    def read():
+        try:
+            for llEvent in stream:
+                got.append(llEvent)
+        except IOError as e:
+            got.append(e)
+    reader = threading.Thread(target=read)
+    reader.start()
+    source.reading.wait(5)
+    stream.close()
+    reader.join(5)
+    assert not reader.is_alive()
+    assert source.hungUp.is_set()
+    assert len(got) == 2 and isinstance(got[1], IOError)
+    assert list(stream) == []
+
+    # replayed streams end when closed
+    stream = replay.ReplayClient([replay.dumpEvent(e)
+        for e in replay.synthesize(2)]).events(decode=True)
+    next(stream)
+    stream.close()
+    assert list(stream) == []
+
+
+def test_replayFast(recording, tmp_path):
+    """
+    As fast as possible, do I replay everything at once, with filters?
+    """
+    path = tmp_path / 'events.jsonl'
+    path.write_text(''.join(recording) + '\n')
+    client = replay.ReplayClient.fromFile(str(path))
+    assert len(client) == 20
+    got = list(client.events(decode=True,
+        filters={'type': ['container'], 'event': ['start', 'die']}))
+    assert [e['Action'] for e in got] == ['start', 'die'] * 2
+    assert got[0] == replay.synthesize(20, containers=4)[7]
+    assert list(client.events(decode=True)) == []
+
+    client = replay.ReplayClient(recording)
+    assert len(list(client.events(decode=True, filters={'type': ['image']}))) == 0
+
+    client = replay.ReplayClient(recording)
+    got = list(client.events(decode=True, filters={'event': ['health_status']}))
+    assert [e['Action'] for e in got] == ['health_status: healthy'] * 2
+
+
+def test_replayRaw(recording, tmp_path):
+    """
+    With decode=False, do I replay the bytes of each event, one per line?
+    """
+    path = tmp_path / 'events.jsonl'
+    path.write_text(''.join(recording))
+    for client in (replay.ReplayClient(recording),
+            replay.ReplayClient.fromFile(str(path))):
+        got = list(client.events(decode=False))
+        assert got == [line.encode('utf-8') for line in recording]
+        assert list(client.events(decode=False)) == []
+
+    client = replay.ReplayClient(recording)
+    got = list(client.events(filters={'event': ['start', 'die']}))
+    assert [json.loads(line)['Action'] for line in got] == ['start', 'die'] * 2
+    assert all(line.endswith(b'}\n') for line in got)
+
+
+def test_replaySpeed(recording):
+    """
+    At recorded speed, do I shift events to now, hand over only the ones
+    that are due when polled, and sleep between them when streamed?
+    """
+    clock = task.Clock()
+    clock.advance(2000000000)
+    slept = []
+    def sleep(seconds):
+        slept.append(seconds)
+        clock.advance(seconds)
+    # synthetic events are 1us apart; at 1/1000th speed that's 1ms
+    client = replay.ReplayClient(recording, speed=0.001,
+            clock=clock.seconds, sleep=sleep)
+
+    got = list(client.events(decode=True, until=clock.seconds() + 0.0025))
+    assert len(got) == 3
+    assert got[0]['timeNano'] == 2000000000 * replay.NANO
+    assert got[2]['time'] == 2000000000
+    assert slept == []
+
+    got = list(client.events(decode=True))
+    assert len(got) == 17
+    assert len(slept) == 17
+    assert got[-1]['timeNano'] == 2000000000 * replay.NANO + 19000000
+
+
+def test_replayEngine(recording):
+    """
+    Can a DockerEngine run against a replay client?
+    """
+    calls = []
+    eng = event.DockerEngine(clientFactory=lambda: replay.ReplayClient(recording))
+    eng.callLater = task.Clock().callLater
+    class EventConsumerApp(object):
+        engine = eng
+
+        @engine.handler("container.die")
+        def onDie(self, event):
+            calls.append(event.actor.name)
+
+    app = EventConsumerApp()
+    app.engine.run()
+    eng._genEvents(0)
+    assert calls == ['noms_0', 'noms_2']
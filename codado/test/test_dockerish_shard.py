@@ -0,0 +1,254 @@
+"""
+Tests of running dockerish handlers in worker processes
+"""
+from builtins import object
+
+from pytest import fixture
+
+import pytest_twisted
+
+from mock import patch
+
+from twisted.internet import defer, error, task
+from twisted.python import failure
+from twisted.protocols import amp
+from twisted.test import iosim
+
+from codado.dockerish import event, shard
+from codado.dockerish.event import DockerEngine
+from codado.dockerish.history import EventHistory
+
+
+# when the events in these tests happen
+T0 = 1500000000000000000
+
+
+class ShardOwner(object):
+    """
+    An owner whose handlers run in the workers
+    """
+    engine = DockerEngine(clientFactory=lambda: None)
+
+    def __init__(self):
+        self.seen = []
+        self.later = []
+
+    @engine.handler("dockerish.init")
+    def onInit(self, event):
+        self.seen.append('init')
+
+    @engine.handler("container.start")
+    def onStart(self, event):
+        if event.actorId == 'bad':
+            raise ValueError("bad container")
+        self.seen.append(event.actorId)
+
+    @engine.handler("container.die")
+    def onDie(self, event):
+        d = defer.Deferred()
+        self.later.append((event.actorId, d))
+        return d
+
+
+def test_shardFor():
+    """
+    Do I spread actors over workers, always the same way?
+    """
+    assert shard.shardFor('abc', 4) == shard.shardFor(u'abc', 4) == 2
+    assert shard.shardFor(None, 4) == 0
+    assert sorted(set(shard.shardFor('c%d' % n, 4) for n in range(100))) == [
+            0, 1, 2, 3]
+
+
+@fixture
+def loopback():
+    """
+    A ShardedDockerEngine whose workers are ShardWorkers in this process,
+    connected over in-memory transports
+    """
+    workers = []
+    pumps = []
+    def spawn(ownerName, index):
+        worker = shard.ShardWorker(shard.ownerClass(ownerName)())
+        worker.start()
+        workers.append(worker)
+        client, server, pump = iosim.connectedServerAndClient(
+                lambda: worker, amp.AMP)
+        pumps.append(pump)
+        return defer.succeed(client)
+
+    eng = shard.ShardedDockerEngine(
+            ownerName='codado.test.test_dockerish_shard:ShardOwner',
+            workers=2, spawn=spawn)
+    eng.callLater = task.Clock().callLater
+    with patch.object(event.docker, 'from_env'):
+        eng.run()
+
+    def flush():
+        for n in range(10):
+            for pump in pumps:
+                pump.flush()
+    return eng, workers, flush
+
+
+def test_dispatchToWorkers(loopback, mkEvent):
+    """
+    Do all the events for one actor go to one worker, in order, and do I
+    collect handler timings and errors from every worker?
+    """
+    eng, workers, flush = loopback
+    assert [w.owner.seen for w in workers] == [['init'], ['init']]
+    assert eng._filters == {'type': ['container'], 'event': ['die', 'start']}
+
+    eng.history = EventHistory()
+    actors = ['c%d' % (n % 5) for n in range(50)]
+    eng._dispatchBatch([mkEvent(T0 + n, a) for (n, a) in enumerate(actors)])
+    # not wanted by any handler; never sent
+    eng._dispatch(mkEvent(T0 + 50, 'c0', 'stop'))
+    eng._dispatch(mkEvent(T0 + 51, 'bad'))
+    flush()
+
+    for n, worker in enumerate(workers):
+        mine = [a for a in actors if shard.shardFor(a, 2) == n]
+        assert worker.owner.seen == ['init'] + mine
+    assert eng.handlerStats['onStart'].calls == 51
+    assert eng.handlerStats['onStart'].errors == 1
+    assert eng.handlerStats['onStart'].seconds > 0
+    # the engine still remembers what it sent
+    assert len(eng.history) == 51
+
+    # a worker answers once its asynchronous handlers have finished
+    with patch.object(shard.log, 'msg') as mMsg:
+        eng._dispatch(mkEvent(T0 + 52, 'c1', 'die'))
+        flush()
+        [worker] = [w for w in workers if w.owner.later]
+        assert 'onDie' not in eng.handlerStats
+        worker.owner.later[0][1].errback(RuntimeError("gone"))
+        flush()
+    assert eng.handlerStats['onDie'].errors == 1
+    assert 'RuntimeError' in mMsg.call_args[0][0]
+    assert "'onDie' failed" in mMsg.call_args[0][0]
+
+    eng.stop()
+    assert all(s.protocol is None for s in eng._shards)
+    eng.stop()
+
+
+def test_workerBackpressure(loopback, mkEvent):
+    """
+    Do I batch events while a worker is busy, and stop reading when too many
+    are waiting for one worker?
+    """
+    eng, workers, flush = loopback
+    for s in eng._shards:
+        s.queueSize = 10
+    target = [s for s in eng._shards if s.index == shard.shardFor('c0', 2)][0]
+    eng._dispatchBatch([mkEvent(T0 + n, 'c0') for n in range(15)])
+    # two single-event batches in flight, and the rest waiting
+    assert target.inFlight == 2
+    assert len(target.pending) == 10
+    assert eng.saturated
+    assert len(eng._backlog) == 3
+    assert not eng._flowing.is_set()
+
+    with patch.object(shard, 'SHARD_BATCH_BYTES', 1000):
+        flush()
+    assert not eng.saturated
+    assert eng._flowing.is_set()
+    assert eng.handlerStats['onStart'].calls == 15
+    worker = workers[target.index]
+    assert worker.owner.seen == ['init'] + ['c0'] * 15
+
+
+def test_workerNoDocker():
+    """
+    Does a worker carry on, without lookups, when it can't reach docker?
+    """
+    worker = shard.ShardWorker(ShardOwner())
+    worker.engine.clientFactory = lambda: 1 / 0
+    with patch.object(shard.log, 'err') as mErr:
+        worker.start()
+    mErr.assert_called_once_with(None, "Worker could not connect to docker")
+    assert worker.engine.client is None
+    assert ShardOwner.engine.clientFactory() is None
+
+
+class QueuedOwner(object):
+    """
+    An owner with a handler behind a queue
+    """
+    engine = DockerEngine(clientFactory=lambda: None)
+
+    def __init__(self):
+        self.waiting = []
+
+    @engine.handler("container.start", concurrency=1, queueSize=2)
+    def onStart(self, event):
+        d = defer.Deferred()
+        self.waiting.append((event.actorId, d))
+        return d
+
+
+def test_workerQueuedHandler(mkEvent):
+    """
+    Does a worker run handlers with a concurrency or queueSize, resuming
+    when their queues drain?
+    """
+    worker = shard.ShardWorker(QueuedOwner())
+    worker.start()
+    client, server, pump = iosim.connectedServerAndClient(lambda: worker, amp.AMP)
+    lines = b'\n'.join(shard.encodeEvent(mkEvent(T0 + n, 'c%d' % n))
+            for n in range(3))
+    replies = []
+    client.callRemote(shard.Dispatch, events=lines).addCallback(replies.append)
+    pump.flush()
+    assert [a for (a, d) in worker.owner.waiting] == ['c0']
+    for n in range(3):
+        d = worker.owner.waiting[n][1]
+        d.callback(None)
+        # the queue resumed the engine without failing
+        assert d.result is None
+        pump.flush()
+    assert [a for (a, d) in worker.owner.waiting] == ['c0', 'c1', 'c2']
+    [reply] = replies
+    assert reply['timings']['onStart'][0] == 1
+
+
+def test_workerMain():
+    """
+    Does a worker speak AMP on stdio, and stop the reactor when the engine
+    hangs up?
+    """
+    with patch.object(shard, 'stdio') as mStdio, \
+            patch.object(shard, 'reactor') as mReactor, \
+            patch.object(shard.log, 'startLogging'):
+        shard.workerMain('codado.test.test_dockerish_shard:ShardOwner')
+        [(worker,), _] = mStdio.StandardIO.call_args
+        assert worker.owner.seen == ['init']
+        mReactor.run.assert_called_once_with()
+        worker.makeConnection(iosim.FakeTransport(worker, False))
+        worker.connectionLost(failure.Failure(error.ConnectionDone()))
+        mReactor.stop.assert_called_once_with()
+
+
+@pytest_twisted.inlineCallbacks
+def test_workerProcesses(mkEvent):
+    """
+    Do I run handlers in real worker processes?
+    """
+    eng = shard.ShardedDockerEngine(
+            ownerName='codado.test.test_dockerish_shard:ShardOwner', workers=2)
+    eng.callLater = task.Clock().callLater
+    eng.callInThread = lambda f, *a: None
+    with patch.object(event.docker, 'from_env'):
+        eng.run()
+    try:
+        for n in range(20):
+            eng._dispatch(mkEvent(T0 + n, 'c%d' % (n % 4)))
+        for n in range(200):
+            if eng.handlerStats.get('onStart', shard.HandlerStats('')).calls == 20:
+                break
+            yield task.deferLater(event.reactor, 0.05, lambda: None)
+        assert eng.handlerStats['onStart'].calls == 20
+    finally:
+        eng.stop()
@@ -0,0 +1,112 @@
+"""
+Tests of compiling JSON schemas into validators
+"""
+from pytest import raises
+
+from codado.schema import compileSchema, ValidationError
+
+
+def check(validate, value, message):
+    """
+    Assert that `value` is rejected with `message`
+    """
+    with raises(ValidationError) as ei:
+        validate(value)
+    assert str(ei.value) == message
+
+
+def test_types():
+    """
+    Do I check JSON types exactly, so that true is not an integer?
+    """
+    assert compileSchema({})({'anything': [1]}) is None
+    integer = compileSchema({'type': 'integer'})
+    integer(3)
+    check(integer, 3.5, "$: expected integer, got float")
+    check(integer, True, "$: expected integer, got bool")
+    number = compileSchema({'type': 'number'})
+    number(3)
+    number(3.5)
+    check(number, '3', "$: expected number, got str")
+    either = compileSchema({'type': ['string', 'null']})
+    either('x')
+    either(None)
+    check(either, [], "$: expected string or null, got list")
+    for t, good, bad in [('object', {}, []), ('array', [], {}),
+            ('boolean', False, 0), ('null', None, False), ('string', '', b'')]:
+        validate = compileSchema({'type': t})
+        validate(good)
+        with raises(ValidationError):
+            validate(bad)
+
+
+def test_objects():
+    """
+    Do I check required, known and extra properties, with their paths?
+    """
+    validate = compileSchema({
+        'type': 'object',
+        'required': ['id'],
+        'properties': {
+            'id': {'type': 'string', 'minLength': 1, 'maxLength': 4},
+            'count': {'type': 'integer', 'minimum': 0, 'maximum': 10},
+            'state': {'enum': ['up', 'down']},
+            },
+        'additionalProperties': False,
+        })
+    validate({'id': 'a'})
+    validate({'id': 'abcd', 'count': 10, 'state': 'up'})
+    check(validate, {}, "$: missing 'id'")
+    check(validate, {'id': 1}, "$.id: expected string, got int")
+    check(validate, {'id': ''}, "$.id: shorter than 1")
+    check(validate, {'id': 'abcde'}, "$.id: longer than 4")
+    check(validate, {'id': 'a', 'count': -1}, "$.count: -1 is less than 0")
+    check(validate, {'id': 'a', 'count': 11}, "$.count: 11 is more than 10")
+    check(validate, {'id': 'a', 'state': 'x'},
+            "$.state: 'x' is not one of ['up', 'down']")
+    check(validate, {'id': 'a', 'other': 1}, "$: unexpected key 'other'")
+
+    labels = compileSchema({'additionalProperties': {'type': 'string'}})
+    labels({'a': 'b'})
+    labels('not an object')
+    check(labels, {'a': 1}, "$.a: expected string, got int")
+
+
+def test_arrays():
+    """
+    Do I check array lengths and every item, with their indexes?
+    """
+    validate = compileSchema({'type': 'array', 'minItems': 1, 'maxItems': 3,
+        'items': {'type': 'object', 'required': ['n'],
+            'properties': {'n': {'type': 'number', 'minimum': 0.5}}}})
+    validate([{'n': 1}, {'n': 0.5}])
+    check(validate, [], "$: fewer than 1 items")
+    check(validate, [{'n': 1}] * 4, "$: more than 3 items")
+    check(validate, [{'n': 1}, {'n': 0}], "$[1].n: 0 is less than 0.5")
+    check(validate, [{'n': 1}, {}], "$[1]: missing 'n'")
+
+
+def test_untyped():
+    """
+    Without a type, do rules only apply to values of the type they are for?
+    """
+    validate = compileSchema({'minLength': 2, 'minItems': 2, 'minimum': 2,
+        'required': ['a']})
+    for value in [None, True, 'ab', [1, 2], 2, 2.5, {'a': 1}]:
+        validate(value)
+    for value in ['a', [1], 1, 1.5, {}]:
+        with raises(ValidationError):
+            validate(value)
+
+
+def test_badSchema():
+    """
+    Am I told when a schema has rules I don't understand?
+    """
+    with raises(ValueError) as ei:
+        compileSchema({'type': 'object', 'patternProperties': {}, 'oneOf': []})
+    assert str(ei.value) == "Unsupported schema rules: oneOf, patternProperties"
+    with raises(ValueError) as ei:
+        compileSchema({'items': {'type': 'tuple'}})
+    assert str(ei.value) == "Unknown schema type 'tuple'"
+    assert 'def validate(v0):' in compileSchema({'type': 'null'}).source
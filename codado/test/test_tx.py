@@ -3,8 +3,10 @@ Tests for twisted-related utilites in Codado
 """
 from __future__ import print_function
 
+import array
 import shlex
 import re
+import struct
 import sys
 
 from future import standard_library
@@ -12,6 +14,12 @@ standard_library.install_aliases()
 
 from mock import patch
 
+from pytest import raises
+
+from twisted.internet import defer, task
+from twisted.protocols import amp
+from twisted.test import iosim
+
 from codado import tx
 
 
@@ -20,12 +28,14 @@ def test_JSONtoString():
     Do I encode json correctly?
     """
     js = tx.JSON()
-    assert js.toString(None) == 'null'
-    assert js.toString([]) == '[]'
-    assert js.toString({}) == '{}'
-    assert js.toString(['a', 'b']) == '["a", "b"]'
-    assert js.toString(['a', 'b']) == '["a", "b"]'
-    assert js.toString({'abc': 1, '234': 234.5}) == '{"234": 234.5, "abc": 1}'
+    assert js.toString(None) == b'null'
+    assert js.toString([]) == b'[]'
+    assert js.toString({}) == b'{}'
+    assert js.toString(['a', 'b']) == b'["a", "b"]'
+    assert js.toString(['a', 'b']) == b'["a", "b"]'
+    assert js.toString({'abc': 1, '234': 234.5}) == b'{"234": 234.5, "abc": 1}'
+    # AMP only carries bytes
+    assert js.toString([u'\u2603']) == b'["\\u2603"]'
 
 
 def test_JSONfromString():
@@ -41,6 +51,335 @@ def test_JSONfromString():
     assert js.fromString('{"234": 234.5, "345": "345", "abc": 1}') == {'abc': 1, '234': 234.5, '345': '345'}
 
 
+def test_JSONserializers():
+    """
+    Can I turn off key sorting, and use a faster serializer whose documents
+    any peer reads the same?
+    """
+    doc = {'b': [1, 2.5, None], 'a': u'\u2603'}
+    unsorted = tx.JSON(sortKeys=False)
+    assert unsorted.toString(doc) == b'{"b": [1, 2.5, null], "a": "\\u2603"}'
+
+    fast = tx.JSON(serializer=tx.OrjsonSerializer())
+    encoded = fast.toString(doc)
+    assert encoded == u'{"a":"\u2603","b":[1,2.5,null]}'.encode('utf-8')
+    assert tx.JSON(sortKeys=False, serializer=fast.serializer).toString(doc
+            ) == u'{"b":[1,2.5,null],"a":"\u2603"}'.encode('utf-8')
+    # each reads what the other sends
+    assert tx.JSON().fromString(encoded) == doc
+    assert fast.fromString(tx.JSON().toString(doc)) == doc
+    assert fast.fromString(memoryview(encoded)) == doc
+    assert tx.JSON().fromString(memoryview(encoded)) == doc
+
+
+class Store(amp.Command):
+    arguments = [(b'doc', tx.JSON()), (b'extra', tx.JSON(optional=True))]
+    response = [(b'doc', tx.JSON())]
+
+
+def test_JSONchunked():
+    """
+    Is a document too big for one AMP value split across keys, and joined
+    again on the other side?
+    """
+    doc = {'items': ['x' * 1000] * 200, 'n': 1}
+    encoded = tx.JSON().toString(doc)
+    assert len(encoded) > 3 * tx.CHUNK_SIZE
+
+    box = Store.makeArguments({'doc': doc, 'extra': None}, None)
+    assert sorted(box) == [b'doc', b'doc.2', b'doc.3', b'doc.4']
+    assert b''.join(box[k] for k in [b'doc', b'doc.2', b'doc.3', b'doc.4']
+            ) == encoded
+    [received] = amp.parseString(box.serialize())
+    assert Store.parseArguments(received, None) == {'doc': doc, 'extra': None}
+
+    # small documents are unchanged on the wire
+    box = Store.makeArguments({'doc': [1], 'extra': 'x'}, None)
+    assert box == {b'doc': b'[1]', b'extra': b'"x"'}
+    assert Store.parseArguments(box, None) == {'doc': [1], 'extra': 'x'}
+
+
+def test_JSONchunkedCall():
+    """
+    Can a big document be sent and answered over a real AMP connection?
+    """
+    class Server(amp.AMP):
+        @Store.responder
+        def store(self, doc, extra):
+            return {'doc': doc[::-1]}
+
+    client, server, pump = iosim.connectedServerAndClient(Server, amp.AMP)
+    doc = list(range(100000))
+    responses = []
+    client.callRemote(Store, doc=doc).addCallback(responses.append)
+    pump.flush()
+    assert responses == [{'doc': doc[::-1]}]
+
+
+class Put(amp.Command):
+    arguments = [(b'doc', tx.JSON(schema={'type': 'object', 'required': ['id'],
+        'properties': {'id': {'type': 'string'}}}))]
+    errors = {tx.InvalidArgument: tx.INVALID_ARGUMENT}
+
+
+def test_JSONschema():
+    """
+    Are documents that don't match the schema rejected with an AMP error,
+    before they reach the responder, and without dropping the connection?
+    """
+    js = Put.arguments[0][1]
+    assert js.fromString(b'{"id": "a"}') == {'id': 'a'}
+    with raises(tx.InvalidArgument) as ei:
+        js.fromString(b'{"id": 1}')
+    assert ei.value.errorCode == tx.INVALID_ARGUMENT
+    assert ei.value.description == "$.id: expected string, got int"
+
+    seen = []
+
+    class Server(amp.AMP):
+        @Put.responder
+        def put(self, doc):
+            seen.append(doc)
+            return {}
+
+    client, server, pump = iosim.connectedServerAndClient(Server, amp.AMP)
+    results = []
+    client.callRemote(Put, doc={}).addErrback(results.append)
+    client.callRemote(Put, doc={'id': 'a'}).addCallback(results.append)
+    pump.flush()
+    failure, answer = results
+    failure.trap(tx.InvalidArgument)
+    assert failure.value.description == "$: missing 'id'"
+    assert answer == {}
+    assert seen == [{'id': 'a'}]
+
+
+def test_msgPack():
+    """
+    Do I carry values, bytes included, as MessagePack, chunked when big?
+    """
+    mp = tx.MsgPack()
+    doc = {'a': [1, 2.5, None, True], 'b': b'\x00\xff', 'c': u'\u2603'}
+    assert mp.fromString(mp.toString(doc)) == doc
+    assert len(mp.toString(doc)) < len(tx.JSON().toString(dict(doc, b='..')))
+
+    class Send(amp.Command):
+        arguments = [(b'doc', tx.MsgPack())]
+    big = {'blob': b'x' * (3 * tx.CHUNK_SIZE)}
+    box = Send.makeArguments({'doc': big}, None)
+    assert len(box) == 4
+    [received] = amp.parseString(box.serialize())
+    assert Send.parseArguments(received, None) == {'doc': big}
+
+
+def test_numericArray():
+    """
+    Do I send buffers of numbers without copying them, and receive them as
+    arrays, or views of what was received?
+    """
+    doubles = array.array('d', [0.5, 1.5, -2.0])
+    na = tx.NumericArray('d')
+    encoded = na.toString(doubles)
+    assert isinstance(encoded, memoryview)
+    assert encoded.obj is doubles
+    assert bytes(encoded) == struct.pack('<3d', 0.5, 1.5, -2.0)
+    assert na.fromString(bytes(encoded)) == doubles
+    with raises(TypeError):
+        na.toString(array.array('i', [1]))
+
+    viewed = tx.NumericArray('d', view=True).fromString(bytes(encoded))
+    assert isinstance(viewed, memoryview)
+    assert viewed.tolist() == [0.5, 1.5, -2.0]
+
+    class Send(amp.Command):
+        arguments = [(b'values', tx.NumericArray('q')),
+                (b'missing', tx.NumericArray('q', optional=True))]
+        response = [(b'total', amp.Integer())]
+
+    class Server(amp.AMP):
+        @Send.responder
+        def send(self, values, missing):
+            assert missing is None
+            return {'total': sum(values)}
+
+    client, server, pump = iosim.connectedServerAndClient(Server, amp.AMP)
+    values = array.array('q', range(100000))
+    responses = []
+    client.callRemote(Send, values=values).addCallback(responses.append)
+    pump.flush()
+    assert responses == [{'total': sum(range(100000))}]
+
+
+def test_parseBoxes():
+    """
+    Do I read boxes one after another like amp.parseString?
+    """
+    boxes = [amp.AmpBox(), amp.AmpBox({b'a': b'1', b'long': b'x' * 300}),
+            amp.AmpBox({b'b': b''})]
+    data = b''.join(box.serialize() for box in boxes)
+    assert tx.parseBoxes(data) == amp.parseString(data) == boxes
+    assert tx.parseBoxes(b'') == []
+    with raises(ValueError):
+        tx.parseBoxes(data[:-2])
+
+
+class Lookup(amp.Command):
+    arguments = [(b'key', amp.Unicode())]
+    response = [(b'value', amp.Integer())]
+    errors = {KeyError: b'NO_KEY'}
+
+
+class Table(amp.AMP):
+    values = {'a': 1, 'b': 2}
+
+    @tx.batchResponder(Lookup)
+    def lookup(self, key):
+        if key == 'boom':
+            raise RuntimeError(key)
+        if key == 'later':
+            return defer.succeed({'value': 3})
+        return {'value': self.values[key]}
+
+
+def test_batchingClient():
+    """
+    Are calls sent in batches, when the window passes or the batch is full,
+    and is each answered, or failed, on its own Deferred?
+    """
+    client, server, pump = iosim.connectedServerAndClient(Table, amp.AMP)
+    sent = []
+    server.boxReceiver.ampBoxReceived = lambda box, receive=server.ampBoxReceived: (
+            sent.append(box[b'_command']), receive(box))
+    clock = task.Clock()
+    batching = tx.BatchingClient(client, Lookup, window=0.01, maxCalls=3)
+    batching.callLater = clock.callLater
+
+    results = []
+    for key in ['a', 'b']:
+        batching.callRemote(key=key).addCallback(results.append)
+    pump.flush()
+    assert results == [] and sent == []
+    clock.advance(0.01)
+    pump.flush()
+    assert results == [{'value': 1}, {'value': 2}]
+    assert sent == [b'Lookup.batch']
+
+    # a full batch goes at once, and cancels its timer
+    del results[:]
+    for key in ['a', 'later', 'nope']:
+        batching.callRemote(key=key).addCallbacks(results.append, results.append)
+    assert clock.getDelayedCalls() == []
+    pump.flush()
+    assert results[:2] == [{'value': 1}, {'value': 3}]
+    results[2].trap(KeyError)
+    assert sent == [b'Lookup.batch'] * 2
+
+    # an unhandled error fails only its own call
+    del results[:]
+    batching.callRemote(key='boom').addErrback(results.append)
+    batching.callRemote(key='b').addCallback(results.append)
+    batching.flush()
+    batching.flush()
+    with patch.object(tx.log, 'err') as mErr:
+        pump.flush()
+    results[0].trap(amp.UnknownRemoteError)
+    assert results[1:] == [{'value': 2}]
+    [((reason, message), _)] = mErr.call_args_list
+    reason.trap(RuntimeError)
+    assert message == "Unhandled error in a batched Lookup"
+    assert sent == [b'Lookup.batch'] * 3
+
+    # single calls still work
+    client.callRemote(Lookup, key='a').addCallback(results.append)
+    pump.flush()
+    assert results[-1] == {'value': 1}
+
+
+def test_batchingClientLost():
+    """
+    Does every call in a batch fail when the batch does, even when sending it
+    raises?
+    """
+    client, server, pump = iosim.connectedServerAndClient(amp.AMP, amp.AMP)
+    batching = tx.BatchingClient(client, Lookup)
+    failures = []
+    for key in ['a', 'b']:
+        batching.callRemote(key=key).addErrback(failures.append)
+    batching.flush()
+    pump.flush()
+    assert len(failures) == 2
+    for f in failures:
+        f.trap(amp.UnhandledCommand)
+
+    del failures[:]
+    client.callRemote = lambda *a, **kw: 1 / 0
+    for key in ['a', 'b']:
+        batching.callRemote(key=key).addErrback(failures.append)
+    batching.flush()
+    assert len(failures) == 2
+    for f in failures:
+        f.trap(ZeroDivisionError)
+
+
+class Echo(amp.Command):
+    arguments = [(b'data', amp.String())]
+    response = [(b'data', amp.String()), (b'size', amp.Integer())]
+
+
+def test_batchingClientTypes():
+    """
+    Is each call in a batch sent with the command's own argument types,
+    checked against their schema, and answered with its response types?
+    """
+    class Server(amp.AMP):
+        @tx.batchResponder(Put)
+        def put(self, doc):
+            seen.append(doc)
+            return {}
+
+        @tx.batchResponder(Echo)
+        def echo(self, data):
+            if data == b'bad':
+                return {'data': None, 'size': 'x'}
+            return {'data': data[::-1], 'size': len(data)}
+
+    seen = []
+    client, server, pump = iosim.connectedServerAndClient(Server, amp.AMP)
+    puts = tx.BatchingClient(client, Put)
+    echoes = tx.BatchingClient(client, Echo)
+    results = []
+    puts.callRemote(doc={'nope': 1}).addErrback(results.append)
+    puts.callRemote(doc={'id': 'a'}).addCallback(results.append)
+    echoes.callRemote(data=b'\x00\xffab').addCallback(results.append)
+    # a value the argument can't encode fails at once, on its own
+    echoes.callRemote(data=u'\u2603').addErrback(results.append)
+    with patch.object(tx.log, 'err') as mErr:
+        echoes.callRemote(data=b'bad').addErrback(results.append)
+        puts.flush()
+        echoes.flush()
+        pump.flush()
+    notBytes, invalid, answer, echoed, bad = results
+    invalid.trap(tx.InvalidArgument)
+    assert invalid.value.description == "$: missing 'id'"
+    notBytes.trap(TypeError)
+    assert answer == {}
+    assert echoed == {'data': b'ba\xff\x00', 'size': 4}
+    bad.trap(amp.UnknownRemoteError)
+    assert mErr.call_count == 1
+    assert seen == [{'id': 'a'}]
+
+    # a response that can't be parsed fails only its own call
+    del results[:]
+    with patch.object(Echo, 'parseResponse', side_effect=[ValueError(), {}]):
+        for data in [b'x', b'y']:
+            echoes.callRemote(data=data).addBoth(results.append)
+        echoes.flush()
+        pump.flush()
+    failed, answered = results
+    failed.trap(ValueError)
+    assert answered == {}
+
+
 def options(name='Options'):
     """
     Return a new instance of an Options for testing
@@ -2,14 +2,31 @@
 Useful Twisted-enhancing utilities
 """
 from __future__ import print_function
+import array
+import struct
 import sys
 import json
 
 from builtins import str
 
-from twisted.python import usage
+import attr
+
+from twisted.internet import defer, reactor
+from twisted.python import failure, log, usage
 from twisted.protocols import amp
 
+from codado.schema import compileSchema, ValidationError
+
+try:
+    import orjson
+except ImportError:  # pragma: nocover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: nocover
+    msgpack = None
+
 
 class CLIError(Exception):
     """
@@ -69,13 +86,400 @@ class Main(usage.Options):
         return base + addl
 
 
-class JSON(amp.String):
+# the most bytes AMP can carry in one value
+CHUNK_SIZE = amp.MAX_VALUE_LENGTH
+
+
+class StdlibSerializer(object):
+    """
+    Encode JSON with the json module, exactly as codado.tx.JSON always has
+    """
+    name = 'json'
+
+    def __init__(self):
+        # json.dumps builds a new encoder for every call with sort_keys
+        self._sorted = json.JSONEncoder(sort_keys=True).encode
+        self._unsorted = json.JSONEncoder().encode
+        self._decode = json.JSONDecoder().decode
+
+    def dumps(self, val, sortKeys=True):
+        """
+        The UTF-8 bytes of `val` as a JSON document
+        """
+        return (self._sorted if sortKeys else self._unsorted)(val).encode('utf-8')
+
+    def loads(self, data):
+        """
+        The value of the JSON document in the UTF-8 bytes `data`
+        """
+        # AMP peers always send UTF-8, so there is no need for json.loads to
+        # guess the encoding
+        if not isinstance(data, str):
+            data = str(data, 'utf-8')
+        return self._decode(data)
+
+
+class OrjsonSerializer(object):
+    """
+    Encode JSON with orjson, which is several times faster.
+
+    Its output is compact and has non-ASCII characters as UTF-8 rather than
+    escapes, which any JSON peer reads the same. Unlike the json module, it
+    can't encode dicts with keys that aren't strings, or integers wider than
+    64 bits, and encodes NaN as null.
+    """
+    name = 'orjson'
+
+    def dumps(self, val, sortKeys=True):
+        return orjson.dumps(val, option=orjson.OPT_SORT_KEYS if sortKeys else 0)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+STDLIB_SERIALIZER = StdlibSerializer()
+
+# orjson if it is installed (pip install codado[fast])
+FAST_SERIALIZER = OrjsonSerializer() if orjson is not None else STDLIB_SERIALIZER
+
+
+def chunkKey(name, n):
+    """
+    The AMP key of chunk `n` (from 2) of the value `name`
+    """
+    return b'%s.%d' % (name, n)
+
+
+class ChunkedString(amp.String):
+    """
+    Bytes of any length (AMP type)
+
+    A value bigger than one AMP value is sent in chunks of CHUNK_SIZE bytes,
+    under the keys `name`, `name.2`, `name.3` and so on, and joined again
+    when it is received. Smaller values are sent as they are.
+    """
+    def toBox(self, name, strings, objects, proto):
+        amp.String.toBox(self, name, strings, objects, proto)
+        data = strings.get(name)
+        if data is None or len(data) <= CHUNK_SIZE:
+            return
+        # slices of a memoryview are not copies; the box is copied once, when
+        # it is serialized
+        view = memoryview(data)
+        strings[name] = view[:CHUNK_SIZE]
+        for n, start in enumerate(range(CHUNK_SIZE, len(data), CHUNK_SIZE), 2):
+            strings[chunkKey(name, n)] = view[start:start + CHUNK_SIZE]
+
+    def fromBox(self, name, strings, objects, proto):
+        if chunkKey(name, 2) in strings:
+            chunks = [strings[name]]
+            n = 2
+            key = chunkKey(name, n)
+            while key in strings:
+                chunks.append(strings.pop(key))
+                n += 1
+                key = chunkKey(name, n)
+            strings[name] = b''.join(chunks)
+        amp.String.fromBox(self, name, strings, objects, proto)
+
+
+INVALID_ARGUMENT = b'INVALID_ARGUMENT'
+
+
+class InvalidArgument(amp.RemoteAmpError):
+    """
+    An argument did not match its schema.
+
+    The peer answers the call with this error and keeps the connection; list
+    `errors = {InvalidArgument: INVALID_ARGUMENT}` on the Command for the
+    caller's Deferred to fail with it, instead of UnknownRemoteError.
+    """
+    def __init__(self, description):
+        amp.RemoteAmpError.__init__(self, INVALID_ARGUMENT, description)
+
+
+class JSON(ChunkedString):
     """
     Automatic marshalling through JSON (AMP type)
+
+    Documents of any size can be sent; see ChunkedString.
+
+    `serializer` encodes and decodes the documents: STDLIB_SERIALIZER (the
+    default) or FAST_SERIALIZER. Every peer can read what either one sends.
+    With `sortKeys=False`, dict keys are sent in their own order instead of
+    being sorted, which is cheaper when nothing compares the encoded bytes.
+
+    With a `schema` (see codado.schema), documents that arrive are checked
+    against it, and the call fails with InvalidArgument before it reaches
+    the responder. The schema is compiled once, here, when the Command is
+    defined.
+    """
+    def __init__(self, optional=False, sortKeys=True, serializer=None, schema=None):
+        ChunkedString.__init__(self, optional)
+        self.sortKeys = sortKeys
+        self.serializer = serializer or STDLIB_SERIALIZER
+        self.validate = compileSchema(schema) if schema is not None else None
+
+    def toString(self, val):
+        return self.serializer.dumps(val, self.sortKeys)
+
+    def fromString(self, val):
+        ret = self.serializer.loads(val)
+        if self.validate is not None:
+            try:
+                self.validate(ret)
+            except ValidationError as e:
+                raise InvalidArgument(str(e))
+        return ret
+
+
+class MsgPack(ChunkedString):
+    """
+    Automatic marshalling through MessagePack (AMP type), which is smaller
+    and faster than JSON, and carries bytes as they are.
+
+    Needs msgpack (pip install codado[fast]).
+    """
+    def __init__(self, optional=False):
+        if msgpack is None:  # pragma: nocover
+            raise ImportError("MsgPack AMP arguments need msgpack installed")
+        ChunkedString.__init__(self, optional)
+
+    def toString(self, val):
+        return msgpack.packb(val, use_bin_type=True)
+
+    def fromString(self, val):
+        return msgpack.unpackb(val, raw=False)
+
+
+class NumericArray(ChunkedString):
+    """
+    An array of numbers of the array module's `typecode`, e.g. 'd' for
+    doubles (AMP type).
+
+    Sends anything with the buffer protocol whose items are that size (an
+    array.array, or a numpy array, say) without copying it, little-endian.
+    It arrives as an array.array, or with `view=True`, as a read-only
+    memoryview of the bytes received, which copies nothing.
     """
+    def __init__(self, typecode, optional=False, view=False):
+        ChunkedString.__init__(self, optional)
+        self.typecode = typecode
+        self.itemsize = array.array(typecode).itemsize
+        self.view = view
+
     def toString(self, val):
-        return amp.String.toString(self, json.dumps(val, sort_keys=True))
+        data = memoryview(val)
+        if data.itemsize != self.itemsize:
+            raise TypeError("Expected items of %d bytes for %r, got %r" % (
+                self.itemsize, self.typecode, data.format))
+        if sys.byteorder == 'big':  # pragma: nocover
+            swapped = array.array(self.typecode, data.tobytes())
+            swapped.byteswap()
+            data = memoryview(swapped)
+        return data.cast('B')
 
     def fromString(self, val):
-        return json.loads(amp.String.fromString(self, val))
+        if self.view and sys.byteorder == 'little':
+            return memoryview(val).cast(self.typecode)
+        ret = array.array(self.typecode)
+        ret.frombytes(val)
+        if sys.byteorder == 'big':  # pragma: nocover
+            ret.byteswap()
+        return ret
+
+
+
+# how long a BatchingClient waits for more calls before sending a batch
+BATCH_WINDOW_SECONDS = 0.002
+
+# the most calls a BatchingClient puts in one batch
+BATCH_MAX_CALLS = 500
+
+_batchCommands = {}
+
+_LENGTH = struct.Struct('!H')
+
+
+def parseBoxes(data):
+    """
+    The AMP boxes serialized one after another in the bytes `data`, as
+    amp.parseString gives them, without running a protocol parser over
+    every key and value
+    """
+    unpack = _LENGTH.unpack_from
+    boxes = []
+    box = amp.AmpBox()
+    pos = 0
+    end = len(data)
+    while pos < end:
+        (n,) = unpack(data, pos)
+        pos += 2
+        if n == 0:
+            boxes.append(box)
+            box = amp.AmpBox()
+            continue
+        key = data[pos:pos + n]
+        (n,) = unpack(data, pos + n)
+        pos += len(key) + 2
+        box[key] = data[pos:pos + n]
+        pos += n
+    if box:
+        raise ValueError("Truncated AMP box")
+    return boxes
+
+
+def batchCommand(command):
+    """
+    The amp.Command that carries a batch of calls of `command`: the AMP box
+    of each call's arguments, one after another, answered with the box of
+    each one's response or error
+    """
+    if command not in _batchCommands:
+        class Batch(amp.Command):
+            commandName = command.commandName + b'.batch'
+            arguments = [(b'calls', ChunkedString())]
+            response = [(b'results', ChunkedString())]
+        _batchCommands[command] = Batch
+    return _batchCommands[command]
+
+
+def _errorBox(command, reason):
+    """
+    The box that answers one call of a batch that failed with `reason`
+    """
+    if reason.check(amp.RemoteAmpError):
+        # e.g. InvalidArgument, from parsing the arguments
+        code, description = reason.value.errorCode, reason.value.description
+    elif reason.check(*command.allErrors):
+        code = command.allErrors[reason.check(*command.allErrors)]
+        description = str(reason.value)
+    else:
+        log.err(reason, "Unhandled error in a batched %s" % command.__name__)
+        code, description = amp.UNKNOWN_ERROR_CODE, 'Unknown Error'
+    if isinstance(description, str):
+        description = description.encode('utf-8', 'replace')
+    return amp.AmpBox({amp.ERROR_CODE: code, amp.ERROR_DESCRIPTION: description})
+
+
+def _batchResponse(boxes):
+    """
+    The answer to a batch, from the response box of each call
+    """
+    return {'results': b''.join(box.serialize() for box in boxes)}
+
+
+def batchResponder(command):
+    """
+    Declare a method to be the responder to `command`, both for single calls
+    and for batches of them from a BatchingClient (decorator).
+
+    Each call in a batch is parsed with the command's own argument types, so
+    a schema rejects it with InvalidArgument as it would a single call. The
+    calls run at the same time, as if they had arrived one by one. One
+    failing does not fail the rest; its error is sent back as it would be
+    for a single call, except that no error drops the connection.
+    """
+    batch = batchCommand(command)
+
+    def decorate(methodfunc):
+        def respondOne(self, box):
+            """
+            The response box to one call, or a Deferred of it if the call is
+            asynchronous
+            """
+            try:
+                result = methodfunc(self, **command.parseArguments(box, self))
+                if not isinstance(result, defer.Deferred):
+                    return command.makeResponse(result, self)
+            except Exception:
+                return _errorBox(command, failure.Failure())
+            result.addCallback(command.makeResponse, self)
+            result.addErrback(lambda reason: _errorBox(command, reason))
+            return result
+
+        def respondBatch(self, calls):
+            boxes = [respondOne(self, box) for box in parseBoxes(calls)]
+            if any(isinstance(box, defer.Deferred) for box in boxes):
+                return defer.gatherResults([
+                    box if isinstance(box, defer.Deferred) else defer.succeed(box)
+                    for box in boxes]).addCallback(_batchResponse)
+            return _batchResponse(boxes)
+
+        command.responder(methodfunc)
+        batch.responder(respondBatch)
+        return methodfunc
+    return decorate
+
+
+@attr.s
+class BatchingClient(object):
+    """
+    Make calls of `command` on the AMP connection `proto` in batches.
+
+    Calls made within `window` seconds of the first one in a batch, up to
+    `maxCalls` of them, are sent together in one box and answered in one,
+    which the peer handles with batchResponder. Each call gets its own
+    Deferred, which fires like the one from proto.callRemote, and is encoded
+    with the command's own argument types.
+    """
+    proto = attr.ib()
+    command = attr.ib()
+    window = attr.ib(default=BATCH_WINDOW_SECONDS)
+    maxCalls = attr.ib(default=BATCH_MAX_CALLS)
+    _pending = attr.ib(default=attr.Factory(list), init=False, repr=False)
+    _timer = attr.ib(default=None, init=False, repr=False)
+
+    callLater = reactor.callLater
+
+    def callRemote(self, **kw):
+        """
+        Call `command` with the keyword arguments `kw` in the next batch
+        """
+        try:
+            data = self.command.makeArguments(kw, self.proto).serialize()
+        except Exception:
+            return defer.fail()
+        d = defer.Deferred()
+        self._pending.append((data, d))
+        if len(self._pending) >= self.maxCalls:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self.callLater(self.window, self.flush)
+        return d
+
+    def flush(self):
+        """
+        Send the calls waiting for a batch now
+        """
+        if self._timer is not None:
+            if self._timer.active():
+                self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        d = defer.maybeDeferred(self.proto.callRemote, batchCommand(self.command),
+                calls=b''.join(data for (data, _) in pending))
+        d.addCallback(lambda response: parseBoxes(response['results']))
+        d.addCallbacks(self._answered, self._failed,
+                callbackArgs=(pending,), errbackArgs=(pending,))
+
+    def _answered(self, boxes, pending):
+        for (_, d), box in zip(pending, boxes):
+            if amp.ERROR_CODE in box:
+                exceptionType = self.command.reverseErrors.get(
+                        box[amp.ERROR_CODE], amp.UnknownRemoteError)
+                d.errback(exceptionType(box[amp.ERROR_DESCRIPTION].decode(
+                    'utf-8', 'replace')))
+                continue
+            try:
+                response = self.command.parseResponse(box, self.proto)
+            except Exception:
+                d.errback()
+            else:
+                d.callback(response)
 
+    def _failed(self, reason, pending):
+        for (_, d) in pending:
+            d.errback(reason)
@@ -16,13 +16,15 @@ cfg = dict(
     url = 'https://github.com/corydodt/Codado',
     keywords = ['twisted', 'utility'],
     classifiers = [
-        "Programming Language :: Python :: 2",
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License"
     ],
+    # asyncio.get_running_loop and asyncio.run need 3.7, which CI no longer
+    # has; the oldest tested is 3.8
+    python_requires='>=3.8',
     scripts = ['bin/jentemplate'],
     install_requires=cleandoc('''
-        attrs>=17.1.0
+        attrs>=21.3.0
         crosscap
         jinja2
         mock
@@ -30,6 +32,7 @@ cfg = dict(
         pytz>=2015.4
         pyyaml
         twisted
+        zope.interface
         ''').split(),
     extras_require={
         'dev': [
@@ -40,9 +43,15 @@ cfg = dict(
             'pytest-twisted',
             'klein',
             'docker',
+            'msgpack',
+            'orjson',
             'wrapt',
             'wheel',
-        ]
+        ],
+        'fast': [
+            'msgpack',
+            'orjson',
+        ],
     },
     zip_safe=False,
 )